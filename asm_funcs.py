@@ -1,14 +1,14 @@
 import os
+import re
+import hashlib
+import shutil
+import subprocess
+import threading
 
-SYMBOLID = 0
+# Only changed while the module is imported.  Everything that changes while compiling belongs to an Assembler.
 VALID_SYMBOL_LIST = []
-def NEXT_SYMBOLID():
-	global SYMBOLID
-	SYMBOLID += 1
-	return SYMBOLID
 def SymbolDef(display_string):
-	global VALID_SYMBOL_LIST
-	a = (NEXT_SYMBOLID(), display_string)
+	a = (len(VALID_SYMBOL_LIST) + 1, display_string)
 	VALID_SYMBOL_LIST.append(a)
 	return a
 
@@ -22,9 +22,25 @@ SYMBOL_STRING = SymbolDef("STRING")
 SYMBOL_STRING_PTR = SymbolDef("STRINGPTR")
 SYMBOL_CONCAT = SymbolDef("CONCAT")
 
+# A String is a length byte followed by up to FREDSTRINGSIZE (255) characters, see fredstringmacro.inc
+STRING_STORAGE_SIZE = 256
+
+# The global String variables live side by side in this one block of the .bss section
+STRING_ARENA_LABEL = "fredstringarena"
+
 def DEBUG_SYMBOLDISPLAY(symboldatatype): # pragma: no cover
 	return symboldatatype[1]
 
+def realLiteralToNASM(value):
+	# NASM needs a period in a floating point constant, else it reads 1e+16 as an integer expression
+	ret = repr(float(value))
+	if not ("." in ret):
+		if "e" in ret:
+			ret = ret.replace("e", ".0e")
+		else: # pragma: no cover
+			ret += ".0"
+	return ret
+
 def intParameterPositionToRegister(pos):
 	# First six integer parameters to functions are stored in registers.
 	# This function converts the position in the function parameter list to a register
@@ -54,32 +70,16 @@ def realParameterPositionToRegister(pos):
 		raise ValueError ("Invalid Parameter Position " + str(pos))
 	return ret
 
+# a Pascal comment inside the source code of a statement.  One that is not closed runs to the end.
+PASCAL_COMMENT_REGEX = re.compile(r"\{[^}]*\}?")
+
 def codeToASMComment(code):
 	# takes a block of code and converts it to a comment that can be added to the line in the assembly
-	# remove newlines
-	c = code.replace('\n','')
-	c = c.replace('\t','')
-	# remove comments
-	i = 0
-	c2 = ''
-	while i < len(c):
-		while c[i] != '{':
-			c2 += c[i]
-			i += 1
-			if i >= len(c):
-				return c2
-		while c[i] != '}':
-			i += 1
-			if i >= len(c):
-				return c2
-		if c[i] == '}':
-			i += 1
-			if i >= len(c):
-				return c2
-	return c2
+	# remove newlines and tabs, then the comments
+	return PASCAL_COMMENT_REGEX.sub('', code.replace('\n', '').replace('\t', ''))
 
 class SymbolData:
-	def __init__(self, type, global_label = None, local_rbp_offset = None, procFuncHeading = None):
+	def __init__(self, type, global_label = None, local_rbp_offset = None, procFuncHeading = None, register = None):
 		# these need to be set up here because the setter below for global_label tests existence of local_rbp_offset
 		# which isn't defined yet until the next line.
 		self.__global_label = None
@@ -94,6 +94,11 @@ class SymbolData:
 		self.global_label = global_label
 		self.local_rbp_offset = local_rbp_offset
 		self.procfuncheading = procFuncHeading
+		# a parameter that is never stored in memory is kept in the register it was passed in, e.g. "RDI".
+		self.register = register
+		# for procedures and functions: the parameter registers the compiled code may overwrite.  None until the
+		# procedure or function has been assembled, which means any of them.
+		self.clobbers = None
 
 	@property
 	def type(self):
@@ -133,7 +138,9 @@ class SymbolData:
 			self.__local_rbp_offset = l
 
 	def as_address(self):
-		if not self.local_rbp_offset is None:
+		if not self.register is None:
+			ret = self.register
+		elif not self.local_rbp_offset is None:
 			ret = "[RBP"
 			if self.local_rbp_offset > 0:
 				ret += '+'
@@ -157,6 +164,13 @@ class SymbolData:
 		return ret
 	
 
+	def clobbered_registers(self):
+		if self.clobbers is None:
+			ret = INT_PARAMETER_REGISTERS + REAL_PARAMETER_REGISTERS
+		else:
+			ret = self.clobbers
+		return ret
+
 	def isPointer(self):
 		if self.type in [SYMBOL_INTEGER_PTR, SYMBOL_REAL_PTR, SYMBOL_STRING_PTR]:
 			return True
@@ -173,10 +187,10 @@ class SymbolTable:
 		else:
 			return False
 
-	def insert(self, symbolname, symboltype, symbol_global_label = None, symbol_rbp_offset=None, procFuncHeading = None):
+	def insert(self, symbolname, symboltype, symbol_global_label = None, symbol_rbp_offset=None, procFuncHeading = None, symbol_register = None):
 		if self.exists(symbolname): # pragma: no cover
 			raise ValueError ("Duplicate symbol inserted :" + symbolname)
-		self.symbols[symbolname] = SymbolData(symboltype, symbol_global_label, symbol_rbp_offset, procFuncHeading)
+		self.symbols[symbolname] = SymbolData(symboltype, symbol_global_label, symbol_rbp_offset, procFuncHeading, symbol_register)
 
 	def get(self, symbolname):
 		if symbolname not in self.symbols: # pragma: no cover
@@ -190,27 +204,268 @@ class SymbolTable:
 	def symbollist(self):
 		return self.symbols.keys()
 
+# Write() and Writeln() go through a buffer in the runtime (fredoutput.asm).  When fully buffered, the buffer is
+# written when it fills and when the program ends.  When line buffered, it is also written after every newline,
+# which is what you want for a program whose output is watched as it runs.
+OUTPUT_FULLY_BUFFERED = "full"
+OUTPUT_LINE_BUFFERED = "line"
+
+# Registers that expression evaluation may keep intermediate results in, instead of pushing them on the stack.
+# All of them are caller-saved, so a value is never held in one of them across a procedure or function call.
+# None of them are used to pass parameters, so holding a value while parameters are being loaded is safe.
+EXPRESSION_INT_REGISTERS = ["R10", "R11"]
+EXPRESSION_XMM_REGISTERS = ["XMM8", "XMM9", "XMM10", "XMM11", "XMM12", "XMM13", "XMM14"]
+# never held; used for a single instruction sequence when an operator needs a register that is not XMM0
+XMM_SCRATCH_REGISTER = "XMM15"
+
+# Registers that pass the first six Integer and the first eight Real parameters to a procedure or function, in order.
+INT_PARAMETER_REGISTERS = ["RDI", "RSI", "RDX", "RCX", "R8", "R9"]
+REAL_PARAMETER_REGISTERS = ["XMM0", "XMM1", "XMM2", "XMM3", "XMM4", "XMM5", "XMM6", "XMM7"]
+
+# The parameter registers other than RDI and RSI (which are always saved around the call) that each runtime routine
+# called in the middle of an expression overwrites
+RUNTIME_CLOBBERS = {"copystring": ["RCX"], "concatstrings": ["RCX", "RDX", "R8", "R9"]}
+
+# The assembly is kept in a buffer of AsmLines until cleanup(), so that the peephole optimizer can rewrite it
+# before it is written out.
+ASMLINE_CODE = "code"
+ASMLINE_LABEL = "label"
+ASMLINE_COMMENT = "comment"
+ASMLINE_RAW = "raw"  # section directives and anything else the optimizer must not look past
+
+class AsmLine:
+	def __init__(self, kind, text, opcode = None, operands = None):
+		self.kind = kind
+		self.text = text  # the line as it is written to the .asm file
+		self.opcode = opcode  # upper case, for matching.  For labels, the label name.
+		self.operands = operands  # list of operand strings as emitted, for ASMLINE_CODE
+
+	def operand(self, pos):
+		# upper case, for matching
+		if self.operands is None or pos >= len(self.operands):
+			return None
+		return self.operands[pos].upper()
+
+	def isInstruction(self, opcode, numoperands = None):
+		if self.kind != ASMLINE_CODE or self.opcode != opcode:
+			return False
+		if numoperands is not None and (self.operands is None or len(self.operands) != numoperands):
+			return False
+		return True
+
+def parseAsmLine(s, comment):
+	# comment is the text that goes after the semicolon, as returned by codeToASMComment(), or None.
+	# Splits an instruction into opcode and operands.  Data definitions can contain commas inside quoted strings,
+	# so those lines keep all of their operands in one piece; no peephole rule matches them anyway.
+	parts = s.split(None, 1)
+	if len(parts) == 0:  # pragma: no cover
+		return AsmLine(ASMLINE_RAW, s)
+	opcode = parts[0].upper()
+	if len(parts) == 1:
+		operands = []
+	elif "`" in parts[1] or "'" in parts[1] or '"' in parts[1]:
+		operands = [parts[1]]
+	else:
+		operands = [x.strip() for x in parts[1].split(",")]
+	if comment is None:
+		text = '\t' + s
+	else:
+		text = '\t' + s + '\t\t;' + comment
+	return AsmLine(ASMLINE_CODE, text, opcode, operands)
+
+def newAsmInstruction(opcode, operands, comment = None):
+	if len(operands) == 0:
+		return parseAsmLine(opcode, comment)
+	return parseAsmLine(opcode + " " + ", ".join(operands), comment)
+
+
+# Peephole rules.  Each rule looks at a window of consecutive instructions and labels (comments in between are
+# skipped, and are kept in the output).  If the rule matches it returns the lines that replace the window, else
+# None.  The rules rely on how the code generator uses registers, e.g. that RAX is not read after an if or while
+# condition has been tested, so they are not safe for arbitrary assembly.
+PEEPHOLE_INT_REGISTERS = ["RAX", "RBX", "RCX", "RDX", "RSI", "RDI", "RBP", "R8", "R9", "R10", "R11", "R12", "R13", "R14", "R15"]
+
+# runtime routines that take no parameters, so a parameter register does not need to be valid when they are called
+PEEPHOLE_NO_PARAMETER_ROUTINES = ["NEWLINE", "FLUSHOUTPUT"]
+
+# jump taken when the condition of the key is false.  UCOMISD leaves ZF, PF and CF set for NaN, so JA/JBE and
+# JAE/JB are still exact opposites.
+INVERTED_JUMPS = {"JE": "JNE", "JNE": "JE", "JG": "JLE", "JLE": "JG", "JL": "JGE", "JGE": "JL",
+				  "JA": "JBE", "JBE": "JA", "JB": "JAE", "JAE": "JB"}
+
+def peepholePushPop(window, labelrefs):
+	# PUSH a / POP b is MOV b, a, or nothing at all if a is b
+	if window[0].isInstruction("PUSH", 1) and window[1].isInstruction("POP", 1):
+		source = window[0].operand(0)
+		dest = window[1].operand(0)
+		if source in PEEPHOLE_INT_REGISTERS and dest in PEEPHOLE_INT_REGISTERS:
+			if source == dest:
+				return []
+			else:
+				return [newAsmInstruction("MOV", [window[1].operands[0], window[0].operands[0]])]
+	return None
+
+def peepholePopPush(window, labelrefs):
+	# POP r / PUSH r puts the same value back on the stack, and only matters if r is read before the value is
+	# popped again.  This is what back-to-back write() parameters look like, each saving and restoring RDI.
+	if window[0].isInstruction("POP", 1) and window[1].isInstruction("PUSH", 1):
+		reg = window[0].operand(0)
+		if reg in PEEPHOLE_INT_REGISTERS and window[1].operand(0) == reg:
+			following = window[2]
+			if following.isInstruction("MOV", 2) and following.operand(0) == reg and not (reg in following.operand(1)):
+				return [following]
+			elif following.isInstruction("CALL", 1) and following.operand(0) in PEEPHOLE_NO_PARAMETER_ROUTINES:
+				return [following]
+	return None
+
+def peepholePushPopXMM(window, labelrefs):
+	# emitpushxmmreg() immediately followed by emitpopxmmreg()
+	if window[0].isInstruction("SUB", 2) and window[0].operand(0) == "RSP" and window[0].operand(1) == "16" and \
+			window[1].isInstruction("MOVDQU", 2) and window[1].operand(0) == "[RSP]" and \
+			window[2].isInstruction("MOVDQU", 2) and window[2].operand(1) == "[RSP]" and \
+			window[3].isInstruction("ADD", 2) and window[3].operand(0) == "RSP" and window[3].operand(1) == "16":
+		if window[1].operand(1) == window[2].operand(0):
+			return []
+		else:
+			return [newAsmInstruction("MOVAPD", [window[2].operands[0], window[1].operands[1]])]
+	return None
+
+def peepholeSelfMove(window, labelrefs):
+	if (window[0].isInstruction("MOV", 2) or window[0].isInstruction("MOVAPD", 2)) and window[0].operand(0) == window[0].operand(1):
+		return []
+	return None
+
+def peepholeJumpToNextLine(window, labelrefs):
+	if window[0].isInstruction("JMP", 1) and window[1].kind == ASMLINE_LABEL and window[1].opcode == window[0].operands[0]:
+		return [window[1]]
+	return None
+
+def peepholeBooleanBranch(window, labelrefs):
+	# A relational operator sets RAX to 0 or -1, then if/while tests RAX.  Jump on the inverted condition instead.
+	#     Jcc .true / MOV RAX, 0 / JMP .done / .true: / MOV RAX, -1 / .done: / CMP RAX, 0 / JE .false
+	# becomes
+	#     Jnotcc .false
+	w = window
+	if w[0].kind == ASMLINE_CODE and w[0].opcode in INVERTED_JUMPS and len(w[0].operands) == 1 and \
+			w[1].isInstruction("MOV", 2) and w[1].operand(0) == "RAX" and w[1].operand(1) == "0" and \
+			w[2].isInstruction("JMP", 1) and \
+			w[3].kind == ASMLINE_LABEL and w[3].opcode == w[0].operands[0] and labelrefs.get(w[3].opcode, 0) == 1 and \
+			w[4].isInstruction("MOV", 2) and w[4].operand(0) == "RAX" and w[4].operand(1) == "-1" and \
+			w[5].kind == ASMLINE_LABEL and w[5].opcode == w[2].operands[0] and labelrefs.get(w[5].opcode, 0) == 1 and \
+			w[6].isInstruction("CMP", 2) and w[6].operand(0) == "RAX" and w[6].operand(1) == "0" and \
+			w[7].isInstruction("JE", 1):
+		return [newAsmInstruction(INVERTED_JUMPS[w[0].opcode], [w[7].operands[0]])]
+	return None
+
+# (name, number of instructions and labels in the window, rule)
+PEEPHOLE_RULES = [("boolean branch", 8, peepholeBooleanBranch),
+				  ("push/pop xmm", 4, peepholePushPopXMM),
+				  ("pop/push", 3, peepholePopPush),
+				  ("push/pop", 2, peepholePushPop),
+				  ("jump to next line", 2, peepholeJumpToNextLine),
+				  ("self move", 1, peepholeSelfMove)]
+
+def countInstructions(lines):
+	ret = 0
+	for line in lines:
+		if line.kind == ASMLINE_CODE:
+			ret += 1
+	return ret
+
+def peepholeOptimize(lines, rules, removedcounts):
+	# One pass over lines.  Returns the new list of lines; removedcounts[rule name] is increased by the number
+	# of instructions each rule removed.
+	labelrefs = {}
+	for line in lines:
+		if line.kind == ASMLINE_CODE and line.opcode[0] == "J":
+			labelrefs[line.operands[0]] = labelrefs.get(line.operands[0], 0) + 1
+
+	ret = []
+	i = 0
+	while i < len(lines):
+		line = lines[i]
+		matched = False
+		if line.kind == ASMLINE_CODE:
+			# gather the window: instructions and labels, skipping comments, up to the next raw line
+			window = []
+			comments = []
+			j = i
+			while j < len(lines) and len(window) < 8 and lines[j].kind != ASMLINE_RAW:
+				if lines[j].kind == ASMLINE_COMMENT:
+					comments.append(lines[j])
+				else:
+					window.append(lines[j])
+				j += 1
+			for name, size, rule in rules:
+				if size > len(window):
+					continue
+				replacement = rule(window[:size], labelrefs)
+				if replacement is not None:
+					removedcounts[name] = removedcounts.get(name, 0) + countInstructions(window[:size]) - countInstructions(replacement)
+					# keep the comments that were inside the window, ahead of the replacement
+					k = i
+					seen = 0
+					while seen < size:
+						if lines[k].kind == ASMLINE_COMMENT:
+							ret.append(lines[k])
+						else:
+							seen += 1
+						k += 1
+					ret.extend(replacement)
+					i = k
+					matched = True
+					break
+		if not matched:
+			ret.append(line)
+			i += 1
+	return ret
+
 class Assembler:
-	def __init__(self, asm_filename):
-		self.asm_file = open(asm_filename, 'w')
+	def __init__(self, asm_filename, output_buffering = OUTPUT_FULLY_BUFFERED, peephole_rules = None, comments = True):
+		if output_buffering not in [OUTPUT_FULLY_BUFFERED, OUTPUT_LINE_BUFFERED]: # pragma: no cover
+			raise ValueError("Invalid output buffering mode: " + str(output_buffering))
+		self.output_buffering = output_buffering
+		self.asm_filename = asm_filename  # None if the object is built straight from the lines (see elf_funcs)
+		self.lines = []  # AsmLines, written to asm_filename by cleanup()
+		self.comments = comments  # False leaves the comments, including the source code of each statement, out of the assembly
+		self.asm_comments = {}  # comment -> the comment as it is written in the assembly, see asm_comment()
+		if peephole_rules is None:
+			peephole_rules = PEEPHOLE_RULES
+		self.peephole_rules = peephole_rules  # pass [] to turn the peephole optimizer off
+		self.peephole_removed = {}  # rule name -> number of instructions it removed
+		self.peephole_instructions_before = 0
+		self.peephole_instructions_after = 0
 		self.string_literals = {}
 		self.real_literals = {}
 		self.next_literal_index = 0
 		self.variable_symbol_table = SymbolTable()
 		self.next_variable_index = 0
 		self.next_local_label_index = 0
-
-	def emit(self, s):
-		self.asm_file.write(s)
+		self.concat_labels = []  # the main program's concat temp strings, shared by every statement (see AST.find_concat_node())
+		self.next_concat_index = 0  # the next of concat_labels for the statement being looked at to use
+		self.frame_sizes = []  # (name, bytes, Strings, String slots) for each procedure and function, see frame_report()
+		self.free_int_registers = list(EXPRESSION_INT_REGISTERS)
+		self.free_xmm_registers = list(EXPRESSION_XMM_REGISTERS)
+		self.held_operands = []  # stack of (operand, bytes of stack to release) for binary operators in progress
+		self.loaded_argument_registers = []  # parameter registers loaded for procedure/function calls in progress
 
 	def emitln(self, s):
-		self.emit(s + '\n')
+		self.lines.append(AsmLine(ASMLINE_RAW, s))
+
+	def asm_comment(self, comment):
+		# Returns the comment as it is written in the assembly, or None if it is left out.  The same comments come
+		# up again and again (e.g. "spill", or an if statement's source code before the THEN and the ELSE), so each
+		# is only converted once.
+		if comment is None or not self.comments:
+			return None
+		ret = self.asm_comments.get(comment)
+		if ret is None:
+			ret = codeToASMComment(comment)
+			self.asm_comments[comment] = ret
+		return ret
 
 	def emitcode(self, s, comment = None):
-		if comment is None:
-			self.emitln('\t' + s)
-		else:
-			self.emitln('\t' + s + '\t\t;' + codeToASMComment(comment))
+		self.lines.append(parseAsmLine(s, self.asm_comment(comment)))
 
 	def emitpushxmmreg(self, reg):
 		self.emitcode("SUB RSP, 16", "PUSH " + reg)
@@ -220,21 +475,91 @@ class Assembler:
 		self.emitcode("MOVDQU " + reg + ", [RSP]", "POP " + reg)
 		self.emitcode("ADD RSP, 16")
 
+	def hold_expression_result(self, isreal, mustspill):
+		# Keeps the value just computed in RAX (XMM0 if isreal) while the other operand of a binary operator is
+		# evaluated.  The value goes into a free register from the pool; it is spilled to the stack if the pool
+		# is exhausted, or if the caller says so because the other operand calls a procedure or function.
+		# Returns the operand (a register or "[RSP]") that refers to the held value until release_held_operand().
+		if isreal:
+			pool = self.free_xmm_registers
+		else:
+			pool = self.free_int_registers
+
+		if mustspill or len(pool) == 0:
+			if isreal:
+				self.emitpushxmmreg("XMM0")
+				self.held_operands.append(("[RSP]", 16))
+			else:
+				self.emitcode("PUSH RAX", "spill")
+				self.held_operands.append(("[RSP]", 8))
+			ret = "[RSP]"
+		else:
+			ret = pool.pop(0)
+			if isreal:
+				self.emitcode("MOVAPD " + ret + ", XMM0")
+			else:
+				self.emitcode("MOV " + ret + ", RAX")
+			self.held_operands.append((ret, 0))
+		return ret
+
+	def hold_direct_operand(self):
+		# The second operand of a binary operator is used straight from memory or as an immediate, so nothing is
+		# held.  Recorded so that every binary operator has exactly one entry to release.
+		self.held_operands.append((None, 0))
+
+	def release_held_operand(self):
+		operand, spillbytes = self.held_operands.pop()
+		if spillbytes > 0:
+			# LEA instead of ADD so the flags from a comparison survive
+			self.emitcode("LEA RSP, [RSP+" + str(spillbytes) + "]", "discard spilled operand")
+		elif operand in EXPRESSION_INT_REGISTERS:
+			self.free_int_registers.insert(0, operand)
+		elif operand in EXPRESSION_XMM_REGISTERS:
+			self.free_xmm_registers.insert(0, operand)
+
 	def emitsection(self,s):
 		self.emitln(s)
 
 	def emitlabel(self, s, comment = None):
+		comment = self.asm_comment(comment)
 		if comment is None:
-			self.emitln(s + ":")
+			self.lines.append(AsmLine(ASMLINE_LABEL, s + ":", s))
 		else:
-			self.emitln(s + ":\t\t\t;" + codeToASMComment(comment))
+			self.lines.append(AsmLine(ASMLINE_LABEL, s + ":\t\t\t;" + comment, s))
 
 	def emitcomment(self, comment):
+		comment = self.asm_comment(comment)
 		if comment is not None:
-			self.emitln('\t\t\t\t;' + codeToASMComment(comment))
+			self.lines.append(AsmLine(ASMLINE_COMMENT, '\t\t\t\t;' + comment))
+
+	def peephole_optimize(self):
+		# Rules can expose new matches for each other, so repeat until nothing changes.
+		self.peephole_instructions_before = countInstructions(self.lines)
+		if len(self.peephole_rules) > 0:
+			while True:
+				before = len(self.lines)
+				self.lines = peepholeOptimize(self.lines, self.peephole_rules, self.peephole_removed)
+				if len(self.lines) == before:
+					break
+		self.peephole_instructions_after = countInstructions(self.lines)
+
+	def peephole_report(self):
+		ret = "Peephole optimizer: " + str(self.peephole_instructions_before) + " instructions, "
+		ret += str(self.peephole_instructions_before - self.peephole_instructions_after) + " removed\n"
+		for name, size, rule in self.peephole_rules:
+			ret += "\t" + name + ": " + str(self.peephole_removed.get(name, 0)) + "\n"
+		return ret
+
+	def text(self):
+		return "\n".join([line.text for line in self.lines]) + "\n"
 
 	def cleanup(self):
-		self.asm_file.close()
+		self.peephole_optimize()
+		if not (self.asm_filename is None):
+			# one write for the whole file
+			asm_file = open(self.asm_filename, 'w')
+			asm_file.write(self.text())
+			asm_file.close()
 
 	def generate_literal_name(self, prefix):
 		ret = 'fredliteral' + prefix + str(self.next_literal_index)
@@ -251,57 +576,37 @@ class Assembler:
 		self.next_local_label_index += 1
 		return ret
 
-	def preserve_xmm_registers_for_procfunc_call(self, num_registers):
-		if num_registers > 8: # pragma: no cover
-			raise ValueError ("Cannot preserve more than 8 XMM registers")
-		i = 0
-		while i < num_registers:
-			if i==0:
-				pass # can't preserve XMM0 as it will be used for the return value
+	def preserve_registers_for_procfunc_call(self, registers):
+		# registers is the list of parameter registers that hold a value the caller still needs after the call
+		# and that the call may overwrite.  They are pushed in order and popped back in reverse.
+		for reg in registers:
+			if reg[:3] == "XMM":
+				self.emitpushxmmreg(reg)
 			else:
-				self.emitpushxmmreg("XMM" + str(i))
-			i += 1
+				self.emitcode("PUSH " + reg)
 
-	def restore_xmm_registers_after_procfunc_call(self, num_registers):
-		if num_registers > 8: # pragma: no cover
-			raise ValueError ("Cannot restore more than 8 XMM registers")
-		i = num_registers - 1;
-		while i >= 0:
-			if i==0:
-				pass # don't restore XMM0 as it will have the return value if it is a real function
+	def restore_registers_after_procfunc_call(self, registers):
+		for reg in reversed(registers):
+			if reg[:3] == "XMM":
+				self.emitpopxmmreg(reg)
 			else:
-				self.emitpopxmmreg("XMM" + str(i))
-			i -= 1
-
-	def preserve_int_registers_for_procfunc_call(self, num_registers):
-		# push the rdi, rsi, rdx, rcx, r8, and r9
-		if num_registers >= 1:
-			self.emitcode("PUSH RDI")
-			if num_registers >= 2:
-				self.emitcode("PUSH RSI")
-				if num_registers >= 3:
-					self.emitcode("PUSH RDX")
-					if num_registers >= 4:
-						self.emitcode("PUSH RCX")
-						if num_registers >= 5:
-							self.emitcode("PUSH R8")
-							if num_registers >= 6:
-								self.emitcode("PUSH R9")
-
-	def restore_int_registers_after_procfunc_call(self, num_registers):
-
-		if num_registers >=6:
-			self.emitcode("POP R9")
-		if num_registers >=5:
-			self.emitcode("POP R8")
-		if num_registers >=4:
-			self.emitcode("POP RCX")
-		if num_registers >=3:
-			self.emitcode("POP RDX")
-		if num_registers >=2:
-			self.emitcode("POP RSI")
-		if num_registers >=1:
-			self.emitcode("POP RDI")
+				self.emitcode("POP " + reg)
+
+	def preserve_loaded(self, registers, live = None):
+		# registers are the parameter registers that a call, a runtime routine or an instruction is about to
+		# overwrite.  Saves the ones that hold an argument already loaded for an enclosing call (e.g. RDI in
+		# f(a, g(b)) or RDX in f(a, b, c, d mod e)), or that are in live.  Returns them, for restore_loaded().
+		if live is None:
+			live = []
+		saved = []
+		for register in INT_PARAMETER_REGISTERS + REAL_PARAMETER_REGISTERS:
+			if register in registers and (register in self.loaded_argument_registers or register in live):
+				saved.append(register)
+		self.preserve_registers_for_procfunc_call(saved)
+		return saved
+
+	def restore_loaded(self, saved):
+		self.restore_registers_after_procfunc_call(saved)
 
 
 	def emit_copyliteraltostring(self, stringaddress, literalvalue):
@@ -312,6 +617,7 @@ class Assembler:
 			self.emit_copystring(stringaddress, data_name)
 
 	def emit_copystring(self, destinationstringaddress, sourcestringaddress):
+		saved = self.preserve_loaded(RUNTIME_CLOBBERS["copystring"])
 		self.emitcode("push rdi")
 		self.emitcode("push rsi")
 		self.emitcode("mov rdi, " + destinationstringaddress)
@@ -319,25 +625,22 @@ class Assembler:
 		self.emitcode("call copystring")
 		self.emitcode("pop rsi")
 		self.emitcode("pop rdi")
+		self.restore_loaded(saved)
 
-	def emit_stringconcatliteral(self, stringaddress, literalvalue):
-		if not (literalvalue in self.string_literals):  # pragma: no cover
-			raise ValueError("No literal for string :" + literalvalue)
-		else:
-			data_name = self.string_literals[literalvalue]
-			self.emit_stringconcatstring(stringaddress, data_name)
-
-	def emit_stringconcatstring(self, destinationstringaddress, sourcestringaddress):
+	def emit_concatstrings(self, destinationstringaddress, numstrings):
+		# The addresses of the numstrings Strings to concatenate have been pushed on the stack, in order.  Takes
+		# them back off, and leaves the address of the destination String in RAX.
+		saved = self.preserve_loaded(RUNTIME_CLOBBERS["concatstrings"])
 		self.emitcode("push rdi")
 		self.emitcode("push rsi")
 		self.emitcode("mov rdi, " + destinationstringaddress)
-		self.emitcode("mov rsi, " + sourcestringaddress)
-		self.emitcode("call stringconcatstring")
+		self.emitcode("lea rsi, [rsp+" + str(16 + 8 * len(saved)) + "]")
+		self.emitcode("mov rdx, " + str(numstrings))
+		self.emitcode("call concatstrings")
 		self.emitcode("pop rsi")
 		self.emitcode("pop rdi")
-
-	def setup_macros(self):
-		self.emitcode('%include "fredstringmacro.inc"')
+		self.restore_loaded(saved)
+		self.emitcode("add rsp, " + str(8 * numstrings))
 
 	def setup_bss(self):
 		if len(self.variable_symbol_table.symbollist()) > 0:
@@ -348,6 +651,25 @@ class Assembler:
 					self.emitcode(symbol.global_label + " resq 1", "global variable " + key)  # 8-byte / 64-bit int or float
 				elif symbol.type == SYMBOL_CONCAT:
 					self.emitcode(symbol.global_label + " resq 1", "global concat")
+			# The .bss section starts out zeroed, so every String in the arena starts out empty
+			numstrings = self.count_global_strings()
+			if numstrings > 0:
+				self.emitcode(STRING_ARENA_LABEL + " resb " + str(numstrings * STRING_STORAGE_SIZE), "storage for the global String variables and concats")
+
+	def count_global_strings(self):
+		ret = 0
+		for key in self.variable_symbol_table.symbollist():
+			if self.variable_symbol_table.get(key).type in [SYMBOL_STRING, SYMBOL_CONCAT]:
+				ret += 1
+		return ret
+
+	def frame_report(self):
+		# The stack frame each procedure and function needs, and how many 256-byte slots its Strings share
+		ret = "Stack frames:\n"
+		for name, numbytes, numstrings, numslots in self.frame_sizes:
+			ret += "\t" + name + ": " + str(numbytes) + " bytes, " + str(numstrings) + " String(s) in " + str(numslots) + " slot(s)\n"
+		ret += "\tmain program: " + str(len(self.concat_labels)) + " concat temp String(s) in .bss\n"
+		return ret
 
 
 	def setup_data(self):
@@ -358,7 +680,7 @@ class Assembler:
 					raise ValueError("String literals must be 255 characters max.  Invalid literal: " + key)
 				self.emitcode(self.string_literals[key] + ' db ' + str(len(key)) + ',`' + key.replace('`','\\`') + '`, 0')
 			for key in self.real_literals.keys():
-				self.emitcode(self.real_literals[key] + ' dq ' + str(key))
+				self.emitcode(self.real_literals[key] + ' dq ' + realLiteralToNASM(key))
 
 	def setup_text(self):
 		self.emitcode("global main")
@@ -367,64 +689,141 @@ class Assembler:
 		self.emitcode("extern newline","imported from nsm64")
 		self.emitcode("extern exit","imported from nsm64")
 
-		self.emitcode("extern newstring","imported from fredstringfunc")
-		self.emitcode("extern freestring","imported from fredstringfunc")
 		self.emitcode("extern copystring","imported from fredstringfunc")
 		self.emitcode("extern printstring","imported from fredstringfunc")
 		self.emitcode("extern stringlength","imported from fredstringfunc")
-		self.emitcode("extern stringconcatstring","imported from fredstringfunc")
-		self.emitcode("extern copystring", "imported from fredstringfunc")
+		self.emitcode("extern concatstrings","imported from fredstringfunc")
+
+		self.emitcode("extern flushoutput", "imported from fredoutput")
+		self.emitcode("extern fredoutputlinebuffered", "imported from fredoutput")
 
 		self.emitsection("section .text")
 
 	def setup_start(self):
 		self.emitlabel("main")
-		# Before we do anything else, we are going to allocate space for any global-space CONCAT() calls.
-		# Doing anything with PUSH or POP messes up these allocations so by doing them first, I ensure there
-		# are no stack calls.  The ASM function newstring messes with the stack, so it is safer to do two trips through
-		# the symbollist.
-		for key in self.variable_symbol_table.symbollist():
-			symbol = self.variable_symbol_table.get(key)
-			if symbol.type == SYMBOL_CONCAT:
-				self.emitcode("NEWSTACKSTRING", "allocate stack space for concat " + key)
-				self.emitcode("mov " + symbol.as_address() + ", rax")
-		# need to init all the global string variables
+		if self.output_buffering == OUTPUT_LINE_BUFFERED:
+			self.emitcode("mov byte [fredoutputlinebuffered], 1", "flush output after every newline")
+		# point each global string variable, and each concat temp string, at its storage in the arena.  Nothing
+		# is allocated, so nothing needs to be freed at the end.
+		first = True
 		for key in self.variable_symbol_table.symbollist():
 			symbol = self.variable_symbol_table.get(key)
-			if symbol.type == SYMBOL_STRING:
-				self.emitcode("call newstring","initialize String variable " + key)
-				self.emitcode("mov " + symbol.as_address() + ", rax")
+			if symbol.type in [SYMBOL_STRING, SYMBOL_CONCAT]:
+				if first:
+					self.emitcode("mov rax, " + STRING_ARENA_LABEL)
+					first = False
+				else:
+					self.emitcode("add rax, " + str(STRING_STORAGE_SIZE))
+				self.emitcode("mov " + symbol.as_address() + ", rax", "initialize String variable " + key)
 
 	def emit_terminate(self):
-		# need to free all the global string variables
-		for key in self.variable_symbol_table.symbollist():
-			symbol = self.variable_symbol_table.get(key)
-			if symbol.type == SYMBOL_STRING:
-				self.emitcode("mov rdi, " + symbol.as_address(), "free String variable " + key)
-				self.emitcode("call freestring")
+		self.emitcode("call flushoutput", "write anything still in the output buffer")
 		self.emitcode("call exit")
 
 
+# Flags passed to nasm for every object we build.  Need to make debug symbols a flag but for now this will work
+NASM_FLAGS = "-f elf64 -F dwarf -g"
+
+# The runtime objects (nsm64.o and fredstringfunc.o) only change when their sources change, so they are assembled
+# once into this directory and reused by every subsequent compile.
+RUNTIME_CACHE_DIR = ".fredcache"
+
+# The runtime sources and fredstringmacro.inc live next to this file, wherever the compiler is run from
+RUNTIME_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+NASM_INCLUDE_FLAGS = "-I" + RUNTIME_SOURCE_DIR + os.sep
+
+# Each runtime object, the source assembled to create it, and the include files that source pulls in.
+RUNTIME_OBJECTS = [("nsm64.o", "nsm64.asm", ["nobjlist.inc"]),
+				   ("fredstringfunc.o", "fredstringfunc.asm", ["fredstringmacro.inc"]),
+				   ("fredoutput.o", "fredoutput.asm", [])]
+
+def nasm_version():
+	try:
+		ret = subprocess.run(["nasm", "-v"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode().strip()
+	except OSError: # pragma: no cover
+		ret = "nasm not found"
+	return ret
+
+class RuntimeObjectCache:
+	def __init__(self, cache_dir = RUNTIME_CACHE_DIR, flags = NASM_FLAGS):
+		self.cache_dir = cache_dir
+		self.flags = flags
+		self.version = None  # looked up the first time a key is needed; nasm is not re-run on every compile
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()  # compilations in several threads can share a cache
+
+	def key(self, asm_filename, include_filenames):
+		# The key covers everything that can change the bytes of the object: the source, the files it includes,
+		# the assembler version and the flags.
+		if self.version is None:
+			self.version = nasm_version()
+		h = hashlib.sha256()
+		h.update(self.version.encode())
+		h.update(self.flags.encode())
+		for filename in [asm_filename] + include_filenames:
+			f = open(os.path.join(RUNTIME_SOURCE_DIR, filename), 'rb')
+			h.update(f.read())
+			f.close()
+		return h.hexdigest()
+
+	def fetch(self, obj_filename, asm_filename, include_filenames, directory = "."):
+		# Places an up-to-date obj_filename in directory, assembling it only on a cache miss.  Returns the name of
+		# the object in the cache; if directory is None, it is only put there.
+		with self.lock:
+			cached_filename = os.path.join(self.cache_dir, obj_filename[:-2] + "-" + self.key(asm_filename, include_filenames) + ".o")
+			if os.path.exists(cached_filename):
+				self.hits += 1
+			else:
+				self.misses += 1
+				os.makedirs(self.cache_dir, exist_ok = True)
+				# assemble to a temp name first, so that an interrupted build never leaves a bad object in the cache.
+				# The name is unique to the process and thread, in case another cache shares the directory.
+				temp_filename = cached_filename + ".tmp" + str(os.getpid()) + "-" + str(threading.get_ident())
+				os.system("nasm " + self.flags + " " + NASM_INCLUDE_FLAGS + " -o " + temp_filename + " " + os.path.join(RUNTIME_SOURCE_DIR, asm_filename))
+				if not os.path.exists(temp_filename): # pragma: no cover
+					raise ValueError("Unable to assemble runtime file " + asm_filename)
+				os.replace(temp_filename, cached_filename)
+		if not (directory is None):
+			shutil.copyfile(cached_filename, os.path.join(directory, obj_filename))
+		return cached_filename
+
+	def fetch_all(self, directory = "."):
+		# Returns the names of the objects in the cache, which the Linker can use straight from there
+		ret = []
+		for obj_filename, asm_filename, include_filenames in RUNTIME_OBJECTS:
+			ret.append(self.fetch(obj_filename, asm_filename, include_filenames, directory))
+		return ret
+
+# shared by every Compiler that is not given its own cache, so the nasm version is only looked up once per process
+DEFAULT_RUNTIME_CACHE = RuntimeObjectCache()
+
 class Compiler:
-	def __init__(self, asm_filename, obj_filename):
+	def __init__(self, asm_filename, obj_filename, runtime_cache = None, runtime_directory = "."):
 		self.asm_filename = asm_filename
 		self.obj_filename = obj_filename
+		if runtime_cache is None:
+			runtime_cache = DEFAULT_RUNTIME_CACHE
+		self.runtime_cache = runtime_cache
+		self.runtime_directory = runtime_directory  # where the runtime objects are copied for the Linker; None links them from the cache
+		self.runtime_obj_filenames = None  # the runtime objects in the cache, once do_compile() has run
 
 	def do_compile(self):
-		# os.system("nasm -f elf64 -o nsm64.o nsm64.asm")
 		# os.system("nasm -f elf64 -o " + self.obj_filename + " " + self.asm_filename)
-		# Need to make debug symbols a flag but for now this will work
-		os.system("nasm -f elf64 -F dwarf -g -o nsm64.o nsm64.asm")
-		os.system("nasm -f elf64 -F dwarf -g -o fredstringfunc.o fredstringfunc.asm")
-		os.system("nasm -f elf64 -F dwarf -g -o " + self.obj_filename + " " + self.asm_filename)
+		self.runtime_obj_filenames = self.runtime_cache.fetch_all(self.runtime_directory)
+		os.system("nasm " + NASM_FLAGS + " " + NASM_INCLUDE_FLAGS + " -o " + self.obj_filename + " " + self.asm_filename)
 
 class Linker:
-	def __init__(self, obj_filename, exe_filename):
+	def __init__(self, obj_filename, exe_filename, runtime_obj_filenames = None):
 		self.obj_filename = obj_filename
 		self.exe_filename = exe_filename
+		if runtime_obj_filenames is None:
+			# copied into the current directory by the Compiler
+			runtime_obj_filenames = [x[0] for x in RUNTIME_OBJECTS]
+		self.runtime_obj_filenames = runtime_obj_filenames
 
 	def do_link(self):
-		os.system("gcc -no-pie " + self.obj_filename + " nsm64.o fredstringfunc.o -o " + self.exe_filename)
+		os.system("gcc -no-pie " + self.obj_filename + " " + " ".join(self.runtime_obj_filenames) + " -o " + self.exe_filename)
 
 
 
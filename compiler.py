@@ -1,20 +1,23 @@
 import sys
+import os
+import math
+import re
+import shutil
+import tempfile
+import time
 import asm_funcs
+import elf_funcs
 
-TOKENID = 0
-VALID_TOKEN_LIST = []
-def NEXT_TOKENID():
-	global TOKENID
-	TOKENID += 1
-	return TOKENID
+# Filled in once, when the module is imported, and never changed after that, so any number of compilations can
+# share it.  The next token type is one more than the number defined so far.
+TOKEN_DISPLAY = {}  # token type -> string to print when debugging.  Also the set of valid token types.
 def TokDef(display_string):
-	global VALID_TOKEN_LIST
-	a = (NEXT_TOKENID(), display_string)
-	VALID_TOKEN_LIST.append(a)
+	a = len(TOKEN_DISPLAY) + 1
+	TOKEN_DISPLAY[a] = display_string
 	return a
 
-# constants for token types - give each token type unique id and a string to print when debugging.
-# we could extend to using namedtuples later if we want to use this for pattern matching
+# constants for token types - each token type is a unique small integer, so comparing and validating them is cheap.
+# The string to print when debugging is in TOKEN_DISPLAY.
 TOKEN_INT = TokDef("INT")
 TOKEN_REAL = TokDef("REAL")
 TOKEN_STRING = TokDef("STRING")
@@ -67,21 +70,26 @@ TOKEN_VARIABLE_TYPE_STRING = TokDef("VARIABLE TYPE: String")
 TOKEN_PROCEDURE_CALL = TokDef("Procedure Call")
 
 TOKEN_NOOP = TokDef("NO-OP")
+TOKEN_EOF = TokDef("End of input")  # returned by TokenStream.peek() past the last token
+
+# These are not real tokens either.  fold_constants_node() replaces Integer multiplication, DIV and MOD by a power of two
+# with them; the second child is an Integer literal holding the number of bits to shift.
+TOKEN_SHIFT_LEFT = TokDef("SHL")
+TOKEN_SHIFT_DIV = TokDef("DIV by shifting")
+TOKEN_MASK_MOD = TokDef("MOD by masking")
+
+RELOP_TOKEN_TYPES = frozenset([TOKEN_RELOP_EQUALS, TOKEN_RELOP_GREATER, TOKEN_RELOP_LESS, TOKEN_RELOP_GREATEREQ, TOKEN_RELOP_LESSEQ, TOKEN_RELOP_NOTEQ])
+MATHOP_TOKEN_TYPES = frozenset([TOKEN_PLUS, TOKEN_MINUS, TOKEN_MULT, TOKEN_DIV, TOKEN_IDIV, TOKEN_MOD])
 
 def DEBUG_TOKENDISPLAY(tokentype): # pragma: no cover
-	return tokentype[1]
+	return TOKEN_DISPLAY[tokentype]
 
 
-EXPRESSIONID = 0
-VALID_EXPRESSIONTYPE_LIST = []
-def NEXT_EXPRESSIONID():
-	global EXPRESSIONID
-	EXPRESSIONID += 1
-	return EXPRESSIONID
+# Like TOKEN_DISPLAY, only changed while the module is imported
+EXPRESSIONTYPE_DISPLAY = {}  # expression type -> string to print when debugging.  Also the set of valid expression types.
 def ExpressionDef(display_string):
-	global VALID_EXPRESSION_LIST
-	a = (NEXT_EXPRESSIONID(), display_string)
-	VALID_EXPRESSIONTYPE_LIST.append(a)
+	a = len(EXPRESSIONTYPE_DISPLAY) + 1
+	EXPRESSIONTYPE_DISPLAY[a] = display_string
 	return a
 
 EXPRESSIONTYPE_NONE = ExpressionDef("")
@@ -89,13 +97,51 @@ EXPRESSIONTYPE_INT = ExpressionDef("Expressiontype: Integer")
 EXPRESSIONTYPE_REAL = ExpressionDef("Expressiontype: Real")
 EXPRESSIONTYPE_STRING = ExpressionDef("Expressiontype: String")
 
+NUMERIC_EXPRESSIONTYPES = (EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL)
+PLUS_EXPRESSIONTYPES = (EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL, EXPRESSIONTYPE_STRING)
+VARIABLE_TYPE_EXPRESSIONTYPES = {TOKEN_VARIABLE_TYPE_INTEGER: EXPRESSIONTYPE_INT, TOKEN_VARIABLE_TYPE_REAL: EXPRESSIONTYPE_REAL, TOKEN_VARIABLE_TYPE_STRING: EXPRESSIONTYPE_STRING}
+
 def DEBUG_EXPRESSIONTYPEDISPLAY(expressiontype): # pragma: no cover
-	return expressiontype[1]
+	return EXPRESSIONTYPE_DISPLAY[expressiontype]
 
 
 
 
 # helper functions
+def wrapInteger(value):
+	# Integers are 64-bit two's complement at runtime, so arithmetic done at compile time wraps the same way.
+	value = value & 0xFFFFFFFFFFFFFFFF
+	if value >= 0x8000000000000000:
+		value -= 0x10000000000000000
+	return value
+
+def isIntegerInRange(value):
+	if value >= -0x8000000000000000 and value <= 0x7FFFFFFFFFFFFFFF:
+		return True
+	else:
+		return False
+
+def powerOfTwoExponent(value):
+	# returns k if value == 2^k for k >= 1, else None
+	if value >= 2 and (value & (value - 1)) == 0:
+		return value.bit_length() - 1
+	else:
+		return None
+
+def runSteps(steps, childsteps):
+	# Runs a pass over the AST with an explicit stack instead of recursion.  steps is a generator for one node that
+	# yields each child which has to be processed before it can go on; childsteps(child) returns the generator for
+	# that child, or None if there is nothing more to do for it.
+	stack = [steps]
+	while len(stack) > 0:
+		child = next(stack[-1], None)
+		if child is None:
+			stack.pop()  # that node is done
+		else:
+			nextsteps = childsteps(child)
+			if not (nextsteps is None):
+				stack.append(nextsteps)
+
 def isSymbol(char):
 	if char in ["-", "+", "(", ")", "*", "/", ";", ".", ":", "=", "<", ">", ',']:
 		return True
@@ -163,9 +209,17 @@ def isSymbol(char):
 
 
 class Token:
-	def __init__(self, type, value):
-		self.type = type
+	# Large programs have hundreds of thousands of Tokens, so they have no per-instance __dict__
+	__slots__ = ("__type", "value", "start", "end")
+
+	def __init__(self, type, value, start = None, end = None):
+		if not (type in TOKEN_DISPLAY): # pragma: no cover
+			raise ValueError("Invalid Token Type")
+		self.__type = type
 		self.value = value
+		# where the token is in the source text, for tokens that came from the Tokenizer
+		self.start = start
+		self.end = end
 
 	@property
 	def type(self):
@@ -173,16 +227,16 @@ class Token:
 
 	@type.setter
 	def type(self, t):
-		if t in VALID_TOKEN_LIST:
+		if t in TOKEN_DISPLAY:
 			self.__type = t
 		else: # pragma: no cover
 			raise ValueError("Invalid Token Type")
 
 	def isRelOp(self):
-		if self.type in [TOKEN_RELOP_EQUALS, TOKEN_RELOP_GREATER, TOKEN_RELOP_LESS, TOKEN_RELOP_GREATEREQ, TOKEN_RELOP_LESSEQ, TOKEN_RELOP_NOTEQ]:
-			return True
-		else:
-			return False
+		return self.__type in RELOP_TOKEN_TYPES
+
+	def isMathOp(self):
+		return self.__type in MATHOP_TOKEN_TYPES
 
 	def isReservedFunction(self):
 		if self.type == TOKEN_CONCAT:
@@ -225,13 +279,24 @@ class ProcFuncParameter:
 			return False
 
 class ProcFuncHeading:
+	# Besides the list of parameters, keeps dicts that are filled in as the parameters and local variables are added,
+	# so that looking up a name, a parameter's position or register, or the number of parameters of a type does not
+	# have to go through all of them.
 	def __init__(self, name):
 		self.name = name
-		self.parameters = []  # will be a list of ProcFuncParameters
+		self.parameters = []  # will be a list of ProcFuncParameters.  Add them with addParameter().
+		self.parametersbyname = {}  # parameter name -> ProcFuncParameter
+		self.parameterpositions = {}  # parameter name -> position in parameters
+		self.parameterregisters = {}  # parameter name -> register it is passed in
+		self.parametercounts = {}  # token variable type -> count, as returned by getParameterCountByType()
+		self.intparameters = 0
+		self.realparameters = 0
 		self.localvariableAST = None
 		self.localvariableSymbolTable = None
-		self.returnAddress = None  # will be a string with an address offset, typically "[RBP-8]"
+		self.resultAddress = None  # will be a string with an address offset, typically "[RBP-8]", or a register
 		self.returntype = None  # will be a token variable type e.g. TOKEN_VARIABLE_TYPE_INTEGER
+		self.readonlystringparameters = set()  # byval String parameters that are not copied, see AST.find_string_changes()
+		self.changescallerstrings = False  # True if calling it may change a String that the caller can see
 
 	@property
 	def returntype(self):
@@ -248,38 +313,63 @@ class ProcFuncHeading:
 		else: # pragma: no cover
 			raise ValueError("Invalid Return Type: " + rt)
 
-
+	@property
+	def localvariableAST(self):
+		return self.__localvariableAST
+
+	@localvariableAST.setter
+	def localvariableAST(self, ast):
+		self.__localvariableAST = ast
+		self.localvariabletypes = {}  # local variable name -> token variable type
+		if not (ast is None):
+			for localvar in ast.children:
+				if not (localvar.token.value in self.localvariabletypes):
+					self.localvariabletypes[localvar.token.value] = localvar.token.type
+
+	def addParameter(self, param):
+		# if a name is used twice, the first parameter with that name is the one that is found
+		if not (param.name in self.parametersbyname):
+			self.parametersbyname[param.name] = param
+			self.parameterpositions[param.name] = len(self.parameters)
+		self.parameters.append(param)
+
+		if param.isIntegerParameterType():
+			self.intparameters += 1
+			register = asm_funcs.intParameterPositionToRegister(self.intparameters)
+		else:
+			self.realparameters += 1
+			register = asm_funcs.realParameterPositionToRegister(self.realparameters)
+		if not (param.name in self.parameterregisters):
+			self.parameterregisters[param.name] = register
+
+		self.parametercounts[param.type] = self.parametercounts.get(param.type, 0) + 1
+		if param.type != TOKEN_VARIABLE_TYPE_INTEGER and param.byref == True:
+			# byref parameters count as integer type
+			self.parametercounts[TOKEN_VARIABLE_TYPE_INTEGER] = self.parametercounts.get(TOKEN_VARIABLE_TYPE_INTEGER, 0) + 1
+
+	def mayShareString(self, name1, name2):
+		# True if the String variables with these names, used in this procedure or function, may be the same String.
+		# Each local variable and copied byval parameter is a String of its own, but a byref parameter, or a byval
+		# parameter that is only read and so is not copied, may be any global String or any other such parameter.
+		if name1 == name2:
+			return True
+		byref = False
+		numshared = 0
+		for name in [name1, name2]:
+			param = self.parametersbyname.get(name)
+			if not (param is None):
+				if param.byref or name in self.readonlystringparameters:
+					byref = True
+					numshared += 1
+			elif not (name in self.localvariabletypes):
+				numshared += 1  # a global variable
+		return byref and numshared == 2
 
 	def getParameterPos(self, paramName):
-		ret = None
-		i = 0
-		while i < len(self.parameters):
-			if self.parameters[i].name == paramName:
-				ret = i
-				break
-			i += 1
-		return ret
-
+		return self.parameterpositions.get(paramName)
 
 	def getRegisterForParameterName(self, paramName):
-		ret = None
-		intargs = 0
-		realargs = 0
-		i = 0
-		while i < len(self.parameters):
-			sp = self.parameters[i]
-			if sp.isIntegerParameterType():
-				intargs += 1
-				if sp.name == paramName:
-					ret = asm_funcs.intParameterPositionToRegister(intargs)
-					break
-			else:
-				realargs += 1
-				if sp.name == paramName:
-					ret = asm_funcs.realParameterPositionToRegister(realargs)
-					break
-			i += 1
-		return ret
+		return self.parameterregisters.get(paramName)
 
 	def getIntegerParameterCount(self):
 		return self.getParameterCountByType(TOKEN_VARIABLE_TYPE_INTEGER)
@@ -288,28 +378,227 @@ class ProcFuncHeading:
 		return self.getParameterCountByType(TOKEN_VARIABLE_TYPE_REAL)
 
 	def getParameterCountByType(self, type):
-		ret = 0
-		i = 0
-		while i < len(self.parameters):
-			if self.parameters[i].type == type:
-				ret += 1
-			elif self.parameters[i].type != TOKEN_VARIABLE_TYPE_INTEGER and type == TOKEN_VARIABLE_TYPE_INTEGER and self.parameters[i].byref == True:
-				# byref parameters count as integer type
-				ret += 1
-			i += 1
-		return ret
+		return self.parametercounts.get(type, 0)
 
 	def getParameterByPos(self, pos):
 		if pos < 0 or pos >= len(self.parameters): # pragma: no cover
 			raise ValueError("Invlalid parameter number: " + str(pos))
 		return self.parameters[pos]
 
+class RegisterUsage:
+	# Used while walking the body of a procedure or function in the order the generated code runs (see
+	# AST.track_register_usage()) to find out which parameters can stay in the register they were passed in,
+	# instead of being copied to the stack.  A parameter can stay in its register if it is never read after that
+	# register was overwritten, and its address is never taken.
+	def __init__(self, procFuncHeading):
+		self.parameterregisters = {}  # parameter name -> register, for the parameters that could stay in one
+		self.pointerparameters = []
+		self.passedin = []  # the registers of all the parameters
+		self.unusedparameters = {}  # parameter name -> register, until the parameter is referenced
+		self.localnames = set()
+		for param in procFuncHeading.parameters:
+			register = procFuncHeading.getRegisterForParameterName(param.name)
+			self.passedin.append(register)
+			self.localnames.add(param.name)
+			# String parameters are copied to the stack: a byval String that is written to gets its own copy there
+			# anyway.  One that is only read is just a pointer, like an Integer.  Every Real expression is computed
+			# in XMM0, so the first Real parameter cannot stay there.
+			inregister = param.type != TOKEN_VARIABLE_TYPE_STRING or param.name in procFuncHeading.readonlystringparameters
+			if inregister:
+				self.unusedparameters[param.name] = register
+			if inregister and register != "XMM0":
+				self.parameterregisters[param.name] = register
+				if param.byref:
+					self.pointerparameters.append(param.name)
+		self.localnames.update(procFuncHeading.localvariabletypes)
+
+		self.clobbered = set()  # registers that no longer hold the value they were passed in with
+		self.everclobbered = set()  # registers overwritten anywhere in the body
+		self.conflicts = set()  # registers read after they were overwritten
+		self.escaped = set()  # parameters whose address is passed to another procedure or function
+		self.assigned = set()  # parameters that are assigned to
+		self.makescalls = False
+
+		# Each use of a parameter and each call gets the next position.  A parameter whose last use comes after a
+		# call is live across that call.
+		self.position = 0
+		self.lastuse = {}  # parameter name -> position of its last use
+		self.callpositions = {}  # AST of the call -> position of the call
+
+	def use(self, name):
+		self.unusedparameters.pop(name, None)
+		self.position += 1
+		self.lastuse[name] = self.position
+		if name in self.parameterregisters and self.parameterregisters[name] in self.clobbered:
+			self.conflicts.add(self.parameterregisters[name])
+
+	def assign(self, name):
+		self.use(name)
+		self.assigned.add(name)
+
+	def take_address(self, name):
+		self.unusedparameters.pop(name, None)
+		if name in self.pointerparameters:
+			self.use(name)  # the pointer itself is passed on
+		elif name in self.parameterregisters:
+			self.escaped.add(name)
+
+	def clobber(self, registers):
+		self.clobbered.update(registers)
+		self.everclobbered.update(registers)
+
+	def clobber_all(self):
+		# the runtime String routines do not preserve any of the parameter registers
+		self.clobber(asm_funcs.INT_PARAMETER_REGISTERS + asm_funcs.REAL_PARAMETER_REGISTERS)
+		self.makescalls = True
+
+	def call(self, node, clobberedbefore, calleeclobbers):
+		# A parameter that stays in a register and is still needed after a call is saved around the call (see
+		# assembleProcFuncInvocation()), so for the parameters the call changes nothing.  The other registers the
+		# callee overwrites are lost.
+		self.clobber(calleeclobbers)
+		for register in self.parameterregisters.values():
+			if register in clobberedbefore:
+				self.clobbered.add(register)
+			else:
+				self.clobbered.discard(register)
+		self.makescalls = True
+		self.position += 1
+		if not (node in self.callpositions):
+			# a call in a loop is walked twice; uses before it in the loop body come after its first position
+			self.callpositions[node] = self.position
+
+	def mark_live_registers(self):
+		# Once it is known which parameters stay in registers, records on each call the registers holding a
+		# parameter that is used after the call.
+		for node in self.callpositions:
+			node.liveregisters = []
+			for name in self.parameterregisters:
+				register = self.registerparameter(name)
+				if not (register is None) and self.lastuse.get(name, 0) > self.callpositions[node]:
+					node.liveregisters.append(register)
+
+	def clobbers(self, resultregister):
+		# The parameter registers the procedure or function may overwrite, for its callers.
+		ret = []
+		for register in asm_funcs.INT_PARAMETER_REGISTERS + asm_funcs.REAL_PARAMETER_REGISTERS:
+			if register in self.everclobbered or register == resultregister or register == "XMM0":
+				ret.append(register)
+			else:
+				for name in self.assigned:
+					if self.registerparameter(name) == register:
+						ret.append(register)
+						break
+		return ret
+
+	def registerparameter(self, name):
+		# Returns the register a parameter stays in, or None if it needs to be copied to the stack.  A parameter
+		# that is never referenced is left where it was passed in.
+		ret = None
+		if name in self.unusedparameters:
+			ret = self.unusedparameters[name]
+		elif name in self.parameterregisters and not (name in self.escaped):
+			if not (self.parameterregisters[name] in self.conflicts):
+				ret = self.parameterregisters[name]
+		return ret
+
+	def resultregister(self, returntype):
+		# A function result can be kept in a parameter register that no parameter uses and that nothing in the
+		# body overwrites - in practice, only in functions that do not call anything.
+		if returntype == TOKEN_VARIABLE_TYPE_REAL:
+			candidates = asm_funcs.REAL_PARAMETER_REGISTERS[1:]
+		else:
+			candidates = asm_funcs.INT_PARAMETER_REGISTERS
+		ret = None
+		for register in candidates:
+			if not (register in self.everclobbered) and not (register in self.passedin):
+				ret = register
+				break
+		return ret
+
+
+class StringLifetimes:
+	# Used while walking the body of a procedure or function (see AST.find_string_lifetimes()) to find out when
+	# each String that needs a slot on the stack is live, so that Strings that are never live at the same time can
+	# share one.  The statements, and the conditions of the IFs and WHILEs, are numbered in the order they appear,
+	# starting from 1.  A concat()'s temp string is only live during the statement that uses it.  A local variable
+	# is live from its first use to its last, stretched to cover any WHILE loop it is used in.  A local variable
+	# whose first use is not an assignment that always runs, and does not read the variable, must start out empty,
+	# so it is live from the start (position 0).
+	def __init__(self, procFuncHeading, names):
+		self.procFuncHeading = procFuncHeading
+		self.names = names  # the String local variables
+		self.position = 0
+		self.lifetimes = {}  # local variable name -> [first position, last position]
+		self.concats = []  # (concat AST, position) for each concat that needs a temp string
+		self.loops = []  # [first position, last position] of each WHILE loop
+
+	def statement(self, node, conditional):
+		# node is a statement or a condition.  conditional is True if it is inside an IF or a WHILE.
+		self.position += 1
+		used = set()
+		stack = list(node.children)
+		while len(stack) > 0:
+			child = stack.pop()
+			stack.extend(child.children)
+			if child.token.type == TOKEN_CONCAT and not (child.token.value is False):
+				self.concats.append((child, self.position))
+			elif child.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION and child.token.value in self.names:
+				used.add(child.token.value)
+		if node.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT and node.token.value in self.names:
+			if not (node.token.value in self.lifetimes) and not conditional and not (node.token.value in used):
+				self.lifetimes[node.token.value] = [self.position, self.position]  # assigned before it is read
+			used.add(node.token.value)
+		for name in used:
+			if name in self.lifetimes:
+				self.lifetimes[name][1] = self.position
+			else:
+				self.lifetimes[name] = [0, self.position]
+
+	def stretch_over_loops(self):
+		# Only ever grows a lifetime, so repeating until nothing changes ends
+		changed = True
+		while changed:
+			changed = False
+			for lifetime in self.lifetimes.values():
+				for first, last in self.loops:
+					if lifetime[0] <= last and lifetime[1] >= first and (lifetime[0] > first or lifetime[1] < last):
+						lifetime[0] = min(lifetime[0], first)
+						lifetime[1] = max(lifetime[1], last)
+						changed = True
+
+
+def shareSlots(lifetimes):
+	# lifetimes is a list of (first, last) positions.  Returns the slot each one gets, numbered from 0, such that no
+	# two that overlap share a slot, and the number of slots.  Taking them in the order they start and reusing the
+	# first slot that is free again uses the fewest slots possible.
+	ret = [None] * len(lifetimes)
+	freeafter = []  # slot -> the last position it is in use
+	for i in sorted(range(len(lifetimes)), key = lambda i: lifetimes[i]):
+		first, last = lifetimes[i]
+		slot = 0
+		while slot < len(freeafter) and freeafter[slot] >= first:
+			slot += 1
+		if slot == len(freeafter):
+			freeafter.append(last)
+		else:
+			freeafter[slot] = last
+		ret[i] = slot
+	return (ret, len(freeafter))
+
+
 class AST():
+	# one AST per statement and expression node, so like Token these have no per-instance __dict__
+	__slots__ = ("token", "comment", "procFuncHeading", "__expressiontype", "containscall", "registersneeded", "liveregisters", "children")
+
 	def __init__(self, token, comment = None):
 		self.token = token
 		self.comment = comment # will get put on the line emitted in the assembly code if populated.
 		self.procFuncHeading = None  # only used for procs and funcs
-		self.expressiontype = EXPRESSIONTYPE_NONE # will be set during static type checking
+		self.__expressiontype = EXPRESSIONTYPE_NONE # will be set during static type checking
+		self.containscall = False  # will be set during static type checking - True if evaluating this calls any code
+		self.registersneeded = 1  # will be set during static type checking - Sethi-Ullman number of the expression
+		self.liveregisters = None  # for calls inside a proc/function: registers holding parameters needed after the call
 		self.children = []
 
 	@property
@@ -318,70 +607,153 @@ class AST():
 
 	@expressiontype.setter
 	def expressiontype(self, et):
-		if et in VALID_EXPRESSIONTYPE_LIST:
+		if et in EXPRESSIONTYPE_DISPLAY:
 			self.__expressiontype = et
 		else: # pragma: no cover
 			raise ValueError("Invalid Expressiontype")
 
 
-	def rpn_print(self, level = 0): # pragma: no cover
-		for x in self.children:
-			x.rpn_print(level + 1)
-		typestr = level * " "
-		if self.expressiontype != EXPRESSIONTYPE_NONE:
-			typestr += DEBUG_EXPRESSIONTYPEDISPLAY(self.expressiontype) + "|"
-		print(typestr + self.token.debugprint())
-
-	def find_literals(self,assembler):
-		if self.token.type == TOKEN_STRING_LITERAL:
-			if not (self.token.value in assembler.string_literals):
-				assembler.string_literals[self.token.value] = assembler.generate_literal_name('string')
-		elif self.token.type == TOKEN_REAL:
-			if not (self.token.value in assembler.real_literals):
-				assembler.real_literals[self.token.value] = assembler.generate_literal_name('real')
-		else:
-			for child in self.children:
-				child.find_literals(assembler)
-
-	def find_main_begin(self):
-		if self.token.type == TOKEN_BEGIN and self.token.value == True:
-			return self
-		else:
-			for child in self.children:
-				ret = child.find_main_begin()
-				if not ret is None:
-					if ret.token.type == TOKEN_BEGIN and ret.token.value == True:
-						return ret
-			return None
-
-	def find_procfunc_concats(self, localvarbytesneeded, procFuncHeading):
-		if self.token.type == TOKEN_CONCAT:
-			localvarbytesneeded += 8
-			# concats do not have brackets around value the way local variables do, because
-			# sometimes we use same assemble() code when it is a global var,
-			# so we always add the brackets when assembling.
-			self.token.value = 'fredconcat' + str(localvarbytesneeded)  # just needs to be unique
-			procFuncHeading.localvariableSymbolTable.insert(self.token.value, asm_funcs.SYMBOL_CONCAT, symbol_rbp_offset = (-1 * localvarbytesneeded))
-		for child in self.children:
-			localvarbytesneeded = child.find_procfunc_concats(localvarbytesneeded, procFuncHeading)
-
-		return localvarbytesneeded
-
+	# The passes over the AST keep their own stack of nodes instead of recursing, because a long chain such as
+	# a+b+c+... is parsed into a tree as deep as the chain is long, and would exceed Python's recursion limit.
 
-	def find_concats(self, assembler):
-		# concat needs stack space allocated for each invocation.  If we add other reserved
-		# functions with same requirements, we can rename this method.
-		if self.token.type == TOKEN_CONCAT:
-			concat_label = assembler.generate_variable_name("concat")
-			self.token.value = concat_label
-			assembler.variable_symbol_table.insert(concat_label, asm_funcs.SYMBOL_CONCAT, symbol_global_label = concat_label)
+	def rpn_print(self): # pragma: no cover
+		stack = [(self, 0, False)]
+		while len(stack) > 0:
+			node, level, childrendone = stack.pop()
+			if childrendone:
+				typestr = level * " "
+				if node.expressiontype != EXPRESSIONTYPE_NONE:
+					typestr += DEBUG_EXPRESSIONTYPEDISPLAY(node.expressiontype) + "|"
+				print(typestr + node.token.debugprint())
+			else:
+				stack.append((node, level, True))
+				for child in reversed(node.children):
+					stack.append((child, level + 1, False))
 
-		# concat can take the results of a concat as a parameter, so we have to look within the
-		# children of the concat as well.  Thus, cannot do an "else" here.
+	def find_literals_node(self, assembler, procFuncHeading):
+		# A node registers the literals among its children once they are folded, so literals that folding
+		# removes never get registered.  The program itself is never a literal.
 		for child in self.children:
-			child.find_concats(assembler)
+			if child.token.type == TOKEN_STRING_LITERAL:
+				if not (child.token.value in assembler.string_literals):
+					assembler.string_literals[child.token.value] = assembler.generate_literal_name('string')
+			elif child.token.type == TOKEN_REAL:
+				if not (child.token.value in assembler.real_literals):
+					assembler.real_literals[child.token.value] = assembler.generate_literal_name('real')
+
+	def find_string_lifetimes(self, lifetimes):
+		# Walks the body of a procedure or function, recording in lifetimes (a StringLifetimes) where each String local
+		# variable and concat temp string is live.  Also finds the concats that need no temp string at all.
+		stack = [(self, False)]  # (AST, whether it is inside an IF or WHILE), or (None, a WHILE loop) at the end of a loop
+		while len(stack) > 0:
+			node, conditional = stack.pop()
+			if node is None:
+				conditional[1] = lifetimes.position
+			elif node.token.type == TOKEN_BEGIN:
+				for child in reversed(node.children):
+					stack.append((child, conditional))
+			elif node.token.type == TOKEN_IF:
+				lifetimes.statement(node.children[0], conditional)
+				for child in reversed(node.children[1:]):
+					stack.append((child, True))
+			elif node.token.type == TOKEN_WHILE:
+				loop = [lifetimes.position + 1, None]
+				lifetimes.loops.append(loop)
+				lifetimes.statement(node.children[0], True)
+				stack.append((None, loop))
+				stack.append((node.children[1], True))
+			else:
+				if node.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT and node.assignsConcatInPlace(lifetimes.procFuncHeading):
+					node.children[0].token.value = False  # no temp string, see assignsConcatInPlace()
+				lifetimes.statement(node, conditional)
+		lifetimes.stretch_over_loops()
+
+	def assignsConcatInPlace(self, procFuncHeading):
+		# True if this assigns a concat() to a variable that none of the concat's arguments after the first can be.
+		# The concat is then built in the variable itself, instead of in a temp string that is copied to the variable.
+		# The first argument may be the variable, as the runtime appends to the String in place.
+		concat = self.children[0]
+		if concat.token.type != TOKEN_CONCAT:
+			return False
+		for child in concat.children[1:]:
+			if child.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION:
+				if procFuncHeading is None:
+					if child.token.value == self.token.value:
+						return False
+				elif procFuncHeading.mayShareString(child.token.value, self.token.value):
+					return False
+		return True
 
-	def find_global_variable_declarations(self, assembler):
+	def find_string_changes(self, assembler, procFuncHeading):
+		# Walks the body of a procedure or function to find the byval String parameters that it only reads.  Those
+		# are not copied on entry, so they point to the caller's String, which is only safe if nothing in the body can
+		# change that String either: no global String or byref String parameter is assigned or passed byref, and
+		# nothing called may change a String its caller can see.  Procedures and functions are assembled in the order
+		# they are declared, so everything this one calls, other than itself, has already been walked.
+		changed = set()  # names that are assigned or passed byref
+		callschanger = False
+		stack = [self]
+		while len(stack) > 0:
+			node = stack.pop()
+			stack.extend(node.children)
+			if node.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT:
+				changed.add(node.token.value)
+			elif node.token.type in [TOKEN_PROCEDURE_CALL, TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION]:
+				if node.token.value in procFuncHeading.parametersbyname or node.token.value in procFuncHeading.localvariabletypes:
+					continue
+				symbol = assembler.variable_symbol_table.get(node.token.value)
+				if symbol.type in [asm_funcs.SYMBOL_FUNCTION, asm_funcs.SYMBOL_PROCEDURE]:
+					if symbol.procfuncheading.changescallerstrings:
+						callschanger = True
+					i = 0
+					while i < len(node.children):
+						if symbol.procfuncheading.getParameterByPos(i).byref:
+							changed.add(node.children[i].token.value)
+						i += 1
+
+		procFuncHeading.changescallerstrings = callschanger
+		for name in changed:
+			param = procFuncHeading.parametersbyname.get(name)
+			if not (param is None):
+				if param.byref and param.type == TOKEN_VARIABLE_TYPE_STRING:
+					procFuncHeading.changescallerstrings = True
+			elif not (name in procFuncHeading.localvariabletypes):
+				if assembler.variable_symbol_table.get(name).type == asm_funcs.SYMBOL_STRING:
+					procFuncHeading.changescallerstrings = True
+
+		procFuncHeading.readonlystringparameters = set()
+		if not procFuncHeading.changescallerstrings:
+			for param in procFuncHeading.parameters:
+				if param.type == TOKEN_VARIABLE_TYPE_STRING and not param.byref and not (param.name in changed):
+					procFuncHeading.readonlystringparameters.add(param.name)
+
+	def find_concat_node(self, assembler, procFuncHeading):
+		# concat needs a temp string for each invocation.  If we add other reserved
+		# functions with same requirements, we can rename this method.  Concats in the main
+		# program get a global; the ones in procedures and functions are found by find_string_lifetimes().
+		# A temp string is only used during the statement that has the concat, so every statement starts again
+		# from the first global, and the program needs as many as its statement with the most concats.
+		# An assignment is visited before the concat it assigns, so that a concat that is built in place gets nothing.
+		if procFuncHeading is None:
+			if self.token.type != TOKEN_CONCAT:
+				assembler.next_concat_index = 0
+				if self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT and self.assignsConcatInPlace(procFuncHeading):
+					self.children[0].token.value = False  # no temp string
+				return
+			if self.token.value is False:
+				return
+			if assembler.next_concat_index == len(assembler.concat_labels):
+				concat_label = assembler.generate_variable_name("concat")
+				assembler.concat_labels.append(concat_label)
+				assembler.variable_symbol_table.insert(concat_label, asm_funcs.SYMBOL_CONCAT, symbol_global_label = concat_label)
+			self.token.value = assembler.concat_labels[assembler.next_concat_index]
+			assembler.next_concat_index += 1
+
+	def find_global_variable_declaration_node(self, assembler, procFuncHeading):
+		if procFuncHeading is None:
+			self.declare_global_variable(assembler)
+
+	def declare_global_variable(self, assembler):
 		# local variables are not part of the main AST.  They are attached to the procFuncHeading
 		# as the localVariableAST.
 		if self.token.type == TOKEN_VARIABLE_TYPE_INTEGER:
@@ -409,17 +781,118 @@ class AST():
 				raise ValueError("Variable redefined: " + self.procFuncHeading.name)
 			else:
 				assembler.variable_symbol_table.insert(self.procFuncHeading.name, asm_funcs.SYMBOL_PROCEDURE, symbol_global_label = assembler.generate_variable_name("proc"), procFuncHeading = self.procFuncHeading)
+
+	def typeCheckIntegerLiteral(self, assembler, parentProcFuncHeading, etype0, etype1):
+		self.expressiontype = EXPRESSIONTYPE_INT
+
+	def typeCheckRealLiteral(self, assembler, parentProcFuncHeading, etype0, etype1):
+		self.expressiontype = EXPRESSIONTYPE_REAL
+
+	def typeCheckString(self, assembler, parentProcFuncHeading, etype0, etype1):
+		self.expressiontype = EXPRESSIONTYPE_STRING
+		if self.token.type == TOKEN_CONCAT:
+			self.containscall = True
+
+	def typeCheckPlus(self, assembler, parentProcFuncHeading, etype0, etype1):
+		# validation check
+		if etype0 not in PLUS_EXPRESSIONTYPES:  # pragma: no cover
+			raise ValueError("Invalid type for first operand")
+		if etype1 not in PLUS_EXPRESSIONTYPES:  # pragma: no cover
+			raise ValueError("Invalid type for second operand")
+		if (etype0 == EXPRESSIONTYPE_STRING or etype1 == EXPRESSIONTYPE_STRING) and etype0 != etype1:  # pragma: no cover
+			raise ValueError("Cannot mix String and numeric types for this operator")
+		if etype0 == EXPRESSIONTYPE_STRING and etype1 == EXPRESSIONTYPE_STRING:
+			self.expressiontype = EXPRESSIONTYPE_STRING
+		elif etype0 == EXPRESSIONTYPE_INT and etype1 == EXPRESSIONTYPE_INT:
+			self.expressiontype = EXPRESSIONTYPE_INT
 		else:
-			for child in self.children:
-				child.find_global_variable_declarations(assembler)
+			self.expressiontype = EXPRESSIONTYPE_REAL
 
-	def static_type_check(self, assembler, parentProcFuncHeading = None):
-		for child in self.children:
-			if not self.procFuncHeading is None:
-				child.static_type_check(assembler, self.procFuncHeading)
-			else:
-				child.static_type_check(assembler, parentProcFuncHeading)
+	def typeCheckMinusOrMult(self, assembler, parentProcFuncHeading, etype0, etype1):
+		# validation check
+		if etype0 not in NUMERIC_EXPRESSIONTYPES: # pragma: no cover
+			raise ValueError ("Invalid type for first operand")
+		if etype1 not in NUMERIC_EXPRESSIONTYPES: # pragma: no cover
+			raise ValueError ("Invalid type for second operand")
+		if etype0 == EXPRESSIONTYPE_INT and etype1 == EXPRESSIONTYPE_INT:
+			self.expressiontype = EXPRESSIONTYPE_INT
+		else:
+			self.expressiontype = EXPRESSIONTYPE_REAL
 
+	def typeCheckIntegerDivision(self, assembler, parentProcFuncHeading, etype0, etype1):
+		if etype0 != EXPRESSIONTYPE_INT: # pragma: no cover
+			raise ValueError ("First operand of DIV or MOD must be an Integer.")
+		if etype1 != EXPRESSIONTYPE_INT: # pragma: no cover
+			raise ValueError ("Second operand of DIV or MOD must be an Integer.")
+		self.expressiontype = EXPRESSIONTYPE_INT
+
+	def typeCheckDivide(self, assembler, parentProcFuncHeading, etype0, etype1):
+		self.expressiontype = EXPRESSIONTYPE_REAL
+
+	def typeCheckVariable(self, assembler, parentProcFuncHeading, etype0, etype1):
+		# A name is looked up in the procedure or function first: its parameters, then its own name when its result
+		# is assigned, then its local variables.  If it is none of those it is global.  Each of these is a dict.
+		foundit = False
+		if not parentProcFuncHeading is None:
+			param = parentProcFuncHeading.parametersbyname.get(self.token.value)
+			if not (param is None):
+				self.expressiontype = VARIABLE_TYPE_EXPRESSIONTYPES[param.type]
+				foundit = True
+			elif self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT and self.token.value == parentProcFuncHeading.name:
+				foundit = True
+				if parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
+					self.expressiontype = EXPRESSIONTYPE_INT
+					for child in self.children:
+						if child.expressiontype == EXPRESSIONTYPE_REAL: # pragma: no cover
+							raise ValueError("Cannot assign real value as return type to function " + parentProcFuncHeading.name)
+				elif parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_REAL:
+					self.expressiontype = EXPRESSIONTYPE_REAL
+				elif parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_STRING:
+					self.expressiontype = EXPRESSIONTYPE_STRING
+				else: # pragma: no cover
+					raise ValueError("Invalid return type from function + " + parentProcFuncHeading.name)
+			else:
+				# Note - parentProcFuncHeading.localvariableSymbolTable is not yet built when this code is running.
+				localtype = parentProcFuncHeading.localvariabletypes.get(self.token.value)
+				if not (localtype is None):
+					self.expressiontype = VARIABLE_TYPE_EXPRESSIONTYPES[localtype]
+					foundit = True
+
+		if foundit == False:
+			myvar = None
+			if myvar is None:
+				myvar = assembler.variable_symbol_table.get(self.token.value)
+			if myvar.type == asm_funcs.SYMBOL_INTEGER:
+				self.expressiontype = EXPRESSIONTYPE_INT
+			elif myvar.type == asm_funcs.SYMBOL_REAL:
+				self.expressiontype = EXPRESSIONTYPE_REAL
+			elif myvar.type == asm_funcs.SYMBOL_STRING:
+				self.expressiontype = EXPRESSIONTYPE_STRING
+			elif myvar.type == asm_funcs.SYMBOL_FUNCTION:
+				self.containscall = True
+				if myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
+					self.expressiontype = EXPRESSIONTYPE_INT
+				elif myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_REAL:
+					self.expressiontype = EXPRESSIONTYPE_REAL
+				elif myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_STRING:
+					self.expressiontype = EXPRESSIONTYPE_STRING
+				else: # pragma: no cover
+					raise ValueError ("Invalid Expression Type")
+
+	def typeCheckRelOp(self, assembler, parentProcFuncHeading, etype0, etype1):
+		if etype0 not in NUMERIC_EXPRESSIONTYPES: # pragma: no cover
+			raise ValueError ("Invalid type left of relational op")
+		if etype1 not in NUMERIC_EXPRESSIONTYPES: # pragma: no cover
+			raise ValueError ("Invalid type right of relational op")
+		if etype0 != etype1: # pragma: no cover
+			errstr = "Left of " + DEBUG_TOKENDISPLAY(self.token.type) + " type "
+			errstr += DEBUG_EXPRESSIONTYPEDISPLAY(etype0)
+			errstr += ", right has type " + DEBUG_EXPRESSIONTYPEDISPLAY(etype1)
+			raise ValueError (errstr)
+		self.expressiontype = etype0
+
+	def type_check_node(self, assembler, parentProcFuncHeading):
+		# Children are checked before their parent.  Checking a node only looks at its children and the symbols.
 		# Just to save some typing
 		etype0 = None
 		etype1 = None
@@ -428,320 +901,581 @@ class AST():
 		if len(self.children) >= 1:
 			etype0 = self.children[0].expressiontype
 
-		if self.token.type == TOKEN_INT:
-			self.expressiontype = EXPRESSIONTYPE_INT
+		checker = AST_TYPE_CHECKERS.get(self.token.type)
+		if not (checker is None):
+			checker(self, assembler, parentProcFuncHeading, etype0, etype1)
+
+		for child in self.children:
+			if child.containscall:
+				self.containscall = True
+
+		if self.token.type in REGISTERS_NEEDED_TOKEN_TYPES:
+			self.computeRegistersNeeded()
+
+	def computeRegistersNeeded(self):
+		# Sethi-Ullman numbering: the number of registers needed to evaluate this expression without spilling.
+		# If one operand needs more registers than the other, evaluating it first means the other can be
+		# evaluated with what is left over; if both need the same number, one more register is needed to
+		# hold the first result.
+		if self.children[0].registersneeded == self.children[1].registersneeded:
+			self.registersneeded = self.children[0].registersneeded + 1
+		else:
+			self.registersneeded = max(self.children[0].registersneeded, self.children[1].registersneeded)
+
+	def isNumericLiteral(self):
+		if self.token.type == TOKEN_INT and isIntegerInRange(self.token.value):
+			return True
 		elif self.token.type == TOKEN_REAL:
-			self.expressiontype = EXPRESSIONTYPE_REAL
-		elif self.token.type in [TOKEN_STRING, TOKEN_STRING_LITERAL, TOKEN_CONCAT]:
-			self.expressiontype = EXPRESSIONTYPE_STRING
-		elif self.token.type == TOKEN_PLUS:
-			# validation check
-			if etype0 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL, EXPRESSIONTYPE_STRING]:  # pragma: no cover
-				raise ValueError("Invalid type for first operand")
-			if etype1 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL, EXPRESSIONTYPE_STRING]:  # pragma: no cover
-				raise ValueError("Invalid type for second operand")
-			if (etype0 == EXPRESSIONTYPE_STRING or etype1 == EXPRESSIONTYPE_STRING) and etype0 != etype1:  # pragma: no cover
-				raise ValueError("Cannot mix String and numeric types for this operator")
-			if etype0 == EXPRESSIONTYPE_STRING and etype1 == EXPRESSIONTYPE_STRING:
-				self.expressiontype = EXPRESSIONTYPE_STRING
-			elif etype0 == EXPRESSIONTYPE_INT and etype1 == EXPRESSIONTYPE_INT:
-				self.expressiontype = EXPRESSIONTYPE_INT
+			return True
+		else:
+			return False
+
+	def replaceWithLiteral(self, value):
+		if self.expressiontype == EXPRESSIONTYPE_INT:
+			self.token = Token(TOKEN_INT, value)
+		else:
+			self.token = Token(TOKEN_REAL, value)
+		self.children = []
+		self.containscall = False
+		self.registersneeded = 1
+
+	def replaceWithNode(self, node):
+		self.token = node.token
+		self.children = node.children
+		self.expressiontype = node.expressiontype
+		self.containscall = node.containscall
+		self.registersneeded = node.registersneeded
+
+	def foldLiteralOperands(self):
+		# Both children are literals.  Returns True if the operation was done at compile time.
+		leftvalue = self.children[0].token.value
+		rightvalue = self.children[1].token.value
+		if self.expressiontype == EXPRESSIONTYPE_INT:
+			if self.token.type == TOKEN_PLUS:
+				result = leftvalue + rightvalue
+			elif self.token.type == TOKEN_MINUS:
+				result = leftvalue - rightvalue
+			elif self.token.type == TOKEN_MULT:
+				result = leftvalue * rightvalue
+			elif rightvalue == 0 or (leftvalue == -0x8000000000000000 and rightvalue == -1):
+				return False  # leave the divide error for runtime
 			else:
-				self.expressiontype = EXPRESSIONTYPE_REAL
-		elif self.token.type in [TOKEN_MINUS, TOKEN_MULT]:
-			# validation check
-			if etype0 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL]: # pragma: no cover
-				raise ValueError ("Invalid type for first operand")
-			if etype1 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL]: # pragma: no cover
-				raise ValueError ("Invalid type for second operand")
-			if etype0 == EXPRESSIONTYPE_INT and etype1 == EXPRESSIONTYPE_INT:
-				self.expressiontype = EXPRESSIONTYPE_INT
+				# DIV truncates towards zero and the result of MOD has the sign of the dividend, as with IDIV
+				quotient = abs(leftvalue) // abs(rightvalue)
+				if (leftvalue < 0) != (rightvalue < 0):
+					quotient = -quotient
+				if self.token.type == TOKEN_IDIV:
+					result = quotient
+				else:
+					result = leftvalue - (rightvalue * quotient)
+			self.replaceWithLiteral(wrapInteger(result))
+			return True
+		else:
+			# Python floats are IEEE doubles and these operations are correctly rounded, same as ADDSD etc.
+			# Integer operands are converted the way CVTSI2SD would convert them.
+			leftvalue = float(leftvalue)
+			rightvalue = float(rightvalue)
+			if self.token.type == TOKEN_PLUS:
+				result = leftvalue + rightvalue
+			elif self.token.type == TOKEN_MINUS:
+				result = leftvalue - rightvalue
+			elif self.token.type == TOKEN_MULT:
+				result = leftvalue * rightvalue
+			elif rightvalue == 0.0:
+				return False
 			else:
-				self.expressiontype = EXPRESSIONTYPE_REAL
-		elif self.token.type in [TOKEN_IDIV, TOKEN_MOD]:
-			if etype0 != EXPRESSIONTYPE_INT: # pragma: no cover
-				raise ValueError ("First operand of DIV or MOD must be an Integer.")
-			if etype1 != EXPRESSIONTYPE_INT: # pragma: no cover
-				raise ValueError ("Second operand of DIV or MOD must be an Integer.")
-			self.expressiontype = EXPRESSIONTYPE_INT
-		elif self.token.type == TOKEN_DIV:
-			self.expressiontype = EXPRESSIONTYPE_REAL
-		elif self.token.type in [TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT, TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION]:
-			foundit = False
-			if not parentProcFuncHeading is None:
-				for param in parentProcFuncHeading.parameters:
-					if param.name == self.token.value:
-						if param.type == TOKEN_VARIABLE_TYPE_INTEGER:
-							self.expressiontype = EXPRESSIONTYPE_INT
-							foundit = True
-							break
-						elif param.type == TOKEN_VARIABLE_TYPE_REAL:
-							self.expressiontype = EXPRESSIONTYPE_REAL
-							foundit = True
-							break
-						elif param.type == TOKEN_VARIABLE_TYPE_STRING:
-							self.expressiontype = EXPRESSIONTYPE_STRING
-							foundit = True
-							break
-			if not foundit:
-				if not parentProcFuncHeading is None:
-					if self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT:
-						if self.token.value == parentProcFuncHeading.name:
-							foundit = True
-							if parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
-								self.expressiontype = EXPRESSIONTYPE_INT
-								for child in self.children:
-									if child.expressiontype == EXPRESSIONTYPE_REAL: # pragma: no cover
-										raise ValueError("Cannot assign real value as return type to function " + parentProcFuncHeading.name)
-							elif parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_REAL:
-								self.expressiontype = EXPRESSIONTYPE_REAL
-							elif parentProcFuncHeading.returntype == TOKEN_VARIABLE_TYPE_STRING:
-								self.expressiontype = EXPRESSIONTYPE_STRING
-							else: # pragma: no cover
-								raise ValueError("Invalid return type from function + " + parentProcFuncHeading.name)
-
-			if foundit == False:
-				if not parentProcFuncHeading is None:
-					# Note - parentProcFuncHeading.localvariableSymbolTable is not yet built when this code is running.
-					# So, we need to look at parentProcFuncHeading.localvariableAST to get the information we need.
-					if not parentProcFuncHeading.localvariableAST is None:
-						for localvar in parentProcFuncHeading.localvariableAST.children:
-							if localvar.token.value == self.token.value:
-								foundit = True
-								if localvar.token.type == TOKEN_VARIABLE_TYPE_INTEGER:
-									self.expressiontype = EXPRESSIONTYPE_INT
-								elif localvar.token.type == TOKEN_VARIABLE_TYPE_REAL:
-									self.expressiontype = EXPRESSIONTYPE_REAL
-								elif localvar.token.type == TOKEN_VARIABLE_TYPE_STRING:
-									self.expressiontype = EXPRESSIONTYPE_STRING
-								break
-
-			if foundit == False:
-				myvar = None
-				if myvar is None:
-					myvar = assembler.variable_symbol_table.get(self.token.value)
-				if myvar.type == asm_funcs.SYMBOL_INTEGER:
-					self.expressiontype = EXPRESSIONTYPE_INT
-				elif myvar.type == asm_funcs.SYMBOL_REAL:
-					self.expressiontype = EXPRESSIONTYPE_REAL
-				elif myvar.type == asm_funcs.SYMBOL_STRING:
-					self.expressiontype = EXPRESSIONTYPE_STRING
-				elif myvar.type == asm_funcs.SYMBOL_FUNCTION:
-					if myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
-						self.expressiontype = EXPRESSIONTYPE_INT
-					elif myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_REAL:
-						self.expressiontype = EXPRESSIONTYPE_REAL
-					elif myvar.procfuncheading.returntype == TOKEN_VARIABLE_TYPE_STRING:
-						self.expressiontype = EXPRESSIONTYPE_STRING
-					else: # pragma: no cover
-						raise ValueError ("Invalid Expression Type")
-		elif self.token.isRelOp():
-			if etype0 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL]: # pragma: no cover
-				raise ValueError ("Invalid type left of relational op")
-			if etype1 not in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL]: # pragma: no cover
-				raise ValueError ("Invalid type right of relational op")
-			if etype0 != etype1: # pragma: no cover
-				errstr = "Left of " + DEBUG_TOKENDISPLAY(self.token.type) + " type "
-				errstr += DEBUG_EXPRESSIONTYPEDISPLAY(etype0)
-				errstr += ", right has type " + DEBUG_EXPRESSIONTYPEDISPLAY(etype1)
-				raise ValueError (errstr)
-			self.expressiontype = etype0
+				result = leftvalue / rightvalue
+			# infinities and NaN cannot be written as literals, and -0.0 would be merged with 0.0 in the literal table
+			if math.isinf(result) or math.isnan(result) or (result == 0.0 and math.copysign(1.0, result) < 0):
+				return False
+			self.replaceWithLiteral(result)
+			return True
 
-	def assembleProcsAndFunctions(self, assembler):
-		if self.token.type in (TOKEN_FUNCTION, TOKEN_PROCEDURE):
-			# first six integer arguments are passed in RDI, RSI, RDX, RCX, R8, and R9 in that order
-			# first eight real arguments are passed in XMM0..XMM7
-			# integer return values are passed in RAX
-			# real return values are passed in XMM0
-
-			if self.token.type == TOKEN_FUNCTION:
-				s = "function"
+	def simplifyIntegerOperation(self):
+		# Algebraic identities and strength reduction for an Integer operator with at most one literal operand.
+		# An operand is only dropped if evaluating it cannot call anything.
+		left = self.children[0]
+		right = self.children[1]
+		leftvalue = None
+		rightvalue = None
+		if left.token.type == TOKEN_INT and left.isNumericLiteral():
+			leftvalue = left.token.value
+		if right.token.type == TOKEN_INT and right.isNumericLiteral():
+			rightvalue = right.token.value
+
+		if self.token.type == TOKEN_PLUS:
+			if rightvalue == 0:
+				self.replaceWithNode(left)
+			elif leftvalue == 0:
+				self.replaceWithNode(right)
+		elif self.token.type == TOKEN_MINUS:
+			if rightvalue == 0:
+				self.replaceWithNode(left)
+		elif self.token.type == TOKEN_MULT:
+			if leftvalue is not None and rightvalue is None:
+				# multiplication is commutative, and a literal has no side effects, so put the literal on the right
+				left, right = right, left
+				leftvalue, rightvalue = rightvalue, leftvalue
+			if rightvalue == 1:
+				self.replaceWithNode(left)
+			elif rightvalue == 0 and not left.containscall:
+				self.replaceWithLiteral(0)
+			elif rightvalue is not None and powerOfTwoExponent(rightvalue) is not None:
+				self.token = Token(TOKEN_SHIFT_LEFT, None)
+				self.children = [left, AST(Token(TOKEN_INT, powerOfTwoExponent(rightvalue)))]
+				self.children[1].expressiontype = EXPRESSIONTYPE_INT
+		elif self.token.type == TOKEN_IDIV:
+			if rightvalue == 1:
+				self.replaceWithNode(left)
+			elif rightvalue is not None and powerOfTwoExponent(rightvalue) is not None and rightvalue < 0x8000000000000000:
+				self.token = Token(TOKEN_SHIFT_DIV, None)
+				self.children = [left, AST(Token(TOKEN_INT, powerOfTwoExponent(rightvalue)))]
+				self.children[1].expressiontype = EXPRESSIONTYPE_INT
+		elif self.token.type == TOKEN_MOD:
+			if rightvalue == 1 and not left.containscall:
+				self.replaceWithLiteral(0)
+			elif rightvalue is not None and powerOfTwoExponent(rightvalue) is not None and rightvalue <= 0x80000000:
+				# the mask has to fit in a 32-bit immediate
+				self.token = Token(TOKEN_MASK_MOD, None)
+				self.children = [left, AST(Token(TOKEN_INT, powerOfTwoExponent(rightvalue)))]
+				self.children[1].expressiontype = EXPRESSIONTYPE_INT
+
+	def fold_constants_node(self, assembler, procFuncHeading):
+		# Optimization pass, run after type_check_node().  Operators whose operands are both literals are evaluated
+		# at compile time, Integer operations that cannot change the value (x+0, x-0, x*1, x DIV 1) are removed,
+		# x*0 and x MOD 1 become 0, and Integer multiplication, DIV and MOD by a power of two become shifts and masks.
+		# Real expressions are only folded when both operands are literals, so that the result is bit-for-bit what
+		# the program would have computed.  Children are folded before their parent.
+		if self.token.isMathOp() and self.expressiontype in [EXPRESSIONTYPE_INT, EXPRESSIONTYPE_REAL]:
+			folded = False
+			if self.children[0].isNumericLiteral() and self.children[1].isNumericLiteral():
+				folded = self.foldLiteralOperands()
+			if not folded and self.expressiontype == EXPRESSIONTYPE_INT:
+				self.simplifyIntegerOperation()
+
+		# operands that call something are never removed, so containscall is still correct
+		if self.token.isMathOp() or self.token.isRelOp() or self.token.type in [TOKEN_SHIFT_LEFT, TOKEN_SHIFT_DIV, TOKEN_MASK_MOD]:
+			self.computeRegistersNeeded()
+
+	def evaluatesRightOperandFirst(self):
+		# Evaluate the operand that needs more registers first.  Only done when neither operand calls anything,
+		# so that procedures and functions with side effects are still invoked left to right.
+		left = self.children[0]
+		right = self.children[1]
+		return right.registersneeded > left.registersneeded and not left.containscall and not right.containscall
+
+	def track_register_usage(self, assembler, usage):
+		# Walks a procedure or function body in the order the generated code runs, recording in usage (a
+		# RegisterUsage) where parameters are read and which parameter registers are overwritten.
+		runSteps(self.registerUsageSteps(assembler, usage), lambda child: child.registerUsageSteps(assembler, usage))
+
+	def registerUsageSteps(self, assembler, usage):
+		# Returns a generator that yields each child to be walked at the point the generated code evaluates it, or
+		# None for a node that has no children to walk.
+		if self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION:
+			if self.token.value in usage.localnames:
+				usage.use(self.token.value)
 			else:
-				s = "procedure"
-
-			procfuncsymbol = assembler.variable_symbol_table.get(self.procFuncHeading.name)
-			assembler.emitlabel(procfuncsymbol.global_label, s + ": " + self.procFuncHeading.name)
-
-			# allocate space for local variables
-			# Also - if we referenced a parameter in the function as a parameter to another function,
-			# that parameter could get clobbered if we did not copy it to the stack.  Example:
-			# function q(r:integer):integer;
-			#   begin
-			#     q = f(r+2,r-9)
-			#   end;
-			#
-			#   rdi would hold the value of r, but then when we evaluated the "r+2", we would store that value
-			#   in rdi to pass it to f.  So when we went to calculate "r-9", we would go to RDI to grab r,
-			#   but RDI has r+2.  So, we store all the parameters as local variables.  This is likely
-			#   something we could optimize later - only store a parameter as a local variable if it is passed
-			#   into another function.
-
-			localvarbytesneeded = 0
-
-			if self.token.type == TOKEN_FUNCTION:
-				# We need to allocate space on the stack for the return value, as a given function may
-				# set and reset the return value multiple times, invoking other code that may clobber
-				# rax/xmm0 in betweeen, and can set it before the function ends.
-
-
-				if self.procFuncHeading.returntype in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL]:
-					localvarbytesneeded += 8
-					self.procFuncHeading.resultAddress = '[RBP-' + str(localvarbytesneeded) + ']'
-				elif self.procFuncHeading.returntype == TOKEN_VARIABLE_TYPE_STRING:
-					# Per ABI - if a type has return class MEMORY, then the caller provides space for the return value and
-					# passes this address in RDI as if it were the first argument to the function.  Strings are greater than
-					# 4 eightbytes, so have return class MEMORY.
-					raise ValueError ("String return types not yet supported")
-				else: # pragma: no cover
-					raise ValueError ("Unhandled return type for function")
+				symbol = assembler.variable_symbol_table.get(self.token.value)
+				if symbol.type == asm_funcs.SYMBOL_FUNCTION:
+					return self.invocationRegisterUsageSteps(assembler, usage, symbol)
+			return None
+		elif self.token.type == TOKEN_PROCEDURE_CALL:
+			symbol = assembler.variable_symbol_table.get(self.token.value)
+			return self.invocationRegisterUsageSteps(assembler, usage, symbol)
+		elif len(self.children) == 0:
+			return None
+		else:
+			return self.childRegisterUsageSteps(assembler, usage)
+
+	def childRegisterUsageSteps(self, assembler, usage):
+		if self.token.type == TOKEN_WHILE:
+			# the test is at the bottom of the loop.  Walking it all twice catches a register that is overwritten
+			# late in one iteration and read early in the next one.
+			for i in range(2):
+				yield self.children[1]
+				yield self.children[0]
+		elif self.token.type == TOKEN_IF:
+			yield self.children[0]
+			clobberedbefore = set(usage.clobbered)
+			yield self.children[1]
+			if len(self.children) == 3:
+				clobberedafterthen = usage.clobbered
+				usage.clobbered = clobberedbefore
+				yield self.children[2]
+				usage.clobbered.update(clobberedafterthen)
+		elif self.token.isMathOp() or self.token.isRelOp():
+			if self.token.type in [TOKEN_IDIV, TOKEN_MOD]:
+				# CQO overwrites RDX before the divisor is read
+				usage.clobber(["RDX"])
+			if self.evaluatesRightOperandFirst():
+				yield self.children[1]
+				yield self.children[0]
+			else:
+				yield self.children[0]
+				yield self.children[1]
+		elif self.token.type in [TOKEN_WRITE, TOKEN_WRITELN]:
+			# prtdec, prtdbl and newline preserve the parameter registers; printstring does not preserve RSI
+			for child in self.children:
+				yield child
+				if child.expressiontype == EXPRESSIONTYPE_STRING:
+					usage.clobber(["RSI"])
+		elif self.token.type == TOKEN_CONCAT:
+			usage.clobber_all()
+			for child in self.children:
+				yield child
+		elif self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT:
+			yield self.children[0]
+			if self.children[0].expressiontype == EXPRESSIONTYPE_STRING:
+				usage.clobber_all()
+			usage.assign(self.token.value)
+		else:
+			for child in self.children:
+				yield child
 
-			self.procFuncHeading.localvariableSymbolTable = asm_funcs.SymbolTable()
-			for i in self.procFuncHeading.parameters:
-				if i.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL, TOKEN_VARIABLE_TYPE_STRING]:
+	def invocationRegisterUsageSteps(self, assembler, usage, symbol):
+		# follows assembleProcFuncInvocation()
+		procFuncHeading = symbol.procfuncheading
+		clobberedbefore = set(usage.clobbered)
+		intparams = 0
+		realparams = 0
+		i = 0
+		while i < len(self.children):
+			curparam = procFuncHeading.getParameterByPos(i)
+			if curparam.byref:
+				intparams += 1
+				usage.take_address(self.children[i].token.value)
+				usage.clobber([asm_funcs.intParameterPositionToRegister(intparams)])
+			else:
+				yield self.children[i]
+				if curparam.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_STRING]:
+					intparams += 1
+					usage.clobber([asm_funcs.intParameterPositionToRegister(intparams)])
+				else:
+					realparams += 1
+					usage.clobber([asm_funcs.realParameterPositionToRegister(realparams)])
+			i += 1
+		usage.call(self, clobberedbefore, symbol.clobbered_registers())
+
+	def assembleProcsAndFunctions(self, assembler):
+		# all procedures and functions are children of the program's procedure and function declaration part
+		for child in self.children:
+			if child.token.type == TOKEN_PROCFUNC_DECLARATION_PART:
+				for procfunc in child.children:
+					procfunc.assembleProcOrFunction(assembler)
+
+	def assembleProcOrFunction(self, assembler):
+		# first six integer arguments are passed in RDI, RSI, RDX, RCX, R8, and R9 in that order
+		# first eight real arguments are passed in XMM0..XMM7
+		# integer return values are passed in RAX
+		# real return values are passed in XMM0
+
+		if self.token.type == TOKEN_FUNCTION:
+			s = "function"
+		else:
+			s = "procedure"
+
+		procfuncsymbol = assembler.variable_symbol_table.get(self.procFuncHeading.name)
+		assembler.emitlabel(procfuncsymbol.global_label, s + ": " + self.procFuncHeading.name)
+
+		# allocate space for local variables
+		# Also - if we referenced a parameter in the function as a parameter to another function,
+		# that parameter could get clobbered if we did not copy it to the stack.  Example:
+		# function q(r:integer):integer;
+		#   begin
+		#     q = f(r+2,r-9)
+		#   end;
+		#
+		#   rdi would hold the value of r, but then when we evaluated the "r+2", we would store that value
+		#   in rdi to pass it to f.  So when we went to calculate "r-9", we would go to RDI to grab r,
+		#   but RDI has r+2.  So a parameter is stored as a local variable, unless walking the body shows
+		#   that its register is never overwritten before it is read, and that its address is never taken.
+
+		self.children[0].find_string_changes(assembler, self.procFuncHeading)
+		usage = RegisterUsage(self.procFuncHeading)
+		for i in self.procFuncHeading.parameters:
+			if i.type == TOKEN_VARIABLE_TYPE_STRING and not i.byref and not (i.name in self.procFuncHeading.readonlystringparameters):
+				usage.clobber_all()  # byval Strings that are written to are copied on entry
+				break
+		self.children[0].track_register_usage(assembler, usage)
+
+		localvarbytesneeded = 0
+
+		if self.token.type == TOKEN_FUNCTION:
+			# We need to allocate space on the stack for the return value, as a given function may
+			# set and reset the return value multiple times, invoking other code that may clobber
+			# rax/xmm0 in betweeen, and can set it before the function ends.  A function that leaves
+			# a parameter register untouched keeps its return value there instead.
+
+
+			if self.procFuncHeading.returntype in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL]:
+				self.procFuncHeading.resultAddress = usage.resultregister(self.procFuncHeading.returntype)
+				if self.procFuncHeading.resultAddress is None:
 					localvarbytesneeded += 8
-					if i.type == TOKEN_VARIABLE_TYPE_INTEGER:
-						if i.byref:
-							symboltype = asm_funcs.SYMBOL_INTEGER_PTR
-						else:
-							symboltype = asm_funcs.SYMBOL_INTEGER
-					elif i.type == TOKEN_VARIABLE_TYPE_REAL:
-						if i.byref:
-							symboltype = asm_funcs.SYMBOL_REAL_PTR
-						else:
-							symboltype = asm_funcs.SYMBOL_REAL
+					self.procFuncHeading.resultAddress = '[RBP-' + str(localvarbytesneeded) + ']'
+			elif self.procFuncHeading.returntype == TOKEN_VARIABLE_TYPE_STRING:
+				# Per ABI - if a type has return class MEMORY, then the caller provides space for the return value and
+				# passes this address in RDI as if it were the first argument to the function.  Strings are greater than
+				# 4 eightbytes, so have return class MEMORY.
+				raise ValueError ("String return types not yet supported")
+			else: # pragma: no cover
+				raise ValueError ("Unhandled return type for function")
+
+		self.procFuncHeading.localvariableSymbolTable = asm_funcs.SymbolTable()
+		for i in self.procFuncHeading.parameters:
+			if i.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL, TOKEN_VARIABLE_TYPE_STRING]:
+				if i.type == TOKEN_VARIABLE_TYPE_INTEGER:
+					if i.byref:
+						symboltype = asm_funcs.SYMBOL_INTEGER_PTR
 					else:
-						if i.byref:
-							symboltype = asm_funcs.SYMBOL_STRING_PTR
-						else:
-							symboltype = asm_funcs.SYMBOL_STRING
+						symboltype = asm_funcs.SYMBOL_INTEGER
+				elif i.type == TOKEN_VARIABLE_TYPE_REAL:
+					if i.byref:
+						symboltype = asm_funcs.SYMBOL_REAL_PTR
+					else:
+						symboltype = asm_funcs.SYMBOL_REAL
+				else:
+					if i.byref:
+						symboltype = asm_funcs.SYMBOL_STRING_PTR
+					else:
+						symboltype = asm_funcs.SYMBOL_STRING
 
+				register = usage.registerparameter(i.name)
+				if i.type == TOKEN_VARIABLE_TYPE_STRING and not i.byref and not (i.name in self.procFuncHeading.readonlystringparameters):
+					pass  # copied, so it gets a String slot below
+				elif register is None:
+					localvarbytesneeded += 8
 					self.procFuncHeading.localvariableSymbolTable.insert(i.name, symboltype, symbol_rbp_offset = (-1 * localvarbytesneeded))
 					assembler.emitcomment("Parameter: " + i.name + " = [RBP-" + str(localvarbytesneeded) + "]")
-				else: # pragma: no cover
-					raise ValueError ("Invalid variable type : " + DEBUG_TOKENDISPLAY(i.type))
-
-			if not (self.procFuncHeading.localvariableAST is None):
-				for i in self.procFuncHeading.localvariableAST.children:  # localvariables is an AST with each var as a child
-					if i.token.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL]:
-						localvarbytesneeded += 8
-						if i.token.type == TOKEN_VARIABLE_TYPE_INTEGER:
-							symboltype = asm_funcs.SYMBOL_INTEGER
-						else:
-							symboltype = asm_funcs.SYMBOL_REAL
-					elif i.token.type == TOKEN_VARIABLE_TYPE_STRING:
-						localvarbytesneeded += 256
-						symboltype = asm_funcs.SYMBOL_STRING
-
-					else: # pragma: no cover
-						raise ValueError ("Invalid variable type :" + DEBUG_TOKENDISPLAY(i.token.type))
+				else:
+					self.procFuncHeading.localvariableSymbolTable.insert(i.name, symboltype, symbol_register = register)
+					assembler.emitcomment("Parameter: " + i.name + " = " + register)
+			else: # pragma: no cover
+				raise ValueError ("Invalid variable type : " + DEBUG_TOKENDISPLAY(i.type))
+
+		# Each String that is copied or built here - the byval String parameters that are copied, the String local
+		# variables and the concat temp strings - needs a 256-byte slot on the stack, plus 8 bytes that point to it.
+		# Strings that are never live at the same time share a slot.
+		copiedparameters = []
+		for i in self.procFuncHeading.parameters:
+			if i.type == TOKEN_VARIABLE_TYPE_STRING and not i.byref and not (i.name in self.procFuncHeading.readonlystringparameters):
+				copiedparameters.append(i.name)
+		stringlocals = []
+		if not (self.procFuncHeading.localvariableAST is None):
+			for i in self.procFuncHeading.localvariableAST.children:  # localvariables is an AST with each var as a child
+				if i.token.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL]:
+					localvarbytesneeded += 8
+					if i.token.type == TOKEN_VARIABLE_TYPE_INTEGER:
+						symboltype = asm_funcs.SYMBOL_INTEGER
+					else:
+						symboltype = asm_funcs.SYMBOL_REAL
 					self.procFuncHeading.localvariableSymbolTable.insert(i.token.value, symboltype, symbol_rbp_offset = (-1 * localvarbytesneeded))
 					assembler.emitcomment("Variable: " + i.token.value + " = [RBP-" + str(localvarbytesneeded) + "]")
-
-			localvarbytesneeded = self.find_procfunc_concats(localvarbytesneeded, self.procFuncHeading)
-
+				elif i.token.type == TOKEN_VARIABLE_TYPE_STRING:
+					stringlocals.append(i.token.value)
+				else: # pragma: no cover
+					raise ValueError ("Invalid variable type :" + DEBUG_TOKENDISPLAY(i.token.type))
+
+		lifetimes = StringLifetimes(self.procFuncHeading, set(stringlocals))
+		self.children[0].find_string_lifetimes(lifetimes)
+		strings = [(name, (0, lifetimes.position)) for name in copiedparameters]  # (name, (first position, last position)); concats have no name
+		for name in stringlocals:
+			strings.append((name, tuple(lifetimes.lifetimes.get(name, [0, 0]))))
+		for concat, position in lifetimes.concats:
+			strings.append((None, (position, position)))
+		slots, numslots = shareSlots([lifetime for name, lifetime in strings])
+
+		# the pointers to the slots come first, then the slots themselves
+		slotpointers = [localvarbytesneeded + 8 * (k + 1) for k in range(numslots)]
+		slotstorage = [localvarbytesneeded + 8 * numslots + asm_funcs.STRING_STORAGE_SIZE * (k + 1) for k in range(numslots)]
+		localvarbytesneeded += (8 + asm_funcs.STRING_STORAGE_SIZE) * numslots
+		emptyslots = set()  # slots whose first String has to start out empty
+		concatindex = 0
+		for k in range(len(strings)):
+			name, lifetime = strings[k]
+			address = "[RBP-" + str(slotpointers[slots[k]]) + "]"
+			if name is None:
+				# concats do not have brackets around value the way local variables do, because
+				# sometimes we use same assemble() code when it is a global var,
+				# so we always add the brackets when assembling.
+				concat = lifetimes.concats[concatindex][0]
+				concatindex += 1
+				concat.token.value = 'fredconcat' + str(slotpointers[slots[k]])  # unique to the slot
+				if not self.procFuncHeading.localvariableSymbolTable.exists(concat.token.value):
+					self.procFuncHeading.localvariableSymbolTable.insert(concat.token.value, asm_funcs.SYMBOL_CONCAT, symbol_rbp_offset = (-1 * slotpointers[slots[k]]))
+			elif name in self.procFuncHeading.parametersbyname:
+				self.procFuncHeading.localvariableSymbolTable.insert(name, asm_funcs.SYMBOL_STRING, symbol_rbp_offset = (-1 * slotpointers[slots[k]]))
+				assembler.emitcomment("Parameter: " + name + " = " + address)
+			else:
+				if lifetime[0] == 0:
+					emptyslots.add(slots[k])
+				self.procFuncHeading.localvariableSymbolTable.insert(name, asm_funcs.SYMBOL_STRING, symbol_rbp_offset = (-1 * slotpointers[slots[k]]))
+				assembler.emitcomment("Variable: " + name + " = " + address)
+		assembler.frame_sizes.append((self.procFuncHeading.name, localvarbytesneeded, len(strings), numslots))
+
+		usage.mark_live_registers()
+		procfuncsymbol.clobbers = usage.clobbers(self.procFuncHeading.resultAddress)
+
+		# A procedure or function that calls something keeps a stack frame if it had one before, so that the
+		# stack is 16-byte aligned for the callee.  Leaf routines whose parameters all stay in registers need none.
+		needsframe = localvarbytesneeded > 0
+		if usage.makescalls and (len(self.procFuncHeading.parameters) > 0 or self.token.type == TOKEN_FUNCTION):
+			needsframe = True
+
+		if needsframe:
+			assembler.emitcode("PUSH RBP")  # ABI requires callee to preserve RBP
+			assembler.emitcode("MOV RBP, RSP", "save stack pointer")
 			if localvarbytesneeded > 0:
-				assembler.emitcode("PUSH RBP")  # ABI requires callee to preserve RBP
-				assembler.emitcode("MOV RBP, RSP", "save stack pointer")
 				assembler.emitcode("SUB RSP, " + str(localvarbytesneeded), "allocate local storage")
-				numbyvalstringparameters = 0
+			numbyvalstringparameters = 0
+			for i in self.procFuncHeading.parameters:
+				param_address = self.procFuncHeading.localvariableSymbolTable.get(i.name).as_address()
+				register = self.procFuncHeading.getRegisterForParameterName(i.name)
+				if param_address == register:
+					pass  # stays in its register
+				elif i.type == TOKEN_VARIABLE_TYPE_INTEGER or i.byref or i.name in self.procFuncHeading.readonlystringparameters:
+					assembler.emitcode("MOV " + param_address + ', ' + register, 'param: ' + i.name)
+				elif i.type == TOKEN_VARIABLE_TYPE_REAL:
+					assembler.emitcode("MOVSD " + param_address + ', ' + register, 'param: ' + i.name)
+				elif i.type == TOKEN_VARIABLE_TYPE_STRING:
+					numbyvalstringparameters += 1  # copied into its slot below
+
+			# point each String slot at its storage
+			for k in range(numslots):
+				assembler.emitcode("LEA RAX, [RBP-" + str(slotstorage[k]) + "]", "String slot " + str(k))
+				assembler.emitcode("MOV [RBP-" + str(slotpointers[k]) + "], RAX")
+				if k in emptyslots:
+					assembler.emitcode("MOV BYTE [RAX], 0", "String variables start out empty")
+
+			assembler.emitcode('AND RSP, QWORD -16', '16-byte align stack pointer')
+
+			if numbyvalstringparameters > 0:
+				# copy byval string parameters - need to do this after all the stack space for the proc/func is
+				# allocated, else we end up creating a new stack frame in the middle of the stack frame we're
+				# trying to create.
+
+				# this is a bit hacky but here is the situation:
+				# Normally above we preserve the value of a register into local storage.  For
+				# strings that are byval, we do NOT do this, because we were given a pointer and
+				# we want to copy the string so we do not edit the original.  The problem: copystring
+				# uses RDI and RSI.  So if we have a byval string passed in RDI or RSI then we can step on
+				# it by doing something like:
+				#	mov rdi, [rbp-16]
+				#	mov rsi, rdi  # BUG - this rdi is because the string passed in was in first parameter
+
+				assembler.emitcode("PUSH R12","Cache RDI and RSI")
+				assembler.emitcode("PUSH R13")
+				assembler.emitcode("MOV R12, RDI")
+				assembler.emitcode("MOV R13, RSI")
+
 				for i in self.procFuncHeading.parameters:
-					param_address = self.procFuncHeading.localvariableSymbolTable.get(i.name).as_address()
-					register = self.procFuncHeading.getRegisterForParameterName(i.name)
-					if i.type == TOKEN_VARIABLE_TYPE_INTEGER or i.byref:
-						assembler.emitcode("MOV " + param_address + ', ' + register, 'param: ' + i.name)
-					elif i.type == TOKEN_VARIABLE_TYPE_REAL:
-						assembler.emitcode("MOVSD " + param_address + ', ' + register, 'param: ' + i.name)
-					elif i.type == TOKEN_VARIABLE_TYPE_STRING:
-						if not i.byref:
-							numbyvalstringparameters += 1
-							assembler.emitcode("NEWSTACKSTRING","Allocate stack space for param " + i.name)
-							assembler.emitcode("MOV " + param_address + ", rax")
-
-				# setup the concats
-				for key in self.procFuncHeading.localvariableSymbolTable.symbollist():
-					symbol = self.procFuncHeading.localvariableSymbolTable.get(key)
-					if symbol.type == asm_funcs.SYMBOL_CONCAT:
-						assembler.emitcode("NEWSTACKSTRING")
-						assembler.emitcode("mov " + symbol.as_address() + ", rax")
-
-				assembler.emitcode('AND RSP, QWORD -16', '16-byte align stack pointer')
-
-				if numbyvalstringparameters > 0:
-					# copy byval string parameters - need to do this after all the stack space for the proc/func is
-					# allocated, else we end up creating a new stack frame in the middle of the stack frame we're
-					# trying to create.
-
-					# this is a bit hacky but here is the situation:
-					# Normally above we preserve the value of a register into local storage.  For
-					# strings that are byval, we do NOT do this, because we were given a pointer and
-					# we want to copy the string so we do not edit the original.  The problem: copystring
-					# uses RDI and RSI.  So if we have a byval string passed in RDI or RSI then we can step on
-					# it by doing something like:
-					#	mov rdi, [rbp-16]
-					#	mov rsi, rdi  # BUG - this rdi is because the string passed in was in first parameter
-
-					assembler.emitcode("PUSH R12","Cache RDI and RSI")
-					assembler.emitcode("PUSH R13")
-					assembler.emitcode("MOV R12, RDI")
-					assembler.emitcode("MOV R13, RSI")
-
-					for i in self.procFuncHeading.parameters:
-						if i.type == TOKEN_VARIABLE_TYPE_STRING:
-							if not i.byref:
-								param_address = self.procFuncHeading.localvariableSymbolTable.get(i.name).as_address()
-								register = self.procFuncHeading.getRegisterForParameterName(i.name)
-								if register.lower() == "rdi":
-									register = "R12"
-								elif register.lower() == "rsi":
-									register = "R13"
-								assembler.emit_copystring(param_address, register)
-
-					assembler.emitcode("POP R13")
-					assembler.emitcode("POP R12")
-
-			self.children[0].assemble(assembler, procfuncsymbol.procfuncheading)  # the code in the Begin statement will reference the parameters before global variables
-
-			if self.token.type == TOKEN_FUNCTION:
-				# put the result in correct register
-				if self.procFuncHeading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
-					assembler.emitcode("MOV RAX, " + self.procFuncHeading.resultAddress)
-				else:
-					assembler.emitcode("MOVSD XMM0, " + self.procFuncHeading.resultAddress)
+					if i.type == TOKEN_VARIABLE_TYPE_STRING:
+						if not i.byref and not (i.name in self.procFuncHeading.readonlystringparameters):
+							param_address = self.procFuncHeading.localvariableSymbolTable.get(i.name).as_address()
+							register = self.procFuncHeading.getRegisterForParameterName(i.name)
+							if register.lower() == "rdi":
+								register = "R12"
+							elif register.lower() == "rsi":
+								register = "R13"
+							assembler.emit_copystring(param_address, register)
+
+				assembler.emitcode("POP R13")
+				assembler.emitcode("POP R12")
+
+		self.children[0].assemble(assembler, procfuncsymbol.procfuncheading)  # the code in the Begin statement will reference the parameters before global variables
+
+		if self.token.type == TOKEN_FUNCTION:
+			# put the result in correct register
+			if self.procFuncHeading.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
+				assembler.emitcode("MOV RAX, " + self.procFuncHeading.resultAddress)
+			else:
+				assembler.emitcode("MOVSD XMM0, " + self.procFuncHeading.resultAddress)
 
-			if localvarbytesneeded > 0:
-				assembler.emitcode("MOV RSP, RBP", "restore stack pointer")
-				assembler.emitcode("POP RBP")
+		if needsframe:
+			assembler.emitcode("MOV RSP, RBP", "restore stack pointer")
+			assembler.emitcode("POP RBP")
 
-			assembler.emitcode("RET")
-		else:
-			for child in self.children:
-				child.assembleProcsAndFunctions(assembler)
+		assembler.emitcode("RET")
+
+	def directOperand(self, assembler, procFuncHeadingScope, operandtype, allowimmediate):
+		# If this expression can be used as the operand of an instruction without first computing it into a
+		# register - an Integer literal, or an Integer or Real variable that is not a pointer - returns that
+		# operand.  Real literals are in memory, so they count as variables.  Otherwise returns None.
+		ret = None
+		if self.expressiontype != operandtype:
+			pass  # would need to be converted first
+		elif self.token.type == TOKEN_INT:
+			# instructions only take 32-bit signed immediates
+			if allowimmediate and self.token.value >= -2147483648 and self.token.value <= 2147483647:
+				ret = str(self.token.value)
+		elif self.token.type == TOKEN_REAL:
+			ret = "[" + assembler.real_literals[self.token.value] + "]"
+		elif self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION:
+			symbol = None
+			if not (procFuncHeadingScope is None):
+				if not (procFuncHeadingScope.localvariableSymbolTable is None):
+					if procFuncHeadingScope.localvariableSymbolTable.exists(self.token.value):
+						symbol = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value)
+			if symbol is None:
+				symbol = assembler.variable_symbol_table.get(self.token.value)
+			if symbol.type in [asm_funcs.SYMBOL_INTEGER, asm_funcs.SYMBOL_REAL]:
+				ret = symbol.as_address()
+		return ret
+
+	def assembleChildAsOperand(self, assembler, procFuncHeadingScope, child, isreal):
+		# Puts the value of the child in RAX, or in XMM0 if isreal, converting an Integer child if needed.
+		yield child
+		if isreal and child.expressiontype == EXPRESSIONTYPE_INT:
+			assembler.emitcode("CVTSI2SD XMM0, RAX")
 
-	def assembleTwoChildrenForMathEvaluation(self, assembler, procFuncHeadingScope):
+	def assembleTwoChildrenForMathEvaluation(self, assembler, procFuncHeadingScope, allowimmediate = True, allowdirectleft = True):
 		# used for math and relational operators
-		# for integer operations, the first child is in RAX and the second child is in RCX
-		# for floating point operations, the first child is in XMM0 and the second child is in XMM8
+		# Returns (left, right), the operands to use for the operator.  For integer operations one of them is RAX,
+		# for floating point operations one of them is XMM0.  The other is a register from the expression register
+		# pool, the spilled value at [RSP], or, if the child allows it, a variable address or an immediate.
+		# The caller must emit the operator and then call assembler.release_held_operand().
+		# allowdirectleft = False means the left operand is never a variable address, for operators that would
+		# have to write to it.
 		if self.expressiontype == EXPRESSIONTYPE_INT:
-			# all children must be ints
-			self.children[0].assemble(assembler, procFuncHeadingScope)
-			# RAX now contains value of the first child
-			assembler.emitcode("PUSH RAX")
-			self.children[1].assemble(assembler, procFuncHeadingScope)
-			# RAX now contains value of the second child
-			assembler.emitcode("POP RCX")
+			isreal = False
+			accumulator = "RAX"
 		elif self.expressiontype == EXPRESSIONTYPE_REAL:
-			# integer children will be in RAX and have to be moved to XMM0
-			# real children will already be in XMM0
-			self.children[0].assemble(assembler, procFuncHeadingScope)
-			if self.children[0].expressiontype == EXPRESSIONTYPE_INT:
-				assembler.emitcode("CVTSI2SD XMM0, RAX")
-			assembler.emitpushxmmreg("XMM0")
-			self.children[1].assemble(assembler, procFuncHeadingScope)
-			if self.children[1].expressiontype == EXPRESSIONTYPE_INT:
-				assembler.emitcode("CVTSI2SD XMM0, RAX")
-			assembler.emitpopxmmreg("XMM8")
+			isreal = True
+			accumulator = "XMM0"
 		else:  # pragma: no cover
-			raise valueError ("Invalid ExpressionType")
+			raise ValueError ("Invalid ExpressionType")
+		if isreal:
+			operandtype = EXPRESSIONTYPE_REAL
+		else:
+			operandtype = EXPRESSIONTYPE_INT
+
+		left = self.children[0]
+		right = self.children[1]
+
+		if self.evaluatesRightOperandFirst():
+			yield from self.assembleChildAsOperand(assembler, procFuncHeadingScope, right, isreal)
+			leftoperand = None
+			if allowdirectleft:
+				leftoperand = left.directOperand(assembler, procFuncHeadingScope, operandtype, allowimmediate)
+			if leftoperand is None:
+				rightoperand = assembler.hold_expression_result(isreal, False)
+				yield from self.assembleChildAsOperand(assembler, procFuncHeadingScope, left, isreal)
+				leftoperand = accumulator
+			else:
+				assembler.hold_direct_operand()
+				rightoperand = accumulator
+		else:
+			yield from self.assembleChildAsOperand(assembler, procFuncHeadingScope, left, isreal)
+			rightoperand = right.directOperand(assembler, procFuncHeadingScope, operandtype, allowimmediate)
+			if rightoperand is None:
+				leftoperand = assembler.hold_expression_result(isreal, right.containscall)
+				yield from self.assembleChildAsOperand(assembler, procFuncHeadingScope, right, isreal)
+				rightoperand = accumulator
+			else:
+				assembler.hold_direct_operand()
+				leftoperand = accumulator
+
+		return (leftoperand, rightoperand)
 
 	def assembleProcFuncInvocation(self, assembler, procFuncHeadingScope, symbol):
 		# procFuncHeadingScope = the scope of the caller
@@ -757,14 +1491,23 @@ class AST():
 		# parameters so current limitation would be 5 int parameters in that case.
 		#
 		# the parameters will be the children in the AST
-		# any register (except XMM0) used to pass a parameter gets pushed onto the stack
+		# any register the caller still needs that the call may overwrite gets pushed onto the stack
 		# put the parameters into those registers, with special handling for XMM0
 		# call the proc/function
 		# rax or XMM0 has the return
-		# pop all the registers back except XMM0
-
-		assembler.preserve_xmm_registers_for_procfunc_call(symbol.procfuncheading.getRealParameterCount())
-		assembler.preserve_int_registers_for_procfunc_call(symbol.procfuncheading.getIntegerParameterCount())
+		# pop the saved registers back
+		#
+		# The caller still needs the registers of its parameters that stay in registers and are used after the
+		# call, and the registers already loaded with arguments for an enclosing call, e.g. RDI in f(a, g(b)).
+		# The call may overwrite whatever the callee clobbers, plus the registers it passes its own arguments in.
+
+		argumentregisters = []
+		for param in symbol.procfuncheading.parameters:
+			register = symbol.procfuncheading.getRegisterForParameterName(param.name)
+			if register != "XMM0":
+				argumentregisters.append(register)
+		saved = assembler.preserve_loaded(list(symbol.clobbered_registers()) + argumentregisters, self.liveregisters)
+		numloadedbefore = len(assembler.loaded_argument_registers)
 
 		i = 0
 		intparams = 0
@@ -805,6 +1548,7 @@ class AST():
 					# must be a global variable
 					childsymbol = assembler.variable_symbol_table.get(childtoken.value)
 					assembler.emitcode("MOV " + asm_funcs.intParameterPositionToRegister(intparams) + "," + childsymbol.as_value())
+				assembler.loaded_argument_registers.append(asm_funcs.intParameterPositionToRegister(intparams))
 			else:
 				# If we are passing into a proc/function a value that itself is a pointer, then we
 				# need to dereference the pointer if it is being passed byval.  The assemble()
@@ -812,12 +1556,13 @@ class AST():
 				# into RAX / XMM0
 
 				paramtype = curparam.type
-				self.children[i].assemble(assembler, procFuncHeadingScope)
+				yield self.children[i]
 				if paramtype in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_STRING]:
 					intparams += 1
 					if self.children[i].expressiontype == EXPRESSIONTYPE_REAL:  # pragma: no cover
 						raise ValueError("Cannot pass real into integer-typed parameter into " + symbol.procfuncheading.name + '()')
 					assembler.emitcode("MOV " + asm_funcs.intParameterPositionToRegister(intparams) + ", RAX")
+					assembler.loaded_argument_registers.append(asm_funcs.intParameterPositionToRegister(intparams))
 				elif paramtype == TOKEN_VARIABLE_TYPE_REAL:
 					realparams += 1
 					if self.children[i].expressiontype == EXPRESSIONTYPE_INT:
@@ -828,10 +1573,11 @@ class AST():
 					# value in XMM0 (when it is evaluated) and then pushes it to XMM1 since XMM1 holds the second parameter.
 					# Fix is to calculate the first parameter, stash it, then grab it back.
 					if realparams == 1:
-						# XMM0 contains the value after the self.children[i].assemble() from above
+						# XMM0 contains the value after assembling self.children[i] above
 						assembler.emitpushxmmreg("XMM0")
 					else:
 						assembler.emitcode("MOVSD " + asm_funcs.realParameterPositionToRegister(realparams) + ", XMM0")
+						assembler.loaded_argument_registers.append(asm_funcs.realParameterPositionToRegister(realparams))
 				else:  # pragma: no cover
 					raise ValueError("Invalid expressiontype")
 
@@ -842,351 +1588,725 @@ class AST():
 			assembler.emitpopxmmreg("XMM0")
 
 		assembler.emitcode("CALL " + symbol.as_value(), "invoke " + symbol.procfuncheading.name + '()')
-		assembler.restore_int_registers_after_procfunc_call(symbol.procfuncheading.getIntegerParameterCount())
-		assembler.restore_xmm_registers_after_procfunc_call(symbol.procfuncheading.getRealParameterCount())
+		del assembler.loaded_argument_registers[numloadedbefore:]
+		assembler.restore_loaded(saved)
 
 
-	def assemble(self, assembler, procFuncHeadingScope):
-		if self.token.type == TOKEN_INT:
-			assembler.emitcode("MOV RAX, " + str(self.token.value))
-		elif self.token.type == TOKEN_REAL:
-			assembler.emitcode("MOVSD XMM0, [" + assembler.real_literals[self.token.value] + "]")
-		elif self.token.type == TOKEN_STRING_LITERAL:
-			data_name = assembler.string_literals[self.token.value]
-			assembler.emitcode("mov rax, " + data_name)
-		elif self.token.type in [TOKEN_PLUS, TOKEN_MINUS, TOKEN_MULT, TOKEN_DIV]:
-			self.assembleTwoChildrenForMathEvaluation(assembler, procFuncHeadingScope)
-			if self.expressiontype == EXPRESSIONTYPE_INT:
-				if self.token.type == TOKEN_PLUS:
-					assembler.emitcode("ADD RAX, RCX")
-				elif self.token.type == TOKEN_MINUS:
-					assembler.emitcode("SUB RCX, RAX")
-					assembler.emitcode("MOV RAX, RCX")  # it might be quicker to sub RAX, RCX and NEG RAX
-				elif self.token.type == TOKEN_MULT:
-					assembler.emitcode("IMUL RAX, RCX")
-				else: # pragma: no cover
-					raise ValueError ("Floating point division has integer type - error")
+	def assembleComparison(self, assembler, procFuncHeadingScope):
+		# Evaluates both operands of a relational operator and compares them.  Returns the conditional jump
+		# that is taken when the relational operator is true.
+		left, right = yield from self.assembleTwoChildrenForMathEvaluation(assembler, procFuncHeadingScope)
+
+		# the accumulator cannot be the second operand of CMP if the other is an immediate, so compare the
+		# other way around and swap the condition.  Real comparisons are never swapped: when either operand is
+		# NaN, JA and JAE are not taken but JB and JBE are, so > and >= would turn into true.
+		swapped = False
+		if self.expressiontype == EXPRESSIONTYPE_INT:
+			if left == "RAX":
+				assembler.emitcode("CMP RAX, " + right)
 			else:
-				if self.token.type == TOKEN_PLUS:
-					assembler.emitcode("ADDSD XMM0, XMM8")
-				elif self.token.type == TOKEN_MINUS:
-					assembler.emitcode("SUBSD XMM8, XMM0")
-					assembler.emitcode("MOVSD XMM0, XMM8")
-				elif self.token.type == TOKEN_MULT:
-					assembler.emitcode("MULSD XMM0, XMM8")
-				elif self.token.type == TOKEN_DIV:
-					assembler.emitcode("DIVSD XMM8, XMM0")
-					assembler.emitcode("MOVSD XMM0, XMM8")
-
-		elif self.token.type in [TOKEN_IDIV, TOKEN_MOD]:
-			self.children[0].assemble(assembler, procFuncHeadingScope)
-			assembler.emitcode("PUSH RAX")
-			self.children[1].assemble(assembler, procFuncHeadingScope)
-			assembler.emitcode("MOV RCX, RAX")
-			assembler.emitcode("POP RAX")
-			assembler.emitcode("XOR RDX, RDX")  # RDX is concatenated with RAX to do division
-			assembler.emitcode("CQO") #extend RAX into RDX to handle idiv by negative numbers
-			assembler.emitcode("IDIV RCX")
-			if self.token.type == TOKEN_MOD:
-				assembler.emitcode("MOV RAX, RDX") # Remainder of IDIV is in RDX.
-		elif self.token.isRelOp():
-
-			self.assembleTwoChildrenForMathEvaluation(assembler, procFuncHeadingScope)
-
-			if self.expressiontype == EXPRESSIONTYPE_INT:
-				assembler.emitcode("CMP RCX, RAX")
-				if self.token.type == TOKEN_RELOP_EQUALS:
-					jumpinstr = "JE"
-				elif self.token.type == TOKEN_RELOP_NOTEQ:
-					jumpinstr = "JNE"
-				elif self.token.type == TOKEN_RELOP_GREATER:
-					jumpinstr = "JG"
-				elif self.token.type == TOKEN_RELOP_GREATEREQ:
-					jumpinstr = "JGE"
-				elif self.token.type == TOKEN_RELOP_LESS:
-					jumpinstr = "JL"
-				elif self.token.type == TOKEN_RELOP_LESSEQ:
-					jumpinstr = "JLE"
-				else: # pragma: no cover
-					raise ValueError ("Invalid Relational Operator : " + DEBUG_TOKENDISPLAY(self.token.type))
-
-			elif self.expressiontype == EXPRESSIONTYPE_REAL:
-				assembler.emitcode("UCOMISD XMM8, XMM0")
-				if self.token.type == TOKEN_RELOP_EQUALS:
-					jumpinstr = "JE"
-				elif self.token.type == TOKEN_RELOP_NOTEQ:
-					jumpinstr = "JNE"
-				elif self.token.type == TOKEN_RELOP_GREATER:
-					jumpinstr = "JA"
-				elif self.token.type == TOKEN_RELOP_GREATEREQ:
-					jumpinstr = "JAE"
-				elif self.token.type == TOKEN_RELOP_LESS:
-					jumpinstr = "JB"
-				elif self.token.type == TOKEN_RELOP_LESSEQ:
-					jumpinstr = "JBE"
-				else: # pragma: no cover
-					raise ValueError ("Invalid Relational Operator : " + DEBUG_TOKENDISPLAY(self.token.type))
+				assembler.emitcode("CMP RAX, " + left)
+				swapped = True
+		elif self.expressiontype == EXPRESSIONTYPE_REAL:
+			if left[0] == "[":
+				# the first operand of UCOMISD has to be a register
+				assembler.emitcode("MOVSD " + asm_funcs.XMM_SCRATCH_REGISTER + ", " + left)
+				left = asm_funcs.XMM_SCRATCH_REGISTER
+			assembler.emitcode("UCOMISD " + left + ", " + right)
+		jumpinstr = self.relOpJumpInstruction(swapped)
+		assembler.release_held_operand()
+		return jumpinstr
+
+	def assembleConditionalJump(self, assembler, procFuncHeadingScope, label, jumpiftrue):
+		# Used for the condition of an if or while: jumps to label if the condition is true (jumpiftrue) or false
+		# (not jumpiftrue), and falls through otherwise, without computing the condition into RAX.
+		if not self.token.isRelOp(): # pragma: no cover
+			raise ValueError("Relational operator expected in condition")
+		jumpinstr = yield from self.assembleComparison(assembler, procFuncHeadingScope)
+		if not jumpiftrue:
+			jumpinstr = asm_funcs.INVERTED_JUMPS[jumpinstr]
+		assembler.emitcode(jumpinstr + " " + label)
+
+	def relOpJumpInstruction(self, swapped):
+		# The conditional jump that is taken when the relational operator is true, after the operands were
+		# compared left to right (or right to left, if swapped).  Integer comparisons are signed; UCOMISD sets
+		# the flags the way an unsigned comparison does.
+		relop = self.token.type
+		if swapped:
+			if relop == TOKEN_RELOP_GREATER:
+				relop = TOKEN_RELOP_LESS
+			elif relop == TOKEN_RELOP_GREATEREQ:
+				relop = TOKEN_RELOP_LESSEQ
+			elif relop == TOKEN_RELOP_LESS:
+				relop = TOKEN_RELOP_GREATER
+			elif relop == TOKEN_RELOP_LESSEQ:
+				relop = TOKEN_RELOP_GREATEREQ
+
+		if relop == TOKEN_RELOP_EQUALS:
+			ret = "JE"
+		elif relop == TOKEN_RELOP_NOTEQ:
+			ret = "JNE"
+		elif self.expressiontype == EXPRESSIONTYPE_INT:
+			if relop == TOKEN_RELOP_GREATER:
+				ret = "JG"
+			elif relop == TOKEN_RELOP_GREATEREQ:
+				ret = "JGE"
+			elif relop == TOKEN_RELOP_LESS:
+				ret = "JL"
+			elif relop == TOKEN_RELOP_LESSEQ:
+				ret = "JLE"
+			else: # pragma: no cover
+				raise ValueError ("Invalid Relational Operator : " + DEBUG_TOKENDISPLAY(self.token.type))
+		elif self.expressiontype == EXPRESSIONTYPE_REAL:
+			if relop == TOKEN_RELOP_GREATER:
+				ret = "JA"
+			elif relop == TOKEN_RELOP_GREATEREQ:
+				ret = "JAE"
+			elif relop == TOKEN_RELOP_LESS:
+				ret = "JB"
+			elif relop == TOKEN_RELOP_LESSEQ:
+				ret = "JBE"
+			else: # pragma: no cover
+				raise ValueError ("Invalid Relational Operator : " + DEBUG_TOKENDISPLAY(self.token.type))
+		else: # pragma: no cover
+			raise ValueError ("Invalid ExpressionType")
+		return ret
 
+	def assembleIntegerLiteral(self, assembler, procFuncHeadingScope):
+		assembler.emitcode("MOV RAX, " + str(self.token.value))
 
-			labeltrue = assembler.generate_local_label()
-			labeldone = assembler.generate_local_label()
-			assembler.emitcode(jumpinstr + " " + labeltrue)
-			assembler.emitcode("MOV RAX, 0")
-			assembler.emitcode("JMP " + labeldone)
-			assembler.emitlabel(labeltrue)
-			assembler.emitcode("MOV RAX, -1")  # we may need to move to using 1 for True per the x86-64 manuals
-			assembler.emitlabel(labeldone)
-		elif self.token.type == TOKEN_IF:
-			label = assembler.generate_local_label()
-			assembler.emitcomment(self.comment + '...')
-			self.children[0].assemble(assembler, procFuncHeadingScope)
-			assembler.emitcode("CMP RAX, 0")
-			assembler.emitcode("JE " + label)
-			if len(self.children) == 2:
-				# straight if-then
-				assembler.emitcomment('... THEN ...')
-				self.children[1].assemble(assembler, procFuncHeadingScope)
-				assembler.emitlabel(label)
-			elif len(self.children) == 3:
-				# if-then-else
-				assembler.emitcomment('... THEN ...')
-				skipelselabel = assembler.generate_local_label()
-				self.children[1].assemble(assembler, procFuncHeadingScope)
-				assembler.emitcode("JMP " + skipelselabel)
-				assembler.emitlabel(label)
-				assembler.emitcomment('... ELSE ...')
-				self.children[2].assemble(assembler, procFuncHeadingScope)
-				assembler.emitlabel(skipelselabel)
+	def assembleRealLiteral(self, assembler, procFuncHeadingScope):
+		assembler.emitcode("MOVSD XMM0, [" + assembler.real_literals[self.token.value] + "]")
+
+	def assembleStringLiteral(self, assembler, procFuncHeadingScope):
+		data_name = assembler.string_literals[self.token.value]
+		assembler.emitcode("mov rax, " + data_name)
+
+	def assembleMathOperation(self, assembler, procFuncHeadingScope):
+		left, right = yield from self.assembleTwoChildrenForMathEvaluation(assembler, procFuncHeadingScope)
+		if self.expressiontype == EXPRESSIONTYPE_INT:
+			if left == "RAX":
+				other = right
+			else:
+				other = left
+			if self.token.type == TOKEN_PLUS:
+				assembler.emitcode("ADD RAX, " + other)
+			elif self.token.type == TOKEN_MINUS:
+				if left == "RAX":
+					assembler.emitcode("SUB RAX, " + right)
+				elif left in asm_funcs.EXPRESSION_INT_REGISTERS:
+					assembler.emitcode("SUB " + left + ", RAX")
+					assembler.emitcode("MOV RAX, " + left)
+				else:
+					# left is in memory: left - right == -right + left
+					assembler.emitcode("NEG RAX")
+					assembler.emitcode("ADD RAX, " + left)
+			elif self.token.type == TOKEN_MULT:
+				assembler.emitcode("IMUL RAX, " + other)
 			else: # pragma: no cover
-				raise ValueError ("Invalid number of tokens following IF.  Expected 2 or 3, got: " + str(len(self.children)))
-		elif self.token.type == TOKEN_WHILE:
-			beginwhilelabel = assembler.generate_local_label()
-			endwhilelabel = assembler.generate_local_label()
-			assembler.emitcomment(self.comment + '...')
-			assembler.emitlabel(beginwhilelabel)
-			self.children[0].assemble(assembler, procFuncHeadingScope)
-			assembler.emitcode("CMP RAX, 0")
-			assembler.emitcode("JE " + endwhilelabel)
-			assembler.emitcomment("... DO ...")
-			self.children[1].assemble(assembler, procFuncHeadingScope)
-			assembler.emitcode("JMP " + beginwhilelabel)
-			assembler.emitlabel(endwhilelabel)
-		elif self.token.type == TOKEN_WRITELN or self.token.type == TOKEN_WRITE:
-			assembler.emitcomment(self.comment)
-			for child in self.children:
-				if child.token.type == TOKEN_STRING_LITERAL:
-					if not (child.token.value in assembler.string_literals): # pragma: no cover
-						raise ValueError ("No literal for string :" + child.token.value)
+				raise ValueError ("Floating point division has integer type - error")
+		else:
+			if left == "XMM0":
+				other = right
+			else:
+				other = left
+			if self.token.type == TOKEN_PLUS:
+				assembler.emitcode("ADDSD XMM0, " + other)
+			elif self.token.type == TOKEN_MULT:
+				assembler.emitcode("MULSD XMM0, " + other)
+			else:
+				if self.token.type == TOKEN_MINUS:
+					instr = "SUBSD"
+				else:
+					instr = "DIVSD"
+				if left == "XMM0":
+					assembler.emitcode(instr + " XMM0, " + right)
+				else:
+					# non-commutative and the left operand is not in XMM0
+					if left in asm_funcs.EXPRESSION_XMM_REGISTERS:
+						reg = left
 					else:
-						data_name = assembler.string_literals[child.token.value]
-						assembler.emitcode("push rdi")
-						assembler.emitcode("mov rdi, " + data_name)
-						assembler.emitcode("call printstring", "imported from fredstringfunc")
-						assembler.emitcode("pop rdi")
-				elif child.expressiontype == EXPRESSIONTYPE_STRING:
-					child.assemble(assembler, procFuncHeadingScope)  # the string result should be in RAX
+						reg = asm_funcs.XMM_SCRATCH_REGISTER
+						assembler.emitcode("MOVSD " + reg + ", " + left)
+					assembler.emitcode(instr + " " + reg + ", XMM0")
+					assembler.emitcode("MOVAPD XMM0, " + reg)
+		assembler.release_held_operand()
+
+	def assembleShiftLeft(self, assembler, procFuncHeadingScope):
+		yield self.children[0]
+		assembler.emitcode("SHL RAX, " + str(self.children[1].token.value))
+
+	def assembleShiftOrMask(self, assembler, procFuncHeadingScope):
+		# DIV rounds towards zero, and MOD has the sign of the dividend, so a negative dividend is biased by
+		# 2^k-1 before shifting or masking.  The bias is the sign bit of the dividend shifted into the low k bits.
+		shift = self.children[1].token.value
+		yield self.children[0]
+		bias = assembler.hold_expression_result(False, False)
+		if bias[0] == "[":
+			bias = "QWORD " + bias
+		assembler.emitcode("SAR " + bias + ", 63")
+		assembler.emitcode("SHR " + bias + ", " + str(64 - shift))
+		assembler.emitcode("ADD RAX, " + bias)
+		if self.token.type == TOKEN_SHIFT_DIV:
+			assembler.emitcode("SAR RAX, " + str(shift))
+		else:
+			assembler.emitcode("AND RAX, " + str((1 << shift) - 1))
+			assembler.emitcode("SUB RAX, " + bias)
+		assembler.release_held_operand()
+
+	def assembleIntegerDivision(self, assembler, procFuncHeadingScope):
+		# IDIV cannot take an immediate divisor, and the dividend may get swapped into RAX
+		left, right = yield from self.assembleTwoChildrenForMathEvaluation(assembler, procFuncHeadingScope, allowimmediate = False, allowdirectleft = False)
+		if left != "RAX":
+			# the divisor is in RAX and the dividend is held elsewhere, so swap them
+			assembler.emitcode("XCHG RAX, " + left)
+			right = left
+		# CQO overwrites RDX, which may hold an argument already loaded for an enclosing call
+		saved = assembler.preserve_loaded(["RDX"])
+		if right == "[RSP]" and len(saved) > 0:
+			right = "[RSP+8]"  # the spilled divisor is under the saved RDX
+		if right[0] == "[":
+			right = "QWORD " + right
+		assembler.emitcode("CQO") #extend RAX into RDX to handle idiv by negative numbers
+		assembler.emitcode("IDIV " + right)
+		if self.token.type == TOKEN_MOD:
+			assembler.emitcode("MOV RAX, RDX") # Remainder of IDIV is in RDX.
+		assembler.restore_loaded(saved)
+		assembler.release_held_operand()
+
+	def assembleRelOp(self, assembler, procFuncHeadingScope): # pragma: no cover
+		# if and while jump on the comparison directly (see assembleConditionalJump()).  The grammar only allows
+		# relational operators in conditions, so this is here for when a boolean value is needed.
+		jumpinstr = yield from self.assembleComparison(assembler, procFuncHeadingScope)
+		labeltrue = assembler.generate_local_label()
+		labeldone = assembler.generate_local_label()
+		assembler.emitcode(jumpinstr + " " + labeltrue)
+		assembler.emitcode("MOV RAX, 0")
+		assembler.emitcode("JMP " + labeldone)
+		assembler.emitlabel(labeltrue)
+		assembler.emitcode("MOV RAX, -1")  # we may need to move to using 1 for True per the x86-64 manuals
+		assembler.emitlabel(labeldone)
+
+	def assembleIf(self, assembler, procFuncHeadingScope):
+		label = assembler.generate_local_label()
+		assembler.emitcomment(self.comment + '...')
+		yield from self.children[0].assembleConditionalJump(assembler, procFuncHeadingScope, label, False)
+		if len(self.children) == 2:
+			# straight if-then
+			assembler.emitcomment('... THEN ...')
+			yield self.children[1]
+			assembler.emitlabel(label)
+		elif len(self.children) == 3:
+			# if-then-else
+			assembler.emitcomment('... THEN ...')
+			skipelselabel = assembler.generate_local_label()
+			yield self.children[1]
+			assembler.emitcode("JMP " + skipelselabel)
+			assembler.emitlabel(label)
+			assembler.emitcomment('... ELSE ...')
+			yield self.children[2]
+			assembler.emitlabel(skipelselabel)
+		else: # pragma: no cover
+			raise ValueError ("Invalid number of tokens following IF.  Expected 2 or 3, got: " + str(len(self.children)))
+
+	def assembleWhile(self, assembler, procFuncHeadingScope):
+		# The test is at the bottom of the loop, so each iteration takes a single branch back to the top.
+		# The loop is entered by jumping to the test.
+		bodylabel = assembler.generate_local_label()
+		testlabel = assembler.generate_local_label()
+		assembler.emitcomment(self.comment + '...')
+		assembler.emitcode("JMP " + testlabel)
+		assembler.emitlabel(bodylabel)
+		assembler.emitcomment("... DO ...")
+		yield self.children[1]
+		assembler.emitlabel(testlabel)
+		yield from self.children[0].assembleConditionalJump(assembler, procFuncHeadingScope, bodylabel, True)
+
+	def assembleWrite(self, assembler, procFuncHeadingScope):
+		assembler.emitcomment(self.comment)
+		for child in self.children:
+			if child.token.type == TOKEN_STRING_LITERAL:
+				if not (child.token.value in assembler.string_literals): # pragma: no cover
+					raise ValueError ("No literal for string :" + child.token.value)
+				else:
+					data_name = assembler.string_literals[child.token.value]
 					assembler.emitcode("push rdi")
-					assembler.emitcode("mov rdi, rax")
+					assembler.emitcode("mov rdi, " + data_name)
 					assembler.emitcode("call printstring", "imported from fredstringfunc")
 					assembler.emitcode("pop rdi")
-				elif child.expressiontype == EXPRESSIONTYPE_INT:
-					child.assemble(assembler, procFuncHeadingScope)  # the expression should be in RAX
-					assembler.emitcode("push rdi")
-					assembler.emitcode("mov rdi, rax") # first parameter of functions should be in RDI
-					assembler.emitcode("call prtdec","imported from nsm64")
-					assembler.emitcode("pop rdi")
-				elif child.expressiontype == EXPRESSIONTYPE_REAL:
-					child.assemble(assembler, procFuncHeadingScope)  # the expression should be in XMM0
-					assembler.emitcode("call prtdbl")
-				else: # pragma: no cover
-					raise ValueError ("Do not know how to write this type.")
-			if self.token.type == TOKEN_WRITELN:
+			elif child.expressiontype == EXPRESSIONTYPE_STRING:
+				yield child  # the string result should be in RAX
 				assembler.emitcode("push rdi")
-				assembler.emitcode("call newline", "imported from nsm64")
+				assembler.emitcode("mov rdi, rax")
+				assembler.emitcode("call printstring", "imported from fredstringfunc")
 				assembler.emitcode("pop rdi")
-		elif self.token.type == TOKEN_CONCAT:
-			assembler.emitcomment(self.comment)
-			if len(self.children) < 2: # pragma: no cover
-				raise ValueError("Concat() requires 2 or more arguments.")
-			else:
-				if not(procFuncHeadingScope is None):
-					# concats are ALWAYS local variables, never parameters, nor are they ever global variables if
-					# encountered inside a function/procedure.  So if there is a ProcFuncHeadingScope, then the concat IS
-					# a local variable, period, so we do not have to track that we found it and then back out to the global scope
-					# in case we did not find it locally and then search for it globally.
-					if not(procFuncHeadingScope.localvariableSymbolTable is None):
-						address = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value).as_address()
-					else: # pragma: no cover
-						raise ValueError("Error: Concat not properly found/allocated")
-				else:
-					address = "[" + self.token.value + "]"
+			elif child.expressiontype == EXPRESSIONTYPE_INT:
+				yield child  # the expression should be in RAX
+				assembler.emitcode("push rdi")
+				assembler.emitcode("mov rdi, rax") # first parameter of functions should be in RDI
+				assembler.emitcode("call prtdec","imported from nsm64")
+				assembler.emitcode("pop rdi")
+			elif child.expressiontype == EXPRESSIONTYPE_REAL:
+				yield child  # the expression should be in XMM0
+				assembler.emitcode("call prtdbl")
+			else: # pragma: no cover
+				raise ValueError ("Do not know how to write this type.")
+		if self.token.type == TOKEN_WRITELN:
+			assembler.emitcode("push rdi")
+			assembler.emitcode("call newline", "imported from nsm64")
+			assembler.emitcode("pop rdi")
+
+	def assembleConcat(self, assembler, procFuncHeadingScope):
+		if not(procFuncHeadingScope is None):
+			# concats are ALWAYS local variables, never parameters, nor are they ever global variables if
+			# encountered inside a function/procedure.  So if there is a ProcFuncHeadingScope, then the concat IS
+			# a local variable, period, so we do not have to track that we found it and then back out to the global scope
+			# in case we did not find it locally and then search for it globally.
+			if not(procFuncHeadingScope.localvariableSymbolTable is None):
+				address = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value).as_address()
+			else: # pragma: no cover
+				raise ValueError("Error: Concat not properly found/allocated")
+		else:
+			address = "[" + self.token.value + "]"
+		yield from self.assembleConcatArguments(assembler)
+		assembler.emit_concatstrings(address, len(self.children))  # now rax has the string that is returned from the Concat
+
+	def assembleConcatArguments(self, assembler):
+		# The address of each String is pushed, for one call to concatenate them all with emit_concatstrings().
+		# Functions cannot return Strings, so evaluating an argument never calls anything that could change a
+		# String pushed before it.
+		assembler.emitcomment(self.comment)
+		if len(self.children) < 2: # pragma: no cover
+			raise ValueError("Concat() requires 2 or more arguments.")
+		for child in self.children:
+			yield child  # rax points to the String
+			assembler.emitcode("push rax")
+
+	def assembleAssignment(self, assembler, procFuncHeadingScope):
+		assembler.emitcomment(self.comment)
+		found_symbol = False
+		if not (procFuncHeadingScope is None):
+			# If this is a param or local variable in a function/proc we refer to it via the offset from RBP
+			if not (procFuncHeadingScope.localvariableSymbolTable is None):
+				if procFuncHeadingScope.localvariableSymbolTable.exists(self.token.value):
+					child = self.children[0]
+					symbol = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value)
+					found_symbol = True
 
-				assembler.emitcode("mov rax, " + address)
-				assembler.emitcode("push rax")
-				child = self.children[0]
-				if child.token.type == TOKEN_STRING_LITERAL:
-					assembler.emit_copyliteraltostring("rax", child.token.value)
-				else:
-					child.assemble(assembler, procFuncHeadingScope)  # rax points to result
-					assembler.emitcode("pop r11")  # now r11 conains the temp string
-					assembler.emitcode("push r11")  # preserve it
-					assembler.emit_copystring("r11", "rax")
-				assembler.emitcode("pop rax")
-				assembler.emitcode("push rax")
-
-				for child in self.children[1:]:
-					# always make sure that at the start of each iteration of the loop, rax
-					# contains the address of the temp string
-					if child.token.type == TOKEN_STRING_LITERAL:
-						assembler.emit_stringconcatliteral("rax", child.token.value)
-					else:
-						child.assemble(assembler, procFuncHeadingScope)  # rax points to result
-						assembler.emitcode("pop r11")  # now r11 conains the temp string
-						assembler.emitcode("push r11")  # preserve it
-						assembler.emit_stringconcatstring("r11", "rax")
-					assembler.emitcode("pop rax")
-					assembler.emitcode("push rax")
-				assembler.emitcode("pop rax") # now rax has the string that is returned from the Concat
-		elif self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT:
-			assembler.emitcomment(self.comment)
-			found_symbol = False
-			if not (procFuncHeadingScope is None):
-				# If this is a param or local variable in a function/proc we refer to it via the offset from RBP
-				if not (procFuncHeadingScope.localvariableSymbolTable is None):
-					if procFuncHeadingScope.localvariableSymbolTable.exists(self.token.value):
-						child = self.children[0]
-						symbol = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value)
-						found_symbol = True
-
-						if symbol.type not in [asm_funcs.SYMBOL_STRING, asm_funcs.SYMBOL_STRING_PTR]:
-							child.assemble(assembler, procFuncHeadingScope)
-
-							if not symbol.isPointer():
-								if child.expressiontype == EXPRESSIONTYPE_INT:
-									assembler.emitcode("MOV " + symbol.as_address() + ", RAX")
-								elif child.expressiontype == EXPRESSIONTYPE_REAL:
-									assembler.emitcode("MOVSD " + symbol.as_address() + ", XMM0")
-								else: # pragma: no cover
-									raise ValueError("Invalid expressiontype")
-							else:
-								if child.expressiontype == EXPRESSIONTYPE_INT:
-									assembler.emitcode("MOV R11, " + symbol.as_address())
-									assembler.emitcode("MOV [R11], RAX")
-								elif child.expressiontype == EXPRESSIONTYPE_REAL:
-									assembler.emitcode("MOV R11, " + symbol.as_address())
-									assembler.emitcode("MOVDQU [R11], XMM0")
-								else: # pragma: no cover
-									raise ValueError("Invalid expressiontype")
+					if symbol.type not in [asm_funcs.SYMBOL_STRING, asm_funcs.SYMBOL_STRING_PTR]:
+						yield child
+
+						if not symbol.isPointer():
+							if child.expressiontype == EXPRESSIONTYPE_INT:
+								assembler.emitcode("MOV " + symbol.as_address() + ", RAX")
+							elif child.expressiontype == EXPRESSIONTYPE_REAL:
+								assembler.emitcode("MOVSD " + symbol.as_address() + ", XMM0")
+							else: # pragma: no cover
+								raise ValueError("Invalid expressiontype")
 						else:
-							# two options - first, we are assigning from a string literal.
-							# second, we are assigning from some other string expression.
-							if not symbol.isPointer():
-								if child.token.type == TOKEN_STRING_LITERAL:
-									assembler.emit_copyliteraltostring(symbol.as_address(), child.token.value)
-								else:
-									child.assemble(assembler, procFuncHeadingScope) # RAX has the address of the resulting String
-									assembler.emit_copystring(symbol.as_address(), "RAX")
-							else:
-								child.assemble(assembler, procFuncHeadingScope)
+							if child.expressiontype == EXPRESSIONTYPE_INT:
 								assembler.emitcode("MOV R11, " + symbol.as_address())
-								assembler.emit_copystring("[R11]", "RAX")
-
-			if found_symbol == False:
-				# Must be a global variable or a function
-				symbol = assembler.variable_symbol_table.get(self.token.value)
-				if symbol.type == asm_funcs.SYMBOL_INTEGER:
-					self.children[0].assemble(assembler, procFuncHeadingScope) # RAX has the value
-					assembler.emitcode("MOV " + symbol.as_address() + ", RAX")
-				elif symbol.type == asm_funcs.SYMBOL_REAL:
-					self.children[0].assemble(assembler, procFuncHeadingScope) # XMM0 has the value
-					assembler.emitcode("MOVSD " + symbol.as_address() + ", XMM0")
-				elif symbol.type == asm_funcs.SYMBOL_STRING:
-					# two options - first, we are assigning from a string literal.
-					# second, we are assigning from some other string expression.
-					child = self.children[0]
-					if child.token.type == TOKEN_STRING_LITERAL:
-						assembler.emit_copyliteraltostring(symbol.as_address(), child.token.value)
+								assembler.emitcode("MOV [R11], RAX")
+							elif child.expressiontype == EXPRESSIONTYPE_REAL:
+								assembler.emitcode("MOV R11, " + symbol.as_address())
+								assembler.emitcode("MOVSD [R11], XMM0")
+							else: # pragma: no cover
+								raise ValueError("Invalid expressiontype")
 					else:
-						child.assemble(assembler, procFuncHeadingScope)  # Sets RAX pointing to the result
-						assembler.emit_copystring(symbol.as_address(), "rax")
-				elif symbol.type == asm_funcs.SYMBOL_FUNCTION:
-					if procFuncHeadingScope is not None:
-						if self.token.value == procFuncHeadingScope.name:
-							self.children[0].assemble(assembler, procFuncHeadingScope)  # Sets RAX or XMM0 to the value we return
-							if procFuncHeadingScope.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
-								assembler.emitcode("MOV " + procFuncHeadingScope.resultAddress + ", RAX")
+						# two options - first, we are assigning from a string literal.
+						# second, we are assigning from some other string expression.
+						if not symbol.isPointer():
+							if child.token.type == TOKEN_STRING_LITERAL:
+								assembler.emit_copyliteraltostring(symbol.as_address(), child.token.value)
+							elif child.token.type == TOKEN_CONCAT and child.token.value is False:
+								yield from child.assembleConcatArguments(assembler)
+								assembler.emit_concatstrings(symbol.as_address(), len(child.children))
 							else:
-								assembler.emitcode("MOVSD " + procFuncHeadingScope.resultAddress + ", XMM0")
-						else: # pragma: no cover
-							raise ValueError ("Cannot assign to a function inside another function: " + symbol.procfuncheading.name)
-					else: # pragma: no cover
-						raise ValueError ("Cannot assign to function outside of function scope: " + symbol.procfuncheading.name)
-				else: # pragma: no cover
-					raise ValueError ("Invalid variable type :" + asm_funcs.DEBUG_SYMBOLDISPLAY(symbol.type))
-		elif self.token.type == TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION:
-			# is this symbol a function parameter or local variable?
-			found_symbol = False
-			if not (procFuncHeadingScope is None):
-				if not (procFuncHeadingScope.localvariableSymbolTable is None):
-					if procFuncHeadingScope.localvariableSymbolTable.exists(self.token.value):
-						found_symbol = True
-						symbol = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value)
-						if symbol.type in [asm_funcs.SYMBOL_INTEGER, asm_funcs.SYMBOL_STRING]:
-							assembler.emitcode("MOV RAX, " + symbol.as_address())
-						elif symbol.type == asm_funcs.SYMBOL_REAL:
-							assembler.emitcode("MOVSD XMM0, " + symbol.as_address())
-						elif symbol.type in [asm_funcs.SYMBOL_INTEGER_PTR, asm_funcs.SYMBOL_STRING_PTR]:
+								yield child # RAX has the address of the resulting String
+								assembler.emit_copystring(symbol.as_address(), "RAX")
+						elif child.token.type == TOKEN_CONCAT and child.token.value is False:
+							yield from child.assembleConcatArguments(assembler)
 							assembler.emitcode("MOV R11, " + symbol.as_address())
-							assembler.emitcode("MOV RAX, [R11]")
-						elif symbol.type == asm_funcs.SYMBOL_REAL_PTR:
+							assembler.emit_concatstrings("[R11]", len(child.children))
+						else:
+							yield child
 							assembler.emitcode("MOV R11, " + symbol.as_address())
-							assembler.emitcode("MOVDQU XMM0, [R11]")
-						else: # pragma: no cover
-							raise ValueError ("Unhandled Symbol Type")
-				if found_symbol == False:
-					# Even though functions now copy their parameters to the stack, so there is no reason
-					# to check the parameter list, at some point we may optimize the code by only copying parameters
-					# to the stack if they are passed byRef or used in function invocations within the current function.
-					# So, I am leaving the parameter list check here.
-					reg = procFuncHeadingScope.getRegisterForParameterName(self.token.value)
-					if not (reg is None):
-						found_symbol = True
-						paramtype = procFuncHeadingScope.parameters[procFuncHeadingScope.getParameterPos[self.token.value]].type
-						if paramtype == TOKEN_VARIABLE_TYPE_INTEGER:
-							assembler.emitcode("MOV RAX, " + reg)
-						elif paramtype == TOKEN_VARIABLE_TYPE_REAL:
-							assembler.emitcode("MOVSD XMM0, " + reg)
-						else: # pragma: no cover
-							raise ValueError("Invalid Parameter Type")
-
-			if found_symbol == False:
-				# Check to see if it is a global variable
-				symbol = assembler.variable_symbol_table.get(self.token.value)
-				if symbol.type in [asm_funcs.SYMBOL_INTEGER, asm_funcs.SYMBOL_STRING]:
-					assembler.emitcode("MOV RAX, " + symbol.as_address())
-				elif symbol.type == asm_funcs.SYMBOL_REAL:
-					assembler.emitcode("MOVSD XMM0, " + symbol.as_address())
-				elif symbol.type == asm_funcs.SYMBOL_FUNCTION:
-					# call the function - return value is in RAX or XMM0
-					self.assembleProcFuncInvocation(assembler, procFuncHeadingScope, symbol)
+							assembler.emit_copystring("[R11]", "RAX")
+
+		if found_symbol == False:
+			# Must be a global variable or a function
+			symbol = assembler.variable_symbol_table.get(self.token.value)
+			if symbol.type == asm_funcs.SYMBOL_INTEGER:
+				yield self.children[0] # RAX has the value
+				assembler.emitcode("MOV " + symbol.as_address() + ", RAX")
+			elif symbol.type == asm_funcs.SYMBOL_REAL:
+				yield self.children[0] # XMM0 has the value
+				assembler.emitcode("MOVSD " + symbol.as_address() + ", XMM0")
+			elif symbol.type == asm_funcs.SYMBOL_STRING:
+				# two options - first, we are assigning from a string literal.
+				# second, we are assigning from some other string expression.
+				child = self.children[0]
+				if child.token.type == TOKEN_STRING_LITERAL:
+					assembler.emit_copyliteraltostring(symbol.as_address(), child.token.value)
+				elif child.token.type == TOKEN_CONCAT and child.token.value is False:
+					# built in the variable itself, see assignsConcatInPlace()
+					yield from child.assembleConcatArguments(assembler)
+					assembler.emit_concatstrings(symbol.as_address(), len(child.children))
+				else:
+					yield child  # Sets RAX pointing to the result
+					assembler.emit_copystring(symbol.as_address(), "rax")
+			elif symbol.type == asm_funcs.SYMBOL_FUNCTION:
+				if procFuncHeadingScope is not None:
+					if self.token.value == procFuncHeadingScope.name:
+						yield self.children[0]  # Sets RAX or XMM0 to the value we return
+						if procFuncHeadingScope.returntype == TOKEN_VARIABLE_TYPE_INTEGER:
+							assembler.emitcode("MOV " + procFuncHeadingScope.resultAddress + ", RAX")
+						else:
+							assembler.emitcode("MOVSD " + procFuncHeadingScope.resultAddress + ", XMM0")
+					else: # pragma: no cover
+						raise ValueError ("Cannot assign to a function inside another function: " + symbol.procfuncheading.name)
 				else: # pragma: no cover
-					raise ValueError ("Invalid variable type :" + vartuple[0])
-		elif self.token.type == TOKEN_PROCEDURE_CALL:
-			if not assembler.variable_symbol_table.exists(self.token.value): # pragma: no cover
-				raise ValueError("Invalid procedure name: " + self.token.value)
+					raise ValueError ("Cannot assign to function outside of function scope: " + symbol.procfuncheading.name)
+			else: # pragma: no cover
+				raise ValueError ("Invalid variable type :" + asm_funcs.DEBUG_SYMBOLDISPLAY(symbol.type))
+
+	def assembleVariableEvaluation(self, assembler, procFuncHeadingScope):
+		# is this symbol a function parameter or local variable?
+		found_symbol = False
+		if not (procFuncHeadingScope is None):
+			if not (procFuncHeadingScope.localvariableSymbolTable is None):
+				if procFuncHeadingScope.localvariableSymbolTable.exists(self.token.value):
+					found_symbol = True
+					symbol = procFuncHeadingScope.localvariableSymbolTable.get(self.token.value)
+					if symbol.type in [asm_funcs.SYMBOL_INTEGER, asm_funcs.SYMBOL_STRING]:
+						assembler.emitcode("MOV RAX, " + symbol.as_address())
+					elif symbol.type == asm_funcs.SYMBOL_REAL:
+						assembler.emitcode("MOVSD XMM0, " + symbol.as_address())
+					elif symbol.type in [asm_funcs.SYMBOL_INTEGER_PTR, asm_funcs.SYMBOL_STRING_PTR]:
+						# RAX, not R11, so that a value held in the expression registers is not clobbered
+						assembler.emitcode("MOV RAX, " + symbol.as_address())
+						assembler.emitcode("MOV RAX, [RAX]")
+					elif symbol.type == asm_funcs.SYMBOL_REAL_PTR:
+						assembler.emitcode("MOV RAX, " + symbol.as_address())
+						assembler.emitcode("MOVSD XMM0, [RAX]")
+					else: # pragma: no cover
+						raise ValueError ("Unhandled Symbol Type")
+		if found_symbol == False:
+			# Check to see if it is a global variable
 			symbol = assembler.variable_symbol_table.get(self.token.value)
-			self.assembleProcFuncInvocation(assembler, procFuncHeadingScope, symbol)
-		elif self.token.type in (TOKEN_FUNCTION, TOKEN_PROCEDURE) :
-			pass # proc/function declarations are asseembled earlier
-		elif self.token.type == TOKEN_VAR:
-			pass  # variable declarations are assembled earlier
-		elif self.token.type == TOKEN_NOOP:
-			pass  # nothing to do for a noop.
-		elif self.token.type in [TOKEN_BEGIN, TOKEN_PROCFUNC_DECLARATION_PART, TOKEN_PROGRAM] :
-			for child in self.children:
-				child.assemble(assembler, procFuncHeadingScope)
-		else: # pragma: no cover
+			if symbol.type in [asm_funcs.SYMBOL_INTEGER, asm_funcs.SYMBOL_STRING]:
+				assembler.emitcode("MOV RAX, " + symbol.as_address())
+			elif symbol.type == asm_funcs.SYMBOL_REAL:
+				assembler.emitcode("MOVSD XMM0, " + symbol.as_address())
+			elif symbol.type == asm_funcs.SYMBOL_FUNCTION:
+				# call the function - return value is in RAX or XMM0
+				return self.assembleProcFuncInvocation(assembler, procFuncHeadingScope, symbol)
+			else: # pragma: no cover
+				raise ValueError ("Invalid variable type :" + vartuple[0])
+
+	def assembleProcedureCall(self, assembler, procFuncHeadingScope):
+		if not assembler.variable_symbol_table.exists(self.token.value): # pragma: no cover
+			raise ValueError("Invalid procedure name: " + self.token.value)
+		symbol = assembler.variable_symbol_table.get(self.token.value)
+		return self.assembleProcFuncInvocation(assembler, procFuncHeadingScope, symbol)
+
+	def assembleChildren(self, assembler, procFuncHeadingScope):
+		for child in self.children:
+			yield child
+
+	def assembleNothing(self, assembler, procFuncHeadingScope):
+		pass  # proc/function and variable declarations are assembled earlier, and there is nothing to do for a noop.
+
+	def assembleSteps(self, assembler, procFuncHeadingScope):
+		# The assembly handlers that need code for a child emitted before they can go on yield that child.  They
+		# return a generator, or None if they have no children to assemble.
+		handler = AST_ASSEMBLERS.get(self.token.type)
+		if handler is None: # pragma: no cover
 			raise ValueError("Unexpected Token :" + DEBUG_TOKENDISPLAY(self.token.type))
+		return handler(self, assembler, procFuncHeadingScope)
+
+	def assemble(self, assembler, procFuncHeadingScope):
+		runSteps(self.assembleSteps(assembler, procFuncHeadingScope), lambda child: child.assembleSteps(assembler, procFuncHeadingScope))
+
+
+# What AST.type_check_node() and AST.assemble() do for each token type.  Token types with no type checker have no
+# expression type of their own.
+AST_TYPE_CHECKERS = {
+	TOKEN_INT: AST.typeCheckIntegerLiteral,
+	TOKEN_REAL: AST.typeCheckRealLiteral,
+	TOKEN_STRING: AST.typeCheckString,
+	TOKEN_STRING_LITERAL: AST.typeCheckString,
+	TOKEN_CONCAT: AST.typeCheckString,
+	TOKEN_PLUS: AST.typeCheckPlus,
+	TOKEN_MINUS: AST.typeCheckMinusOrMult,
+	TOKEN_MULT: AST.typeCheckMinusOrMult,
+	TOKEN_IDIV: AST.typeCheckIntegerDivision,
+	TOKEN_MOD: AST.typeCheckIntegerDivision,
+	TOKEN_DIV: AST.typeCheckDivide,
+	TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT: AST.typeCheckVariable,
+	TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION: AST.typeCheckVariable
+}
+for tokentype in RELOP_TOKEN_TYPES:
+	AST_TYPE_CHECKERS[tokentype] = AST.typeCheckRelOp
+
+REGISTERS_NEEDED_TOKEN_TYPES = MATHOP_TOKEN_TYPES | RELOP_TOKEN_TYPES
+
+# The nodes that AST.declare_global_variable() declares
+GLOBAL_DECLARATION_TOKEN_TYPES = frozenset([TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL, TOKEN_VARIABLE_TYPE_STRING, TOKEN_FUNCTION, TOKEN_PROCEDURE])
+# The simple statements, each of which can use the main program's concat temp strings afresh (see AST.find_concat_node())
+STATEMENT_TOKEN_TYPES = frozenset([TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT, TOKEN_PROCEDURE_CALL, TOKEN_WRITE, TOKEN_WRITELN])
+
+AST_ASSEMBLERS = {
+	TOKEN_INT: AST.assembleIntegerLiteral,
+	TOKEN_REAL: AST.assembleRealLiteral,
+	TOKEN_STRING_LITERAL: AST.assembleStringLiteral,
+	TOKEN_PLUS: AST.assembleMathOperation,
+	TOKEN_MINUS: AST.assembleMathOperation,
+	TOKEN_MULT: AST.assembleMathOperation,
+	TOKEN_DIV: AST.assembleMathOperation,
+	TOKEN_SHIFT_LEFT: AST.assembleShiftLeft,
+	TOKEN_SHIFT_DIV: AST.assembleShiftOrMask,
+	TOKEN_MASK_MOD: AST.assembleShiftOrMask,
+	TOKEN_IDIV: AST.assembleIntegerDivision,
+	TOKEN_MOD: AST.assembleIntegerDivision,
+	TOKEN_IF: AST.assembleIf,
+	TOKEN_WHILE: AST.assembleWhile,
+	TOKEN_WRITELN: AST.assembleWrite,
+	TOKEN_WRITE: AST.assembleWrite,
+	TOKEN_CONCAT: AST.assembleConcat,
+	TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT: AST.assembleAssignment,
+	TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION: AST.assembleVariableEvaluation,
+	TOKEN_PROCEDURE_CALL: AST.assembleProcedureCall,
+	TOKEN_FUNCTION: AST.assembleNothing,
+	TOKEN_PROCEDURE: AST.assembleNothing,
+	TOKEN_VAR: AST.assembleNothing,
+	TOKEN_NOOP: AST.assembleNothing,
+	TOKEN_BEGIN: AST.assembleChildren,
+	TOKEN_PROCFUNC_DECLARATION_PART: AST.assembleChildren,
+	TOKEN_PROGRAM: AST.assembleChildren
+}
+for tokentype in RELOP_TOKEN_TYPES:
+	AST_ASSEMBLERS[tokentype] = AST.assembleRelOp
+
+
+# The passes over the AST are run by a PassManager, which fuses the passes that visit one node at a time so that they
+# share as few walks over the tree as possible.  A walk goes through the tree once, left to right, calling the
+# preorder passes on each node before its children and collecting the nodes in postorder.  Then it calls the
+# postorder passes on the collected nodes, so that each node comes after its children.  So every preorder pass of a
+# walk is done with the whole tree before the first postorder pass of that walk starts.
+PASS_PREORDER = 0  # visit(node, assembler, procFuncHeading) is called for each node before its children
+PASS_POSTORDER = 1  # visit(node, assembler, procFuncHeading) is called for each node after its children
+PASS_WHOLE_TREE = 2  # visit(ast, assembler) is called once with the root, in a walk of its own
+
+class ASTPass:
+	def __init__(self, name, order, visit, tokentypes = None, requires = None, follows = None):
+		self.name = name
+		self.order = order
+		self.visit = visit
+		self.tokentypes = tokentypes  # only nodes with these token types are visited; None visits every node
+		if requires is None:
+			requires = []
+		if follows is None:
+			follows = []
+		self.requires = requires  # names of passes that have to be done with the whole tree before this one starts
+		self.follows = follows  # names of passes that have to be done with a node, and for a postorder pass with the nodes below it, before this one visits it
+		self.seconds = 0.0
+
+
+class PassManager:
+	def __init__(self, timing = False):
+		self.passes = []
+		self.timing = timing  # time each pass on its own.  Otherwise only the walks are timed, which costs nothing per node.
+		self.walks = []
+		self.walkseconds = []
+
+	def add(self, astpass):
+		names = [p.name for p in self.passes]
+		for name in astpass.requires + astpass.follows:
+			if not (name in names): # pragma: no cover
+				raise ValueError("Pass " + astpass.name + " depends on " + name + ", which has to be added first")
+		self.passes.append(astpass)
+
+	def canJoinWalk(self, astpass, walk):
+		for other in walk:
+			if other.name in astpass.requires:
+				if not (other.order == PASS_PREORDER and astpass.order == PASS_POSTORDER):
+					return False
+			elif other.name in astpass.follows:
+				if other.order == PASS_POSTORDER and astpass.order == PASS_PREORDER:
+					return False
+		return True
+
+	def schedule(self):
+		# Groups the passes, in the order they were added, into walks.  A pass joins the walk before it unless that
+		# walk has a pass it depends on which would not be done in time.
+		self.walks = []
+		walk = None
+		for astpass in self.passes:
+			if astpass.order == PASS_WHOLE_TREE:
+				self.walks.append([astpass])
+				walk = None
+			elif not (walk is None) and self.canJoinWalk(astpass, walk):
+				walk.append(astpass)
+			else:
+				walk = [astpass]
+				self.walks.append(walk)
+		return self.walks
+
+	def visitors(self, walk, order):
+		# Returns a dict of token type -> list of the visit functions to call for a node with that token type
+		ret = {}
+		for astpass in walk:
+			if astpass.order == order:
+				visit = astpass.visit
+				if self.timing:
+					visit = self.timedVisit(astpass)
+				tokentypes = astpass.tokentypes
+				if tokentypes is None:
+					tokentypes = TOKEN_DISPLAY.keys()
+				for tokentype in tokentypes:
+					ret.setdefault(tokentype, []).append(visit)
+		return ret
+
+	def timedVisit(self, astpass):
+		def visit(node, assembler, procFuncHeading):
+			start = time.perf_counter()
+			astpass.visit(node, assembler, procFuncHeading)
+			astpass.seconds += time.perf_counter() - start
+		return visit
+
+	def walk(self, ast, assembler, walk):
+		previsitors = self.visitors(walk, PASS_PREORDER)
+		postvisitors = self.visitors(walk, PASS_POSTORDER)
+		# A node is pushed back on the stack, below its children, after it has been visited in preorder.  When it
+		# comes off the stack again its children are done, so it goes on the list of nodes in postorder.
+		postorder = []
+		stack = [(ast, None, False)]
+		while len(stack) > 0:
+			node, procFuncHeading, childrendone = stack.pop()
+			if childrendone:
+				postorder.append((node, procFuncHeading))
+				continue
+			visits = previsitors.get(node.token.type)
+			if not (visits is None):
+				for visit in visits:
+					visit(node, assembler, procFuncHeading)
+			if len(node.children) > 0:
+				stack.append((node, procFuncHeading, True))
+				if not (node.procFuncHeading is None):
+					procFuncHeading = node.procFuncHeading
+				stack.extend([(child, procFuncHeading, False) for child in reversed(node.children)])
+			else:
+				postorder.append((node, procFuncHeading))
+		if len(postvisitors) > 0:
+			for node, procFuncHeading in postorder:
+				visits = postvisitors.get(node.token.type)
+				if not (visits is None):
+					for visit in visits:
+						visit(node, assembler, procFuncHeading)
+
+	def run(self, ast, assembler):
+		self.schedule()
+		self.walkseconds = []
+		for walk in self.walks:
+			start = time.perf_counter()
+			if walk[0].order == PASS_WHOLE_TREE:
+				walk[0].visit(ast, assembler)
+			else:
+				self.walk(ast, assembler, walk)
+			elapsed = time.perf_counter() - start
+			if walk[0].order == PASS_WHOLE_TREE:
+				walk[0].seconds += elapsed
+			self.walkseconds.append(elapsed)
+
+	def report(self):
+		numtreewalks = len([walk for walk in self.walks if walk[0].order != PASS_WHOLE_TREE])
+		ret = "Passes: " + str(len(self.passes)) + ", with " + str(numtreewalks) + " walk(s) over the tree, "
+		ret += "{:.2f}".format(sum(self.walkseconds) * 1000) + " ms\n"
+		i = 0
+		while i < len(self.walks):
+			walk = self.walks[i]
+			if walk[0].order == PASS_WHOLE_TREE:
+				ret += "\t" + walk[0].name + ": " + "{:.2f}".format(self.walkseconds[i] * 1000) + " ms\n"
+			else:
+				ret += "\tWalk over the tree: " + "{:.2f}".format(self.walkseconds[i] * 1000) + " ms\n"
+				passseconds = 0.0
+				for astpass in walk:
+					if self.timing:
+						ret += "\t\t" + astpass.name + ": " + "{:.2f}".format(astpass.seconds * 1000) + " ms\n"
+						passseconds += astpass.seconds
+					else: # pragma: no cover
+						ret += "\t\t" + astpass.name + "\n"
+				if self.timing:
+					ret += "\t\t(walking the tree and timing the passes): " + "{:.2f}".format((self.walkseconds[i] - passseconds) * 1000) + " ms\n"
+			i += 1
+		return ret
+
+
+# The Tokenizer matches the next token, and the white space and comments after it, with a single regular expression.
+# The name of the group that matched says what kind of token it is.  Real has to come before Integer so that 1.5 is
+# not read as 1 followed by ".5".  Symbols come first because they are the most common.
+WHITESPACE_AND_COMMENTS = r"\s*(?:\{[^}]*\}\s*)*"
+TOKENIZER_REGEX = re.compile(r"""
+	(?:(?P<symbol>:=|>=|<=|<>|[-+()*/;.:=<>,])
+	|(?P<identifier>[^\W\d_][^\W_]*)
+	|(?P<real>\d+\.\d+)
+	|(?P<integer>\d+)
+	|(?P<string>'[^']*(?:''[^']*)*'))
+	""" + WHITESPACE_AND_COMMENTS, re.VERBOSE)
+IDENTIFIER_REGEX = re.compile(r"[^\W\d_][^\W_]*")
+NUMBER_REGEX = re.compile(r"\d+(\.\d+)?")
+STRING_LITERAL_REGEX = re.compile(r"'[^']*(?:''[^']*)*'")
+COMMENTS_REGEX = re.compile(r"(?:\{[^}]*\}\s*)*")
+WHITESPACE_AND_COMMENTS_REGEX = re.compile(WHITESPACE_AND_COMMENTS)
+
+# The value of a "BEGIN" token is True/False whether or not it is "main."  It is set to True by the parser.
+KEYWORD_TOKENS = {
+	"begin": TOKEN_BEGIN,
+	"end": TOKEN_END,
+	"writeln": TOKEN_WRITELN,
+	"write": TOKEN_WRITE,
+	"concat": TOKEN_CONCAT,
+	"if": TOKEN_IF,
+	"then": TOKEN_THEN,
+	"else": TOKEN_ELSE,
+	"while": TOKEN_WHILE,
+	"do": TOKEN_DO,
+	"program": TOKEN_PROGRAM,
+	"var": TOKEN_VAR,
+	"function": TOKEN_FUNCTION,
+	"procedure": TOKEN_PROCEDURE,
+	"integer": TOKEN_VARIABLE_TYPE_INTEGER,
+	"real": TOKEN_VARIABLE_TYPE_REAL,
+	"string": TOKEN_VARIABLE_TYPE_STRING,
+	"div": TOKEN_IDIV,
+	"mod": TOKEN_MOD
+}
+
+SYMBOL_TOKENS = {
+	"+": TOKEN_PLUS,
+	"-": TOKEN_MINUS,
+	"/": TOKEN_DIV,
+	"*": TOKEN_MULT,
+	"(": TOKEN_LPAREN,
+	")": TOKEN_RPAREN,
+	";": TOKEN_SEMICOLON,
+	".": TOKEN_PERIOD,
+	":": TOKEN_COLON,
+	",": TOKEN_COMMA,
+	":=": TOKEN_ASSIGNMENT_OPERATOR,
+	"=": TOKEN_RELOP_EQUALS,
+	"<>": TOKEN_RELOP_NOTEQ,
+	">": TOKEN_RELOP_GREATER,
+	">=": TOKEN_RELOP_GREATEREQ,
+	"<": TOKEN_RELOP_LESS,
+	"<=": TOKEN_RELOP_LESSEQ
+}
+
+# peekMatchStringAndSpace() compiles a regular expression for each keyword the first time it is asked for.  The
+# compiled expressions never change, so all compilations share them; two threads compiling the same one at once
+# just store equal values.
+KEYWORD_AND_SPACE_REGEXES = {}
 
 
 class Tokenizer:
@@ -1194,8 +2314,16 @@ class Tokenizer:
 		self.curPos = 0
 		self.text = text
 		self.length = len(text)
-		self.line_number = 1
-		self.line_position = 1
+
+	# The line and position are only needed for error messages, so they are worked out from curPos when asked for.
+	# This also keeps them right when the parser moves curPos back.
+	@property
+	def line_number(self):
+		return self.text.count("\n", 0, self.curPos) + 1
+
+	@property
+	def line_position(self):
+		return self.curPos - self.text.rfind("\n", 0, self.curPos)
 
 	def raiseTokenizeError(self, errormsg): # pragma: no cover
 		errstr = "Parse Error: " + errormsg + "\n"
@@ -1219,12 +2347,12 @@ class Tokenizer:
 	def peekMatchStringAndSpace(self, str):
 		# Looks to see if the next N characters match the string and then the N+1th character is whitespace.
 		# Purpose: to see if the next block of code begins with a specific keyword or such.
-		l = len(str)
-		nextN = self.peekMulti(l+1).lower()
-		if nextN[0:l] == str.lower() and nextN[l].isspace():
-			return True
-		else:
+		if not (str in KEYWORD_AND_SPACE_REGEXES):
+			KEYWORD_AND_SPACE_REGEXES[str] = re.compile(re.escape(str) + r"\s", re.IGNORECASE)
+		if KEYWORD_AND_SPACE_REGEXES[str].match(self.text, self.curPos) is None:
 			return False
+		else:
+			return True
 
 
 	def eat(self):
@@ -1233,58 +2361,37 @@ class Tokenizer:
 		else:
 			retChar = self.text[self.curPos]
 			self.curPos += 1
-			self.line_position += 1
 			return retChar
 
 	def getIdentifier(self):
 		# <identifier> ::= <letter> {<letter> | <digit>}
-		if self.peek().isalpha():
-			retVal = self.eat()
-			while self.peek().isalnum():
-				retVal += self.eat()
-			return retVal
-		else: # pragma: no cover
+		m = IDENTIFIER_REGEX.match(self.text, self.curPos)
+		if m is None: # pragma: no cover
 			self.raiseTokenizeError("Identifiers must begin with alpha character")
+		self.curPos = m.end()
+		return m.group()
 
 	def getNumber(self):
 		# <integer> ::= ["-"] <digit> {<digit>}
 		# <real> ::= ["-"]<digit>{digit}["."<digit>{digit}]
-		if self.peek().isdigit():
-			retval = self.eat()
-			while self.peek().isdigit():
-				retval += self.eat()
-			if self.peek() == "." and self.peekMulti(2)[1].isdigit():
-				retval += self.eat() # eat the period
-				while self.peek().isdigit():
-					retval += self.eat()
-				return float(retval)
-			else:
-				return int(retval)
-
-		else: # pragma: no cover
+		m = NUMBER_REGEX.match(self.text, self.curPos)
+		if m is None: # pragma: no cover
 			self.raiseTokenizeError("Numbers must be numeric")
+		self.curPos = m.end()
+		if m.group(1) is None:
+			return int(m.group())
+		else:
+			return float(m.group())
 
 	def getStringLiteral(self):
 		# <string literal> = "'" {<any character>} "'"  # note - apostrophes in string literals have to be escaped by using two apostrophes
 		if self.peek() != "'": # pragma: no cover
 			self.raiseTokenizeError("Strings must begin with an apostrophe.")
-		self.eat()
-		ret = ""
-		done = False
-		while not done:
-			if self.peek() == "'" and self.peekMulti(2) != "''":
-				done = True
-			elif self.peekMulti(2) == "''":
-				ret += "'"
-				self.eat() #eat first apostrophe
-				self.eat() #eat second apostrophe
-			elif self.peek() == "": # pragma: no cover
-				self.raiseTokenizeError("End of input reached inside quoted string")
-			else:
-				ret += self.eat()
-		self.eat() # eat closing apostrophe
-		return ret
-
+		m = STRING_LITERAL_REGEX.match(self.text, self.curPos)
+		if m is None: # pragma: no cover
+			self.raiseTokenizeError("End of input reached inside quoted string")
+		self.curPos = m.end()
+		return m.group()[1:-1].replace("''", "'")
 
 	def getSymbol(self):
 		if isSymbol(self.peek()):
@@ -1293,19 +2400,8 @@ class Tokenizer:
 			self.raiseTokenizeError("Symbol Expected")
 
 	def eatComments(self):
-		while self.peek() == "{":
-			while self.peek() != "}":
-				if self.peek() == "\n":
-					self.line_number += 1
-					self.line_position += 1
-				self.eat()
-			self.eat()  # eat the "}"
-			# get rid of any white space that follows comments
-			while self.peek().isspace():
-				if self.peek() == "\n":
-					self.line_number += 1
-					self.line_position = 1
-				self.eat()
+		# eats any comments and the white space that follows them
+		self.curPos = COMMENTS_REGEX.match(self.text, self.curPos).end()
 
 
 	def getNextToken(self, requiredtokentype=None):
@@ -1318,131 +2414,127 @@ class Tokenizer:
 				errstr = "Expected " + DEBUG_TOKENDISPLAY(requiredtokentype) # pragma: no cover
 			self.raiseTokenizeError("Unexpected end of input. " + errstr) # pragma: no cover
 		else:
-			if self.peek().isalpha():
-				ident = self.getIdentifier().lower()
-				if ident == "begin":
-					ret = Token(TOKEN_BEGIN, False)  # The value of a "BEGIN" token is True/False whether or not it is "main."
-				elif ident == "end":
-					ret = Token(TOKEN_END, None)
-				elif ident == "writeln":
-					ret = Token(TOKEN_WRITELN, None)
-				elif ident == "write":
-					ret = Token(TOKEN_WRITE, None)
-				elif ident == "concat":
-					ret = Token(TOKEN_CONCAT, None)
-				elif ident == "if":
-					ret = Token(TOKEN_IF, None)
-				elif ident == "then":
-					ret = Token(TOKEN_THEN, None)
-				elif ident == "else":
-					ret = Token(TOKEN_ELSE, None)
-				elif ident == "while":
-					ret = Token(TOKEN_WHILE, None)
-				elif ident == "do":
-					ret = Token(TOKEN_DO, None)
-				elif ident == "program":
-					ret = Token(TOKEN_PROGRAM, None)
-				elif ident == "var":
-					ret = Token(TOKEN_VAR, None)
-				elif ident == "function":
-					ret = Token(TOKEN_FUNCTION, None)
-				elif ident == "procedure":
-					ret = Token(TOKEN_PROCEDURE, None)
-				elif ident == "integer":
-					ret = Token(TOKEN_VARIABLE_TYPE_INTEGER, None)
-				elif ident == "real":
-					ret = Token(TOKEN_VARIABLE_TYPE_REAL, None)
-				elif ident == "string":
-					ret = Token(TOKEN_VARIABLE_TYPE_STRING, None)
-				elif ident == "div":
-					ret = Token(TOKEN_IDIV, None)
-				elif ident == "mod":
-					ret = Token(TOKEN_MOD, None)
-				else:  # assume any other identifier is a variable; if inappropriate, it will throw an error later in parsing.
-					ret = Token(TOKEN_IDENTIFIER, ident)
-			elif self.peek().isdigit():
-				num = self.getNumber()
-				if isinstance(num, int):
-					ret = Token(TOKEN_INT, num)
+			m = TOKENIZER_REGEX.match(self.text, self.curPos)
+			if m is None: # pragma: no cover
+				if self.peek() == "'":
+					self.raiseTokenizeError("End of input reached inside quoted string")
 				else:
-					ret = Token(TOKEN_REAL, num)
-			elif self.peek() == "'":
-				ret = Token(TOKEN_STRING_LITERAL, self.getStringLiteral())
-			elif isSymbol(self.peek()):
-				sym = self.getSymbol()
-				# multi-character symbols we support will be
-				# := >= <= <>
-				if (sym in (":", ">", "<") and self.peek() == "=") or (sym == "<" and self.peek() == ">"):
-					sym += self.getSymbol()
-
-				if sym == "+":
-					ret = Token(TOKEN_PLUS, None)
-				elif sym == "-":
-					ret = Token(TOKEN_MINUS, None)
-				elif sym == "/":
-					ret = Token(TOKEN_DIV, None)
-				elif sym == "*":
-					ret = Token(TOKEN_MULT, None)
-				elif sym == "(":
-					ret = Token(TOKEN_LPAREN, None)
-				elif sym == ")":
-					ret = Token(TOKEN_RPAREN, None)
-				elif sym == ";":
-					ret = Token(TOKEN_SEMICOLON, None)
-				elif sym == ".":
-					ret = Token(TOKEN_PERIOD, None)
-				elif sym == ":":
-					ret = Token(TOKEN_COLON, None)
-				elif sym == ",":
-					ret = Token(TOKEN_COMMA, None)
-				elif sym == ":=":
-					ret = Token(TOKEN_ASSIGNMENT_OPERATOR, None)
-				elif sym == "=":
-					ret = Token(TOKEN_RELOP_EQUALS, None)
-				elif sym == "<>":
-					ret = Token(TOKEN_RELOP_NOTEQ, None)
-				elif sym == ">":
-					ret = Token(TOKEN_RELOP_GREATER, None)
-				elif sym == ">=":
-					ret = Token(TOKEN_RELOP_GREATEREQ, None)
-				elif sym == "<":
-					ret = Token(TOKEN_RELOP_LESS, None)
-				elif sym == "<=":
-					ret = Token(TOKEN_RELOP_LESSEQ, None)
-				else: # pragma: no cover
-					self.raiseTokenizeError("Unrecognized Token: " + sym)
-			else:  # pragma: no cover
-				self.raiseTokenizeError("Unrecognized Token: " + self.peek())
-
-			while self.peek().isspace():
-				if self.peek() == "\n":
-					self.line_number += 1
-					self.line_position = 1
-				self.eat()
+					self.raiseTokenizeError("Unrecognized Token: " + self.peek())
+			kind = m.lastgroup
+			value = m.group(kind)
+			tokenvalue = None
+			# most common first
+			if kind == "symbol":
+				tokentype = SYMBOL_TOKENS[value]
+			elif kind == "identifier":
+				ident = value.lower()
+				if ident in KEYWORD_TOKENS:
+					tokentype = KEYWORD_TOKENS[ident]
+					if tokentype == TOKEN_BEGIN:
+						tokenvalue = False
+				else:  # assume any other identifier is a variable; if inappropriate, it will throw an error later in parsing.
+					tokentype = TOKEN_IDENTIFIER
+					tokenvalue = ident
+			elif kind == "integer":
+				tokentype = TOKEN_INT
+				tokenvalue = int(value)
+			elif kind == "real":
+				tokentype = TOKEN_REAL
+				tokenvalue = float(value)
+			else:
+				tokentype = TOKEN_STRING_LITERAL
+				tokenvalue = value[1:-1].replace("''", "'")
+			ret = Token(tokentype, tokenvalue, m.start(), m.end(kind))
 
 			if not (requiredtokentype is None):
 				if ret.type != requiredtokentype: # pragma: no cover
 					self.raiseTokenizeError("Expected " + DEBUG_TOKENDISPLAY(requiredtokentype) + ", got " + DEBUG_TOKENDISPLAY(ret.type))
 
-			self.eatComments()
+			self.curPos = m.end()  # past the white space and comments that follow the token
 
 			return ret
 
+	def tokenize(self):
+		# Returns the list of all the Tokens in the text, from curPos on
+		self.curPos = WHITESPACE_AND_COMMENTS_REGEX.match(self.text, self.curPos).end()
+		ret = []
+		while self.curPos < self.length:
+			ret.append(self.getNextToken())
+		return ret
+
+
+class TokenStream:
+	# The Tokens of a program, tokenized once up front, for the Parser to read with as much lookahead as it needs.
+	def __init__(self, tokenizer):
+		self.text = tokenizer.text
+		self.tokens = tokenizer.tokenize()
+		self.types = [tok.type for tok in self.tokens]  # so lookahead does not go through Token.type
+		self.numtokens = len(self.tokens)
+		self.pos = 0  # index of the next Token
+		self.lastend = 0  # where the last Token read ends in the text
+		self.eof = Token(TOKEN_EOF, None, len(self.text), len(self.text))
+
+	@property
+	def line_number(self):
+		return self.text.count("\n", 0, self.peek().start) + 1
+
+	@property
+	def line_position(self):
+		return self.peek().start - self.text.rfind("\n", 0, self.peek().start)
+
+	def raiseTokenizeError(self, errormsg): # pragma: no cover
+		errstr = "Parse Error: " + errormsg + "\n"
+		errstr += "Line: " + str(self.line_number) + ", Position: " + str(self.line_position) + "\n"
+		if self.peektype() == TOKEN_EOF:
+			errstr += "at EOF"
+		else:
+			errstr += "Immediately prior to: " + self.text[self.peek().start:self.peek().start + 10]
+		raise ValueError(errstr)
+
+	def peek(self, k = 0):
+		# Returns the Token k Tokens after the next one, without reading it
+		if self.pos + k < self.numtokens:
+			return self.tokens[self.pos + k]
+		else:
+			return self.eof
+
+	def peektype(self, k = 0):
+		i = self.pos + k
+		if i < self.numtokens:
+			return self.types[i]
+		else:
+			return TOKEN_EOF
+
+	def nextstart(self):
+		# where the next Token starts in the text
+		return self.peek().start
+
+	def getNextToken(self, requiredtokentype=None):
+		# if the next Token must be of a certain type, passing that type in
+		# will lead to validation.
+		if self.pos >= self.numtokens: # pragma: no cover
+			errstr = ""
+			if not (requiredtokentype is None):
+				errstr = "Expected " + DEBUG_TOKENDISPLAY(requiredtokentype)
+			self.raiseTokenizeError("Unexpected end of input. " + errstr)
+		if not (requiredtokentype is None):
+			if self.types[self.pos] != requiredtokentype: # pragma: no cover
+				self.raiseTokenizeError("Expected " + DEBUG_TOKENDISPLAY(requiredtokentype) + ", got " + DEBUG_TOKENDISPLAY(self.types[self.pos]))
+		ret = self.tokens[self.pos]
+		self.pos += 1
+		self.lastend = ret.end
+		return ret
+
 
 class Parser:
 	def __init__(self, tokenizer):
 		self.tokenizer = tokenizer
+		self.tokens = None  # the TokenStream, created by parse()
 		self.AST = None
 		self.asssembler = None
 
 	def raiseParseError(self, errormsg): # pragma: no cover
-		errstr = "Parse Error: " + errormsg + "\n"
-		errstr += "Line: " + str(self.tokenizer.line_number) + ", Position: " + str(self.tokenizer.line_position) + "\n"
-		if self.tokenizer.peek() == "":
-			errstr += "at EOF"
-		else:
-			errstr += "Immediately prior to: " + self.tokenizer.peekMulti(10)
-		raise ValueError(errstr)
+		self.tokens.raiseTokenizeError(errormsg)
 
 	def parseReservedFunction(self, functoken):
 		# Concat is a function, so is covered in the <function designator> BNF, however I have it here for my benefit.
@@ -1450,18 +2542,18 @@ class Parser:
 		# <string parameter> :: <string literal> | <variable identifier>
 		if functoken.type == TOKEN_CONCAT:
 			ret = AST(functoken)
-			lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
+			lparen = self.tokens.getNextToken(TOKEN_LPAREN)
 			# Need to have at least two children
 			ret.children.append(self.parseStringParameter())
-			comma = self.tokenizer.getNextToken(TOKEN_COMMA)
+			comma = self.tokens.getNextToken(TOKEN_COMMA)
 			done = False
 			while not done:
 				ret.children.append(self.parseStringParameter())
-				if self.tokenizer.peek() == ")":
+				if self.tokens.peektype() == TOKEN_RPAREN:
 					done = True
 				else:
-					comma = self.tokenizer.getNextToken(TOKEN_COMMA)
-			rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
+					comma = self.tokens.getNextToken(TOKEN_COMMA)
+			rparen = self.tokens.getNextToken(TOKEN_RPAREN)
 		else: # pragma: no cover
 			raise ValueError("Invalid Reserved Function " + DEBUG_TOKENDISPLAY(functoken))
 		return ret
@@ -1474,13 +2566,13 @@ class Parser:
 		# <actual parameter list> ::= "(" <simple expression> {"," <simple expression>} ")"
 
 
-		if self.tokenizer.peek() == "(":
+		if self.tokens.peektype() == TOKEN_LPAREN:
 			# parens do not go in the AST
-			lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
+			lparen = self.tokens.getNextToken(TOKEN_LPAREN)
 			ret = self.parseSimpleExpression()
-			rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
+			rparen = self.tokens.getNextToken(TOKEN_RPAREN)
 		else:
-			factor = self.tokenizer.getNextToken()
+			factor = self.tokens.getNextToken()
 			if factor.isReservedFunction():
 				ret = self.parseReservedFunction(factor)
 			elif factor.type == TOKEN_IDENTIFIER:
@@ -1488,19 +2580,19 @@ class Parser:
 				factor.type = TOKEN_VARIABLE_IDENTIFIER_FOR_EVALUATION
 				ret = AST(factor)
 
-				if self.tokenizer.peek() == "(":
+				if self.tokens.peektype() == TOKEN_LPAREN:
 					# this is a function invocation - but at this point we cannot tell if it is
 					# a valid function.  Invalid invocations will error later.
-					lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
+					lparen = self.tokens.getNextToken(TOKEN_LPAREN)
 					ret.children.append(self.parseSimpleExpression())
-					while self.tokenizer.peek() == ",":
-						comma = self.tokenizer.getNextToken(TOKEN_COMMA)
+					while self.tokens.peektype() == TOKEN_COMMA:
+						comma = self.tokens.getNextToken(TOKEN_COMMA)
 						ret.children.append(self.parseSimpleExpression())
-					rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
+					rparen = self.tokens.getNextToken(TOKEN_RPAREN)
 
 			else:
 				if factor.type == TOKEN_MINUS:
-					factor = self.tokenizer.getNextToken()
+					factor = self.tokens.getNextToken()
 					factor.value = -1 * factor.value
 				ret = AST(factor)
 
@@ -1516,8 +2608,8 @@ class Parser:
 	def parseTerm(self):
 		# <term> ::= <factor> { <multiplication operator> <factor> }
 		ret = self.parseFactor()
-		while self.tokenizer.peek() in ["*","/"] or self.tokenizer.peekMatchStringAndSpace("div") or self.tokenizer.peekMatchStringAndSpace("mod"):
-			multdiv = AST(self.tokenizer.getNextToken())
+		while self.tokens.peektype() in [TOKEN_MULT, TOKEN_DIV, TOKEN_IDIV, TOKEN_MOD]:
+			multdiv = AST(self.tokens.getNextToken())
 			multdiv.children.append(ret)
 			nextchild = self.parseFactor()
 			multdiv.children.append(nextchild)
@@ -1529,8 +2621,8 @@ class Parser:
 	def parseSimpleExpression(self):
 		# <simple expression> ::= <term> { <addition operator> <term> }    # Fred note - official BNF handles minus here, I do it in <integer>
 		ret = self.parseTerm()
-		while self.tokenizer.peek() in ['+', '-']:
-			addsub = AST(self.tokenizer.getNextToken())
+		while self.tokens.peektype() in [TOKEN_PLUS, TOKEN_MINUS]:
+			addsub = AST(self.tokens.getNextToken())
 			addsub.children.append(ret)
 			nextchild = self.parseTerm()
 			addsub.children.append(nextchild)
@@ -1540,11 +2632,8 @@ class Parser:
 	def parseExpression(self):
 		# <expression> ::= <simple expression> [<relational operator> <simple expression>]
 		first_simple_expression = self.parseSimpleExpression()
-		if self.tokenizer.peek() in [">", "<", "="]:
-			tok = self.tokenizer.getNextToken()
-			if not tok.isRelOp(): # pragma: no cover
-				raiseParseError("Relational Operator Expected, got: " + DEBUG_TOKENDISPLAY(tok.type))
-			ret = AST(tok)
+		if self.tokens.peek().isRelOp():
+			ret = AST(self.tokens.getNextToken())
 			next_simple_expression = self.parseSimpleExpression()
 			ret.children.append(first_simple_expression)
 			ret.children.append(next_simple_expression)
@@ -1555,30 +2644,28 @@ class Parser:
 
 	def parseIfStatement(self):
 		# <if statement> ::= "if" <expression> "then" <statement> ["else" <statement>]
-		startpos = self.tokenizer.curPos
-		ret = AST(self.tokenizer.getNextToken(TOKEN_IF))
+		startpos = self.tokens.nextstart()
+		ret = AST(self.tokens.getNextToken(TOKEN_IF))
 		expression = self.parseExpression()
-		endpos = self.tokenizer.curPos
-		ret.comment = self.tokenizer.text[startpos:endpos]
+		ret.comment = self.tokens.text[startpos:self.tokens.lastend]
 		ret.children.append(expression)
-		tok = self.tokenizer.getNextToken(TOKEN_THEN)
+		tok = self.tokens.getNextToken(TOKEN_THEN)
 		statement = self.parseStatement()
 		ret.children.append(statement)
-		if self.tokenizer.peekMatchStringAndSpace("else"):
-			tok = self.tokenizer.getNextToken(TOKEN_ELSE)
+		if self.tokens.peektype() == TOKEN_ELSE:
+			tok = self.tokens.getNextToken(TOKEN_ELSE)
 			elsestatement = self.parseStatement()
 			ret.children.append(elsestatement)
 		return ret
 
 	def parseWhileStatement(self):
 		# <while statement> ::= "while" <expression> "do" <statement>
-		startpos = self.tokenizer.curPos
-		ret = AST(self.tokenizer.getNextToken(TOKEN_WHILE))
+		startpos = self.tokens.nextstart()
+		ret = AST(self.tokens.getNextToken(TOKEN_WHILE))
 		expression = self.parseExpression()
-		endpos = self.tokenizer.curPos
-		ret.comment = self.tokenizer.text[startpos:endpos]
+		ret.comment = self.tokens.text[startpos:self.tokens.lastend]
 		ret.children.append(expression)
-		tok = self.tokenizer.getNextToken(TOKEN_DO)
+		tok = self.tokens.getNextToken(TOKEN_DO)
 		statement = self.parseStatement()
 		ret.children.append(statement)
 		return ret
@@ -1587,8 +2674,8 @@ class Parser:
 		# <string parameter> :: <simple expression> | <string literal>
 		# <string literal> = "'" {<any character>} "'"  # note - apostrophes in string literals have to be escaped by using two apostrophes
 		# <variable identifier> ::= <identifier>
-		if self.tokenizer.peek() == "'":
-			ret = AST(self.tokenizer.getNextToken(TOKEN_STRING_LITERAL))
+		if self.tokens.peektype() == TOKEN_STRING_LITERAL:
+			ret = AST(self.tokens.getNextToken(TOKEN_STRING_LITERAL))
 		else:
 			ret = self.parseSimpleExpression()
 		return ret
@@ -1608,37 +2695,38 @@ class Parser:
 		# <write parameter> ::= <simple expression> | <string literal>
 
 		# if next token is begin then it is a structured => compound statement
-		if self.tokenizer.peekMatchStringAndSpace("begin"):
+		nexttype = self.tokens.peektype()
+		if nexttype == TOKEN_BEGIN:
 			ret = self.parseCompoundStatement()
 		# if next token is if then it is a structured => if statement
-		elif self.tokenizer.peekMatchStringAndSpace("if"):
+		elif nexttype == TOKEN_IF:
 			ret = self.parseIfStatement()
-		elif self.tokenizer.peekMatchStringAndSpace("while"):
+		elif nexttype == TOKEN_WHILE:
 			ret = self.parseWhileStatement()
 		else:
-			startpos = self.tokenizer.curPos
-			tok = self.tokenizer.getNextToken()
+			startpos = self.tokens.nextstart()
 
-			if tok.type == TOKEN_WRITELN or tok.type == TOKEN_WRITE:
-				ret = AST(tok)
-				lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
+			if nexttype == TOKEN_WRITELN or nexttype == TOKEN_WRITE:
+				ret = AST(self.tokens.getNextToken())
+				lparen = self.tokens.getNextToken(TOKEN_LPAREN)
 				done = False
 				while not done:
-					if self.tokenizer.peek() == "'":
-						tobeprinted = AST(self.tokenizer.getNextToken(TOKEN_STRING_LITERAL))
+					if self.tokens.peektype() == TOKEN_STRING_LITERAL:
+						tobeprinted = AST(self.tokens.getNextToken(TOKEN_STRING_LITERAL))
 					else:
 						tobeprinted = self.parseSimpleExpression()
 					ret.children.append(tobeprinted)
-					if self.tokenizer.peek() == ")":
+					if self.tokens.peektype() == TOKEN_RPAREN:
 						done = True
 					else:
-						comma = self.tokenizer.getNextToken(TOKEN_COMMA)
-				rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
-			elif tok.type == TOKEN_IDENTIFIER:
-				if self.tokenizer.peekMulti(2) == ":=":
+						comma = self.tokens.getNextToken(TOKEN_COMMA)
+				rparen = self.tokens.getNextToken(TOKEN_RPAREN)
+			elif nexttype == TOKEN_IDENTIFIER:
+				tok = self.tokens.getNextToken()
+				if self.tokens.peektype() == TOKEN_ASSIGNMENT_OPERATOR:
 					# we are assigning here
 					tok.type = TOKEN_VARIABLE_IDENTIFIER_FOR_ASSIGNMENT
-					assignment_operator = self.tokenizer.getNextToken(TOKEN_ASSIGNMENT_OPERATOR)
+					assignment_operator = self.tokens.getNextToken(TOKEN_ASSIGNMENT_OPERATOR)
 					ret = AST(tok)
 					ret.children.append(self.parseSimpleExpression())
 				else:
@@ -1646,35 +2734,37 @@ class Parser:
 					# and ignoring the result, so this cannot be a function invocation.
 					tok.type = TOKEN_PROCEDURE_CALL
 					ret = AST(tok)
-					if self.tokenizer.peek() == "(":
+					if self.tokens.peektype() == TOKEN_LPAREN:
 						# this is a procedure invocation (or
-						lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
+						lparen = self.tokens.getNextToken(TOKEN_LPAREN)
 						ret.children.append(self.parseSimpleExpression())
-						while self.tokenizer.peek() == ",":
-							comma = self.tokenizer.getNextToken(TOKEN_COMMA)
+						while self.tokens.peektype() == TOKEN_COMMA:
+							comma = self.tokens.getNextToken(TOKEN_COMMA)
 							ret.children.append(self.parseSimpleExpression())
-						rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
+						rparen = self.tokens.getNextToken(TOKEN_RPAREN)
 			else:
-				self.tokenizer.curPos = startpos
+				# empty statement; the next token belongs to whatever follows it
 				ret = AST(Token(TOKEN_NOOP, None))
 
-			endpos = self.tokenizer.curPos
-			ret.comment = self.tokenizer.text[startpos:endpos]
+			if ret.token.type == TOKEN_NOOP:
+				ret.comment = ""
+			else:
+				ret.comment = self.tokens.text[startpos:self.tokens.lastend]
 
 		return ret
 
 	def parseCompoundStatement(self):
 		# <compound statement> ::= "begin" <statement sequence> "end"
 		# <statement sequence> ::= <statement> | <statement> ';' <statement sequence>
-		ret = AST(self.tokenizer.getNextToken(TOKEN_BEGIN))
+		ret = AST(self.tokens.getNextToken(TOKEN_BEGIN))
 
 		statement = self.parseStatement()
 		ret.children.append(statement)
-		while self.tokenizer.peek() == ";":
-			semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
+		while self.tokens.peektype() == TOKEN_SEMICOLON:
+			semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
 			statement = self.parseStatement()
 			ret.children.append(statement)
-		end = self.tokenizer.getNextToken(TOKEN_END)
+		end = self.tokens.getNextToken(TOKEN_END)
 		return ret
 
 	def parseStatementPart(self):
@@ -1688,31 +2778,27 @@ class Parser:
 		# <variable declaration> ::= <identifier list> ":" <type>
 		# <identifier list> ::= <identifier> {"," <identifier>}
 		# <type> ::= "integer" | "real" | "string"
-		ret = AST(self.tokenizer.getNextToken(TOKEN_VAR))
+		ret = AST(self.tokens.getNextToken(TOKEN_VAR))
 		done = False
 		while not done:
 			# I do not know how to recognize the end of the variable section without looking ahead
 			# to the next section, which is either <procedure and function declaration part> or
 			# the <statement part>.  <statement part> starts with "begin".
 			# <procedure and function declaration part> starts with "function" or "procedure."
-			# So, we are done when the next N characters are BEGIN/FUNCTION/PROCEDURE plus whitespace.
-			if self.tokenizer.peekMatchStringAndSpace("begin"):
-				done = True
-			elif self.tokenizer.peekMatchStringAndSpace("function"):
-				done = True
-			elif self.tokenizer.peekMatchStringAndSpace("procedure"):
+			# So, we are done when the next token is BEGIN/FUNCTION/PROCEDURE.
+			if self.tokens.peektype() in [TOKEN_BEGIN, TOKEN_FUNCTION, TOKEN_PROCEDURE]:
 				done = True
 			else:
 				ident_token_list = []
-				ident_token_list.append(self.tokenizer.getNextToken(TOKEN_IDENTIFIER))
-				while self.tokenizer.peek() == ",":
-					comma = self.tokenizer.getNextToken(TOKEN_COMMA)
-					ident_token_list.append(self.tokenizer.getNextToken(TOKEN_IDENTIFIER))
-				colon_token = self.tokenizer.getNextToken(TOKEN_COLON)
-				type_token = self.tokenizer.getNextToken()
+				ident_token_list.append(self.tokens.getNextToken(TOKEN_IDENTIFIER))
+				while self.tokens.peektype() == TOKEN_COMMA:
+					comma = self.tokens.getNextToken(TOKEN_COMMA)
+					ident_token_list.append(self.tokens.getNextToken(TOKEN_IDENTIFIER))
+				colon_token = self.tokens.getNextToken(TOKEN_COLON)
+				type_token = self.tokens.getNextToken()
 				if type_token.type not in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL, TOKEN_VARIABLE_TYPE_STRING]: # pragma: no cover
 					self.raiseParseError ("Expected variable type, got " + DEBUG_TOKENDISPLAY(type_token.type))
-				semi_token = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
+				semi_token = self.tokens.getNextToken(TOKEN_SEMICOLON)
 
 				for ident_token in ident_token_list:
 					variable_token = Token(type_token.type, ident_token.value )
@@ -1723,49 +2809,49 @@ class Parser:
 	def parseProcFuncParameter(self):
 		# <formal parameter list> ::= "(" ["var"] <identifier> ":" <type> {";" ["var"] <identifier> ":" <type>} ")"    /* Fred note - we are only allowing 6 Integer and 8 Real parameters */
 
-		if self.tokenizer.peekMatchStringAndSpace("var"):
-			vartoken = self.tokenizer.getNextToken(TOKEN_VAR)
+		if self.tokens.peektype() == TOKEN_VAR:
+			vartoken = self.tokens.getNextToken(TOKEN_VAR)
 			byref = True
 		else:
 			byref = False
-		paramname = self.tokenizer.getNextToken(TOKEN_IDENTIFIER).value
-		colon = self.tokenizer.getNextToken(TOKEN_COLON)
-		paramtypetoken = self.tokenizer.getNextToken()
+		paramname = self.tokens.getNextToken(TOKEN_IDENTIFIER).value
+		colon = self.tokens.getNextToken(TOKEN_COLON)
+		paramtypetoken = self.tokens.getNextToken()
 		if not paramtypetoken.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL, TOKEN_VARIABLE_TYPE_STRING]: # pragma: no cover
 			self.raiseParseError("Expected Integer, Real, or String Procedure/Function Parameter Type, got " + DEBUG_TOKENDISPLAY(paramtypetoken.type))
 		return ProcFuncParameter(paramname, paramtypetoken.type, byref)
 
 	def parseFormalParameterList(self, procfuncheading):
 		# <formal parameter list> ::= "(" ["var"] <identifier> ":" <type> {";" ["var"] <identifier> ":" <type>} ")"    /* Fred note - we are only allowing 6 Integer and 8 Real parameters */
-		lparen = self.tokenizer.getNextToken(TOKEN_LPAREN)
-		procfuncheading.parameters.append(self.parseProcFuncParameter())
-		while self.tokenizer.peek() == ";":
-			semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
-			procfuncheading.parameters.append(self.parseProcFuncParameter())
-		rparen = self.tokenizer.getNextToken(TOKEN_RPAREN)
+		lparen = self.tokens.getNextToken(TOKEN_LPAREN)
+		procfuncheading.addParameter(self.parseProcFuncParameter())
+		while self.tokens.peektype() == TOKEN_SEMICOLON:
+			semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
+			procfuncheading.addParameter(self.parseProcFuncParameter())
+		rparen = self.tokens.getNextToken(TOKEN_RPAREN)
 
 	def parseFunctionDeclaration(self):
 		# <function declaration> ::= <function heading> ";" <procedure or function body>
 		# <function heading> ::= "function" <identifier> [<formal parameter list>] ":" <type>
 		# <procedure or function body> ::= [<variable declaration part>] <statement part>
 
-		functoken = self.tokenizer.getNextToken(TOKEN_FUNCTION)
-		funcheading = ProcFuncHeading(self.tokenizer.getIdentifier().lower())
+		functoken = self.tokens.getNextToken(TOKEN_FUNCTION)
+		funcheading = ProcFuncHeading(self.tokens.getNextToken(TOKEN_IDENTIFIER).value)
 
 
-		if self.tokenizer.peek() == "(":
+		if self.tokens.peektype() == TOKEN_LPAREN:
 			self.parseFormalParameterList(funcheading)
 
 
-		colon = self.tokenizer.getNextToken(TOKEN_COLON)
-		functype = self.tokenizer.getNextToken()
+		colon = self.tokens.getNextToken(TOKEN_COLON)
+		functype = self.tokens.getNextToken()
 		if functype.type in [TOKEN_VARIABLE_TYPE_INTEGER, TOKEN_VARIABLE_TYPE_REAL]:
 			funcheading.returntype = functype.type
 		else:
 			self.raiseParseError("Expected Integer Function Return Type, got " + DEBUG_TOKENDISPLAY(functype.type)) # pragma: no cover
-		semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
+		semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
 
-		if self.tokenizer.peekMatchStringAndSpace("var"):
+		if self.tokens.peektype() == TOKEN_VAR:
 			funcheading.localvariableAST = self.parseVariableDeclarations()
 
 		ret = AST(functoken)
@@ -1779,13 +2865,13 @@ class Parser:
 		# <procedure heading> ::= "procedure" <identifier> [<formal parameter list>]
 		# <procedure or function body> ::= [<variable declaration part>] <statement part>
 
-		proctoken = self.tokenizer.getNextToken(TOKEN_PROCEDURE)
-		procheading = ProcFuncHeading(self.tokenizer.getIdentifier().lower())
+		proctoken = self.tokens.getNextToken(TOKEN_PROCEDURE)
+		procheading = ProcFuncHeading(self.tokens.getNextToken(TOKEN_IDENTIFIER).value)
 
-		if self.tokenizer.peek() == "(":
+		if self.tokens.peektype() == TOKEN_LPAREN:
 			self.parseFormalParameterList(procheading)
-		semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
-		if self.tokenizer.peekMatchStringAndSpace("var"):
+		semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
+		if self.tokens.peektype() == TOKEN_VAR:
 			procheading.localvariableAST = self.parseVariableDeclarations()
 
 		ret = AST(proctoken)
@@ -1799,12 +2885,12 @@ class Parser:
 		ret = AST(Token(TOKEN_PROCFUNC_DECLARATION_PART, None))  # this is not a real token, it just holds procs and functions
 		done = False
 		while not done:
-			if self.tokenizer.peekMatchStringAndSpace("function"):
+			if self.tokens.peektype() == TOKEN_FUNCTION:
 				ret.children.append(self.parseFunctionDeclaration())
-				semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
-			elif self.tokenizer.peekMatchStringAndSpace("procedure"):
+				semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
+			elif self.tokens.peektype() == TOKEN_PROCEDURE:
 				ret.children.append(self.parseProcedureDeclaration())
-				semicolon = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
+				semicolon = self.tokens.getNextToken(TOKEN_SEMICOLON)
 			else:
 				done = True
 		return ret
@@ -1814,21 +2900,19 @@ class Parser:
 		# program ::= <program heading> <block> "."
 		# program heading ::= "program" <identifier> ";"
 
-		# eat any leading comments
-		self.tokenizer.eatComments()
-
-		ret = AST(self.tokenizer.getNextToken(TOKEN_PROGRAM))
-		ret.token.value = self.tokenizer.getIdentifier()
-		semi = self.tokenizer.getNextToken(TOKEN_SEMICOLON)
+		ret = AST(self.tokens.getNextToken(TOKEN_PROGRAM))
+		nametoken = self.tokens.getNextToken(TOKEN_IDENTIFIER)
+		ret.token.value = self.tokens.text[nametoken.start:nametoken.end]  # as written, not lowercased
+		semi = self.tokens.getNextToken(TOKEN_SEMICOLON)
 
 		# block ::= [<declaration part>] <statement part>
 		# <declaration part> ::= [<variable declaration part>] [<procedure and function declaration part>]
-		if self.tokenizer.peekMatchStringAndSpace("var"):
+		if self.tokens.peektype() == TOKEN_VAR:
 			variable_declarations = self.parseVariableDeclarations()
 		else:
 			variable_declarations = None
 
-		if self.tokenizer.peekMatchStringAndSpace("function") or self.tokenizer.peekMatchStringAndSpace("procedure"):
+		if self.tokens.peektype() in [TOKEN_FUNCTION, TOKEN_PROCEDURE]:
 			procfunc_declarations = self.parseProcedureFunctionDeclarationPart()
 		else:
 			procfunc_declarations = None
@@ -1838,9 +2922,9 @@ class Parser:
 			statementPart.token.value = True  # set the "main" begin to have True as its value
 		else: # pragma: no cover
 			raiseParseError("Unexpected token to begin main block, expected BEGIN, received " + DEBUG_TOKENDISPLAY(statementpart.token.type))
-		period = self.tokenizer.getNextToken(TOKEN_PERIOD)
-		if self.tokenizer.peek() != "": # pragma: no cover
-			raiseParseError("Unexpected character after period " + self.tokenizer.peek())
+		period = self.tokens.getNextToken(TOKEN_PERIOD)
+		if self.tokens.peektype() != TOKEN_EOF: # pragma: no cover
+			self.raiseParseError("Unexpected token after period " + DEBUG_TOKENDISPLAY(self.tokens.peektype()))
 
 		if not (variable_declarations is None):  # variable declarations are optional
 			ret.children.append(variable_declarations)
@@ -1853,41 +2937,152 @@ class Parser:
 		return ret
 
 	def parse(self):
+		self.tokens = TokenStream(self.tokenizer)
 		self.AST = self.parseProgram()
 
 	def assembleAST(self):
 		self.AST.assemble(self.assembler, None)  # None = Global Scope
 
-	def assemble(self, filename):
-		self.assembler = asm_funcs.Assembler(filename)
-		self.AST.find_literals(self.assembler)
-		self.AST.find_global_variable_declarations(self.assembler)
-		# concat needs stack space allocated for each invocation.  If we add other reserved
-		# functions with same requirements, we can rename this method.
-		mainbegin = self.AST.find_main_begin()
-		mainbegin.find_concats(self.assembler)
-		self.AST.static_type_check(self.assembler)
+	def assembleSections(self, ast, assembler):
+		assembler.setup_bss()
+		assembler.setup_data()
+		assembler.setup_text()
 
-		self.assembler.setup_macros()
-		self.assembler.setup_bss()
-		self.assembler.setup_data()
-		self.assembler.setup_text()
-
-		self.AST.assembleProcsAndFunctions(self.assembler)
-
-		self.assembler.setup_start()
+	def assembleMain(self, ast, assembler):
+		assembler.setup_start()
 		self.assembleAST()
+		assembler.emit_terminate()
+
+	def assembleCleanup(self, ast, assembler):
+		assembler.cleanup()
+
+	def assemble(self, filename, output_buffering = asm_funcs.OUTPUT_FULLY_BUFFERED, peephole_rules = None, passtiming = False, comments = True):
+		self.assembler = asm_funcs.Assembler(filename, output_buffering, peephole_rules, comments)
+		self.passmanager = PassManager(passtiming)
+		self.passmanager.add(ASTPass("Declare global variables", PASS_PREORDER, AST.find_global_variable_declaration_node, GLOBAL_DECLARATION_TOKEN_TYPES))
+		self.passmanager.add(ASTPass("Find concats", PASS_PREORDER, AST.find_concat_node, STATEMENT_TOKEN_TYPES | frozenset([TOKEN_CONCAT])))
+		self.passmanager.add(ASTPass("Type check", PASS_POSTORDER, AST.type_check_node, requires = ["Declare global variables"]))
+		self.passmanager.add(ASTPass("Fold constants", PASS_POSTORDER, AST.fold_constants_node, MATHOP_TOKEN_TYPES | RELOP_TOKEN_TYPES, follows = ["Type check"]))
+		# after folding, as folding creates new Real literals and may remove others
+		self.passmanager.add(ASTPass("Find literals", PASS_POSTORDER, AST.find_literals_node, follows = ["Fold constants"]))
+		self.passmanager.add(ASTPass("Set up sections", PASS_WHOLE_TREE, self.assembleSections, requires = ["Declare global variables", "Find concats", "Find literals"]))
+		self.passmanager.add(ASTPass("Assemble procedures and functions", PASS_WHOLE_TREE, AST.assembleProcsAndFunctions, requires = ["Set up sections"]))
+		self.passmanager.add(ASTPass("Assemble main program", PASS_WHOLE_TREE, self.assembleMain, requires = ["Assemble procedures and functions"]))
+		self.passmanager.add(ASTPass("Peephole optimize and write", PASS_WHOLE_TREE, self.assembleCleanup, requires = ["Assemble main program"]))
+		self.passmanager.run(self.AST, self.assembler)
+
+
+# The object and the executable are built in a temporary directory under this one, in memory when there is a tmpfs
+COMPILE_WORKDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+class CompileResult:
+	def __init__(self):
+		self.assembly = None  # the text of the assembly
+		self.object = None  # bytes of the object file, if it was asked for
+		self.executable = None  # bytes of the executable, if it was asked for
+		self.passmanager = None  # for the time each pass took
+		self.timings = {}  # stage -> seconds, in the order the stages ran
+
+	def report(self):
+		ret = "Compile: " + "{:.2f}".format(sum(self.timings.values()) * 1000) + " ms\n"
+		for stage in self.timings:
+			ret += "\t" + stage + ": " + "{:.2f}".format(self.timings[stage] * 1000) + " ms\n"
+		return ret
 
-		self.assembler.emit_terminate()
-		self.assembler.cleanup()
+
+def compile_source(text, output_buffering = asm_funcs.OUTPUT_FULLY_BUFFERED, peephole_rules = None, comments = True, build_object = False, build_executable = False, direct_object = False, workdir = COMPILE_WORKDIR):
+	# Compiles the text of a program and returns a CompileResult, without writing any files next to the source or
+	# in the current directory.  The assembly is always returned.  nasm and gcc need files, so the object and the
+	# executable are built in a temporary directory under workdir that is removed before returning.  With
+	# direct_object, the object alone needs no files at all.
+	ret = CompileResult()
+	start = time.perf_counter()
+	p = Parser(Tokenizer(text))
+	p.parse()
+	ret.timings["Tokenize and parse"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	p.assemble(None, output_buffering, peephole_rules, comments = comments)
+	ret.assembly = p.assembler.text()
+	ret.passmanager = p.passmanager
+	ret.timings["Generate assembly"] = time.perf_counter() - start
+
+	if direct_object and build_object and not build_executable:
+		start = time.perf_counter()
+		ret.object = elf_funcs.ELFObjectWriter(p.assembler).build()
+		ret.timings["Assemble object"] = time.perf_counter() - start
+	elif build_object or build_executable:
+		tempdir = tempfile.mkdtemp(prefix = "fred", dir = workdir)
+		try:
+			objectfilename = os.path.join(tempdir, "program.o")
+			start = time.perf_counter()
+			if direct_object:
+				c = elf_funcs.Compiler(p.assembler, objectfilename, runtime_directory = None)
+			else:
+				assemblyfilename = os.path.join(tempdir, "program.asm")
+				f = open(assemblyfilename, "w")
+				f.write(ret.assembly)
+				f.close()
+				c = asm_funcs.Compiler(assemblyfilename, objectfilename, runtime_directory = None)
+			c.do_compile()
+			if not os.path.exists(objectfilename): # pragma: no cover
+				raise ValueError("Unable to assemble the program")
+			if build_object:
+				f = open(objectfilename, "rb")
+				ret.object = f.read()
+				f.close()
+			ret.timings["Assemble object"] = time.perf_counter() - start
+
+			if build_executable:
+				exefilename = os.path.join(tempdir, "program")
+				start = time.perf_counter()
+				l = asm_funcs.Linker(objectfilename, exefilename, c.runtime_obj_filenames)
+				l.do_link()
+				if not os.path.exists(exefilename): # pragma: no cover
+					raise ValueError("Unable to link the program")
+				f = open(exefilename, "rb")
+				ret.executable = f.read()
+				f.close()
+				ret.timings["Link"] = time.perf_counter() - start
+		finally:
+			shutil.rmtree(tempdir)
+	return ret
 
 
 def main(): # pragma: no cover
-	if len(sys.argv) < 2:
-		print("Usage: python3 compiler.py [filename]")
+	args = sys.argv[1:]
+	output_buffering = asm_funcs.OUTPUT_FULLY_BUFFERED
+	peephole_rules = None
+	peephole_report = False
+	pass_report = False
+	frame_report = False
+	comments = True
+	direct_object = False
+	while len(args) > 0 and args[0][:2] == "--":
+		if args[0] == "--line-buffered":
+			output_buffering = asm_funcs.OUTPUT_LINE_BUFFERED
+		elif args[0] == "--no-peephole":
+			peephole_rules = []
+		elif args[0] == "--peephole-report":
+			peephole_report = True
+		elif args[0] == "--pass-report":
+			pass_report = True
+		elif args[0] == "--frame-report":
+			frame_report = True
+		elif args[0] == "--no-comments":
+			comments = False
+		elif args[0] == "--direct-object":
+			direct_object = True
+		else:
+			print("Unknown option: " + args[0])
+			sys.exit()
+		args = args[1:]
+
+	if len(args) < 1:
+		print("Usage: python3 compiler.py [--line-buffered] [--no-peephole] [--peephole-report] [--pass-report] [--frame-report] [--no-comments] [--direct-object] [filename]")
 		sys.exit()
 
-	infilename = sys.argv[1]
+	infilename = args[0]
 	if infilename[-4:].lower() == ".pas":
 		assemblyfilename = infilename[:-4] + ".asm"
 		objectfilename = infilename[:-4] + ".o"
@@ -1911,9 +3106,22 @@ def main(): # pragma: no cover
 
 
 	print("Done.\nAssembling...")
-	p.assemble(assemblyfilename)
+	if direct_object:
+		# nasm is not run on the generated code, so there is no need to write the .asm file
+		assemblyfilename = None
+		comments = False
+	p.assemble(assemblyfilename, output_buffering, peephole_rules, pass_report, comments)
+	if peephole_report:
+		print(p.assembler.peephole_report())
+	if pass_report:
+		print(p.passmanager.report())
+	if frame_report:
+		print(p.assembler.frame_report())
 	print("Done.\nCompiling...")
-	c = asm_funcs.Compiler(assemblyfilename, objectfilename)
+	if direct_object:
+		c = elf_funcs.Compiler(p.assembler, objectfilename)
+	else:
+		c = asm_funcs.Compiler(assemblyfilename, objectfilename)
 	c.do_compile()
 	print("Done.\nLinking...")
 	l = asm_funcs.Linker(objectfilename, exefilename)
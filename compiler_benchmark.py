@@ -0,0 +1,194 @@
+import compiler
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the compiler itself (not for the programs it generates).
+# Usage: python3 compiler_benchmark.py [number of statements]
+
+
+def generate_program(numstatements):
+	# Returns the text of a valid program with numstatements statements in the main block, using every kind of
+	# token: keywords, identifiers, Integer and Real literals, String literals with escaped apostrophes, comments,
+	# and all of the symbols.
+	lines = ["program benchmark;", "{ generated by compiler_benchmark.py }"]
+	lines.append("var counter:integer; total:integer; ratio:real; message:string;")
+	lines.append("function scaled(value:integer; factor:real):real;")
+	lines.append("begin")
+	lines.append("\tscaled := value * factor")
+	lines.append("end;")
+	lines.append("begin")
+	lines.append("\tcounter := 0; total := 0; ratio := 1.5;")
+	statements = []
+	i = 0
+	while i < numstatements:
+		kind = i % 5
+		if kind == 0:
+			statements.append("\ttotal := (total + " + str(i) + " * counter) div 3 - counter mod 7")
+		elif kind == 1:
+			statements.append("\tratio := scaled(counter, " + str(i) + ".25) / 2.0 { scale it down }")
+		elif kind == 2:
+			statements.append("\tif total <> counter then writeln('Line " + str(i) + " isn''t equal', total) else write('same')")
+		elif kind == 3:
+			statements.append("\twhile counter <= " + str(i % 10) + " do counter := counter + 1")
+		else:
+			statements.append("\tmessage := concat('abc', message, 'def'); if ratio >= 0.5 then counter := counter - 1")
+		i += 1
+	lines.append(";\n".join(statements))
+	lines.append("end.")
+	return "\n".join(lines) + "\n"
+
+
+def benchmark_tokenizer(text, repeats = 3):
+	# Returns (number of tokens, best time in seconds) for tokenizing the text, with the best of several runs.
+	best = None
+	numtokens = 0
+	i = 0
+	while i < repeats:
+		start = time.perf_counter()
+		t = compiler.Tokenizer(text)
+		t.eatComments()
+		numtokens = 0
+		while t.curPos < t.length:
+			t.getNextToken()
+			numtokens += 1
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+		i += 1
+	return (numtokens, best)
+
+
+def benchmark_parser(text, repeats = 3):
+	# Returns the best time in seconds for tokenizing and parsing the text into an AST.
+	best = None
+	i = 0
+	while i < repeats:
+		start = time.perf_counter()
+		p = compiler.Parser(compiler.Tokenizer(text))
+		p.parse()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+		i += 1
+	return best
+
+
+def count_ast_nodes(ast):
+	ret = 0
+	stack = [ast]
+	while len(stack) > 0:
+		node = stack.pop()
+		ret += 1
+		stack.extend(node.children)
+	return ret
+
+
+def benchmark_nodes(count):
+	# Returns (bytes per Token, Tokens constructed per second, bytes per AST node, AST nodes constructed per second)
+	# from building count of each and keeping them alive.  The timing runs are separate from the memory runs,
+	# because tracing allocations slows them down.
+	ret = []
+	for make in [lambda: compiler.Token(compiler.TOKEN_INT, 5, 0, 1), lambda: compiler.AST(compiler.Token(compiler.TOKEN_INT, 5))]:
+		nodes = [None] * count  # preallocated, so the list itself is not counted
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+		i = 0
+		while i < count:
+			nodes[i] = make()
+			i += 1
+		after = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+		ret.append((after - before) / count)
+
+		nodes = [None] * count
+		start = time.perf_counter()
+		i = 0
+		while i < count:
+			nodes[i] = make()
+			i += 1
+		ret.append(count / (time.perf_counter() - start))
+		nodes = None
+	# an AST node was built around a Token of its own, so take that Token's share out
+	ret[2] -= ret[0]
+	return tuple(ret)
+
+
+def benchmark_parse_memory(text):
+	# Returns (number of Tokens, number of AST nodes, bytes allocated by tokenizing and parsing the text)
+	tracemalloc.start()
+	p = compiler.Parser(compiler.Tokenizer(text))
+	p.parse()
+	allocated = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return (p.tokens.numtokens, count_ast_nodes(p.AST), allocated)
+
+
+def benchmark_codegen(text, repeats = 3, comments = True):
+	# Returns (number of AST nodes, best time in seconds) for type checking, folding constants and generating the
+	# assembly for the parsed text, without the peephole optimizer.  Assembling changes the AST, so each run gets a
+	# freshly parsed one.
+	best = None
+	numnodes = 0
+	tempdir = tempfile.mkdtemp()
+	assemblyfilename = os.path.join(tempdir, "benchmark.asm")
+	i = 0
+	while i < repeats:
+		p = compiler.Parser(compiler.Tokenizer(text))
+		p.parse()
+		numnodes = count_ast_nodes(p.AST)
+		start = time.perf_counter()
+		p.assemble(assemblyfilename, peephole_rules = [], comments = comments)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+		i += 1
+	os.remove(assemblyfilename)
+	os.rmdir(tempdir)
+	return (numnodes, best)
+
+
+def benchmark_passes(text):
+	# Returns the pass manager's report of how long each pass took on the parsed text, without the peephole optimizer
+	p = compiler.Parser(compiler.Tokenizer(text))
+	p.parse()
+	tempdir = tempfile.mkdtemp()
+	assemblyfilename = os.path.join(tempdir, "benchmark.asm")
+	p.assemble(assemblyfilename, peephole_rules = [], passtiming = True)
+	os.remove(assemblyfilename)
+	os.rmdir(tempdir)
+	return p.passmanager.report()
+
+
+def main():
+	numstatements = 100000
+	if len(sys.argv) > 1:
+		numstatements = int(sys.argv[1])
+
+	text = generate_program(numstatements)
+	print("Source: " + str(numstatements) + " statements, " + str(len(text)) + " characters")
+
+	numtokens, elapsed = benchmark_tokenizer(text)
+	print("Tokenizer: " + str(numtokens) + " tokens in " + "{:.3f}".format(elapsed) + " seconds, " + "{:,.0f}".format(numtokens / elapsed) + " tokens/second")
+
+	elapsed = benchmark_parser(text)
+	print("Parser: " + str(numstatements) + " statements in " + "{:.3f}".format(elapsed) + " seconds, " + "{:,.0f}".format(numstatements / elapsed) + " statements/second")
+
+	numtokens, numnodes, allocated = benchmark_parse_memory(text)
+	print("Parsed program: " + str(numtokens) + " tokens and " + str(numnodes) + " AST nodes in " + "{:,.1f}".format(allocated / 1048576) + " MB")
+
+	numnodes, elapsed = benchmark_codegen(text)
+	print("Code generation (no peephole): " + str(numnodes) + " AST nodes in " + "{:.3f}".format(elapsed) + " seconds, " + "{:.1f}".format(elapsed * 1000 * 10000 / numnodes) + " ms per 10k nodes")
+	numnodes, elapsed = benchmark_codegen(text, comments = False)
+	print("Code generation (no peephole, no comments): " + "{:.3f}".format(elapsed) + " seconds, " + "{:.1f}".format(elapsed * 1000 * 10000 / numnodes) + " ms per 10k nodes")
+	print(benchmark_passes(text), end = "")
+
+	tokenbytes, tokenrate, astbytes, astrate = benchmark_nodes(numstatements * 10)
+	print("Token: " + "{:.0f}".format(tokenbytes) + " bytes each, " + "{:,.0f}".format(tokenrate) + " constructed/second")
+	print("AST node: " + "{:.0f}".format(astbytes) + " bytes each (not counting its Token), " + "{:,.0f}".format(astrate) + " constructed/second (with its Token)")
+
+
+if __name__ == '__main__':  # pragma: no cover
+	main()
@@ -1,42 +1,154 @@
 import compiler
 import asm_funcs
+import elf_funcs
+import concurrent.futures
+import glob
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 
 NUM_ATTEMPTS = 0
 NUM_SUCCESSES = 0
 TEST_FPC_INSTEAD = False  # switch to true to validate the .out files using fpc
 
+# Every .pas file in here that has a .out file next to it is a test
+TEST_DIRECTORY = "compiler_test_files"
 
-def dotest(infilename, resultfilename):
-	global NUM_ATTEMPTS
-	global NUM_SUCCESSES
+# Tests that are run a second time with other options, on top of every test found in TEST_DIRECTORY
+TEST_VARIANTS = [("testconcat02", {"direct_object": True}),
+				 ("testfunc13", {"direct_object": True}),
+				 ("testfunc13", {"in_memory": True}),
+				 ("testif03", {"comments": False}),
+				 ("testreal08", {"direct_object": True}),
+				 ("testrelop01", {"peephole_rules": []}),
+				 ("testwrite02", {"output_buffering": asm_funcs.OUTPUT_LINE_BUFFERED}),
+				 ("testwrite02", {"output_buffering": asm_funcs.OUTPUT_LINE_BUFFERED, "direct_object": True}),
+				 ("testwrite02", {"output_buffering": asm_funcs.OUTPUT_LINE_BUFFERED, "direct_object": True, "in_memory": True}),
+				 ("testwriteln03", {"peephole_rules": []})]
 
-	NUM_ATTEMPTS += 1
+TEST_STAGES = ["compile", "assemble", "link", "run"]
+
+
+class TestResult:
+	def __init__(self, name):
+		self.name = name  # the source file, and any options it was compiled with
+		self.passed = False
+		self.message = None  # why a test failed
+		self.workdir = None  # a failed test's files are left here, so we can debug
+		self.timings = {}  # stage from TEST_STAGES -> seconds
+
+	def report(self):
+		if self.passed:
+			ret = "PASS: "
+		else:
+			ret = "FAIL: "
+		if TEST_FPC_INSTEAD:
+			ret = "FPC " + ret
+		ret += self.name
+		stages = [stage + " " + "{:.1f}".format(self.timings[stage] * 1000) + " ms" for stage in TEST_STAGES if stage in self.timings]
+		if len(stages) > 0:
+			ret += " (" + ", ".join(stages) + ")"
+		if not self.passed: # pragma: no cover
+			if not (self.message is None):
+				ret += "\n" + self.message
+			if not (self.workdir is None):
+				ret += "\nFiles left in " + self.workdir
+		return ret
+
+
+def discover_tests(directory = TEST_DIRECTORY):
+	# Returns (infilename, resultfilename, options) for every test program in the directory, and for its variants
+	tests = []
+	for infilename in sorted(glob.glob(os.path.join(directory, "*.pas"))):
+		resultfilename = infilename[:-4] + ".out"
+		if os.path.exists(resultfilename):
+			tests.append((infilename, resultfilename, {}))
+	for name, options in TEST_VARIANTS:
+		infilename = os.path.join(directory, name + ".pas")
+		tests.append((infilename, infilename[:-4] + ".out", options))
+	return tests
 
+
+def dotest(infilename, resultfilename, output_buffering = asm_funcs.OUTPUT_FULLY_BUFFERED, peephole_rules = None, comments = True, direct_object = False, in_memory = False):
+	# Compiles, links and runs the program in a temporary directory of its own, so that tests can run side by side,
+	# and compares what it writes with resultfilename.  Returns a TestResult.
+	name = infilename
+	options = []
+	if output_buffering != asm_funcs.OUTPUT_FULLY_BUFFERED:
+		options.append("line buffered")
+	if not (peephole_rules is None) and len(peephole_rules) == 0:
+		options.append("no peephole")
+	if not comments:
+		options.append("no comments")
+	if direct_object:
+		options.append("direct object")
+	if in_memory:
+		options.append("in memory")
+	if len(options) > 0:
+		name += " [" + ", ".join(options) + "]"
+	result = TestResult(name)
+
+	workdir = tempfile.mkdtemp(prefix = "fredtest")
 	try:
-		exefilename = infilename[:-4]
+		basename = os.path.basename(infilename)[:-4]
+		exefilename = os.path.join(workdir, basename)
 		testoutputfilename = exefilename + ".testoutput"
 
-		if not TEST_FPC_INSTEAD:
-			assemblyfilename = infilename[:-4] + ".asm"
-			objectfilename = infilename[:-4] + ".o"
+		f = open(infilename, "r")
+		text = f.read()
+		f.close()
 
-			f = open(infilename, "r")
-			t = compiler.Tokenizer(f.read())
+		if TEST_FPC_INSTEAD:
+			start = time.perf_counter()
+			os.system("fpc -v0 -o" + exefilename + " " + infilename)
+			result.timings["compile"] = time.perf_counter() - start
+
+		elif in_memory:
+			# only the executable is written, from the bytes compile_source() returns
+			compiled = compiler.compile_source(text, output_buffering, peephole_rules, comments, build_executable = True, direct_object = direct_object, workdir = workdir)
+			result.timings["compile"] = compiled.timings["Tokenize and parse"] + compiled.timings["Generate assembly"]
+			result.timings["assemble"] = compiled.timings["Assemble object"]
+			result.timings["link"] = compiled.timings["Link"]
+
+			f = open(exefilename, "wb")
+			f.write(compiled.executable)
 			f.close()
+			os.chmod(exefilename, 0o755)
 
-			p = compiler.Parser(t)
+		else:
+			assemblyfilename = exefilename + ".asm"
+			objectfilename = exefilename + ".o"
+
+			start = time.perf_counter()
+			p = compiler.Parser(compiler.Tokenizer(text))
 			p.parse()
-			p.assemble(assemblyfilename)
-			c = asm_funcs.Compiler(assemblyfilename, objectfilename)
+			if direct_object:
+				assemblyfilename = None  # the object comes straight from the assembler, without an .asm file
+			p.assemble(assemblyfilename, output_buffering, peephole_rules, comments = comments)
+			result.timings["compile"] = time.perf_counter() - start
+
+			start = time.perf_counter()
+			# the runtime objects are linked straight from the cache
+			if direct_object:
+				c = elf_funcs.Compiler(p.assembler, objectfilename, runtime_directory = None)
+			else:
+				c = asm_funcs.Compiler(assemblyfilename, objectfilename, runtime_directory = None)
 			c.do_compile()
-			l = asm_funcs.Linker(objectfilename, exefilename)
-			l.do_link()
+			result.timings["assemble"] = time.perf_counter() - start
 
-		else:
-			os.system("fpc -v0 -o" + exefilename + " " + infilename)
+			start = time.perf_counter()
+			l = asm_funcs.Linker(objectfilename, exefilename, c.runtime_obj_filenames)
+			l.do_link()
+			result.timings["link"] = time.perf_counter() - start
 
-		os.system("./" + exefilename + " > " + testoutputfilename)
+		start = time.perf_counter()
+		testfile = open(testoutputfilename, "w")
+		subprocess.run([exefilename], stdout = testfile)
+		testfile.close()
+		result.timings["run"] = time.perf_counter() - start
 
 		testfile = open(testoutputfilename, "r")
 		testvalue = testfile.read()
@@ -46,100 +158,102 @@ def dotest(infilename, resultfilename):
 		resultvalue = resultfile.read()
 		resultfile.close()
 
+		result.passed = (resultvalue == testvalue)
+	except Exception as e: # pragma: no cover
+		result.message = str(e)
 
+	if result.passed:
+		shutil.rmtree(workdir)
+	else: # pragma: no cover
+		# leave the files from failed tests so we can debug
+		result.workdir = workdir
+	return result
 
-		if resultvalue == testvalue:
-			if not TEST_FPC_INSTEAD:
-				print("PASS: " + infilename)
-			else:
-				print("FPC PASS: " + infilename)
-			NUM_SUCCESSES += 1
 
-			# remove the files from passed tests; we will leave the files from failed tests so we can debug
-			if not TEST_FPC_INSTEAD:
-				os.system("rm " + assemblyfilename)
-				os.system("rm " + objectfilename)
-			os.system("rm " + exefilename)
-			os.system("rm " + testoutputfilename)
+def runtest(test):
+	infilename, resultfilename, options = test
+	return dotest(infilename, resultfilename, **options)
+
+
+def compile_to_bytes(text):
+	result = compiler.compile_source(text, build_object = True, direct_object = True)
+	return (result.assembly, result.object)
+
+
+def doconcurrencytest(infilenames, numthreads = 8, rounds = 4):
+	# Compiles the programs from a pool of threads, each one several times over, and checks that every compile
+	# gives the same assembly and object as compiling the program on its own did.
+	global NUM_ATTEMPTS
+	global NUM_SUCCESSES
+
+	NUM_ATTEMPTS += 1
+
+	try:
+		texts = []
+		for infilename in infilenames:
+			f = open(infilename, "r")
+			texts.append(f.read())
+			f.close()
+		expected = [compile_to_bytes(text) for text in texts]
+
+		pool = concurrent.futures.ThreadPoolExecutor(numthreads)
+		results = list(pool.map(compile_to_bytes, texts * rounds))
+		pool.shutdown()
 
+		mismatches = 0
+		for i in range(len(results)):
+			if results[i] != expected[i % len(texts)]: # pragma: no cover
+				print("Different output compiling " + infilenames[i % len(texts)] + " concurrently")
+				mismatches += 1
+
+		if mismatches == 0:
+			print("PASS: " + str(len(results)) + " concurrent compiles in " + str(numthreads) + " threads")
+			NUM_SUCCESSES += 1
 			return True
 		else: # pragma: no cover
-			print("FAIL: " + infilename)
+			print("FAIL: concurrent compiles")
 			return False
 	except Exception as e: # pragma: no cover
-		print("FAIL: " + infilename)
+		print("FAIL: concurrent compiles")
 		print(e)
 		return False
 
 
 def main():
+	# Usage: python3 compiler_test.py [number of processes]
 	global NUM_ATTEMPTS
 	global NUM_SUCCESSES
 
-	f = dotest("compiler_test_files/testbyref01.pas", "compiler_test_files/testbyref01.out")
-	f = dotest("compiler_test_files/testbyref02.pas", "compiler_test_files/testbyref02.out")
-	f = dotest("compiler_test_files/testbyref03.pas", "compiler_test_files/testbyref03.out")
-	f = dotest("compiler_test_files/testbyref04.pas", "compiler_test_files/testbyref04.out")
-	f = dotest("compiler_test_files/testcomments01.pas", "compiler_test_files/testcomments01.out")
-	f = dotest("compiler_test_files/testconcat01.pas", "compiler_test_files/testconcat01.out")
-	f = dotest("compiler_test_files/testconcat02.pas", "compiler_test_files/testconcat02.out")
-	f = dotest("compiler_test_files/testconcat03.pas", "compiler_test_files/testconcat03.out")
-	f = dotest("compiler_test_files/testconcat04.pas", "compiler_test_files/testconcat04.out")
-	f = dotest("compiler_test_files/testconcat05.pas", "compiler_test_files/testconcat05.out")
-	f = dotest("compiler_test_files/testfunc01.pas", "compiler_test_files/testfunc01.out")
-	f = dotest("compiler_test_files/testfunc02.pas", "compiler_test_files/testfunc02.out")
-	f = dotest("compiler_test_files/testfunc03.pas", "compiler_test_files/testfunc03.out")
-	f = dotest("compiler_test_files/testfunc04.pas", "compiler_test_files/testfunc04.out")
-	f = dotest("compiler_test_files/testfunc05.pas", "compiler_test_files/testfunc05.out")
-	f = dotest("compiler_test_files/testfunc06.pas", "compiler_test_files/testfunc06.out")
-	f = dotest("compiler_test_files/testfunc07.pas", "compiler_test_files/testfunc07.out")
-	f = dotest("compiler_test_files/testfunc08.pas", "compiler_test_files/testfunc08.out")
-	f = dotest("compiler_test_files/testfunc09.pas", "compiler_test_files/testfunc09.out")
-	f = dotest("compiler_test_files/testfunc10.pas", "compiler_test_files/testfunc10.out")
-	f = dotest("compiler_test_files/testfunc11.pas", "compiler_test_files/testfunc11.out")
-	f = dotest("compiler_test_files/testglobalvar01.pas", "compiler_test_files/testglobalvar01.out")
-	f = dotest("compiler_test_files/testglobalvar02.pas", "compiler_test_files/testglobalvar02.out")
-	f = dotest("compiler_test_files/testif01.pas", "compiler_test_files/testif01.out")
-	f = dotest("compiler_test_files/testif02.pas", "compiler_test_files/testif02.out")
-	f = dotest("compiler_test_files/testif03.pas", "compiler_test_files/testif03.out")
-	f = dotest("compiler_test_files/testlocalvar01.pas", "compiler_test_files/testlocalvar01.out")
-	f = dotest("compiler_test_files/testlocalvar02.pas", "compiler_test_files/testlocalvar02.out")
-	f = dotest("compiler_test_files/testmath01.pas", "compiler_test_files/testmath01.out")
-	f = dotest("compiler_test_files/testmath02.pas", "compiler_test_files/testmath02.out")
-	f = dotest("compiler_test_files/testmath03.pas", "compiler_test_files/testmath03.out")
-	f = dotest("compiler_test_files/testmath04.pas", "compiler_test_files/testmath04.out")
-	f = dotest("compiler_test_files/testproc01.pas", "compiler_test_files/testproc01.out")
-	f = dotest("compiler_test_files/testproc02.pas", "compiler_test_files/testproc02.out")
-	f = dotest("compiler_test_files/testproc03.pas", "compiler_test_files/testproc03.out")
-	f = dotest("compiler_test_files/testproc04.pas", "compiler_test_files/testproc04.out")
-	f = dotest("compiler_test_files/testreal01.pas", "compiler_test_files/testreal01.out")
-	f = dotest("compiler_test_files/testreal02.pas", "compiler_test_files/testreal02.out")
-	f = dotest("compiler_test_files/testreal03.pas", "compiler_test_files/testreal03.out")
-	f = dotest("compiler_test_files/testreal04.pas", "compiler_test_files/testreal04.out")
-	f = dotest("compiler_test_files/testreal05.pas", "compiler_test_files/testreal05.out")
-	f = dotest("compiler_test_files/testreal06.pas", "compiler_test_files/testreal06.out")
-	f = dotest("compiler_test_files/testreal07.pas", "compiler_test_files/testreal07.out")
-	f = dotest("compiler_test_files/testreal08.pas", "compiler_test_files/testreal08.out")
-	f = dotest("compiler_test_files/testrecursion01.pas", "compiler_test_files/testrecursion01.out")
-	f = dotest("compiler_test_files/testrelop01.pas", "compiler_test_files/testrelop01.out")
-	f = dotest("compiler_test_files/testrelop02.pas", "compiler_test_files/testrelop02.out")
-	f = dotest("compiler_test_files/testscope01.pas", "compiler_test_files/testscope01.out")
-	f = dotest("compiler_test_files/testscope02.pas", "compiler_test_files/testscope02.out")
-	f = dotest("compiler_test_files/testscope03.pas", "compiler_test_files/testscope03.out")
-	f = dotest("compiler_test_files/teststring01.pas", "compiler_test_files/teststring01.out")
-	f = dotest("compiler_test_files/teststring02.pas", "compiler_test_files/teststring02.out")
-	f = dotest("compiler_test_files/teststring03.pas", "compiler_test_files/teststring03.out")
-	f = dotest("compiler_test_files/teststring04.pas", "compiler_test_files/teststring04.out")
-	f = dotest("compiler_test_files/testwhile01.pas", "compiler_test_files/testwhile01.out")
-	f = dotest("compiler_test_files/testwhile02.pas", "compiler_test_files/testwhile02.out")
-	f = dotest("compiler_test_files/testwrite01.pas", "compiler_test_files/testwrite01.out")
-	f = dotest("compiler_test_files/testwriteln01.pas", "compiler_test_files/testwriteln01.out")
-	f = dotest("compiler_test_files/testwriteln02.pas", "compiler_test_files/testwriteln02.out")
-	f = dotest("compiler_test_files/testwriteln03.pas", "compiler_test_files/testwriteln03.out")
+	numprocesses = os.cpu_count()
+	if len(sys.argv) > 1:
+		numprocesses = int(sys.argv[1])
+
+	start = time.perf_counter()
+	tests = discover_tests()
+	if not TEST_FPC_INSTEAD:
+		# assemble the runtime objects before the tests start, rather than in every process at once
+		asm_funcs.DEFAULT_RUNTIME_CACHE.fetch_all(None)
+
+	totals = {}
+	pool = concurrent.futures.ProcessPoolExecutor(numprocesses)
+	for result in pool.map(runtest, tests):
+		NUM_ATTEMPTS += 1
+		if result.passed:
+			NUM_SUCCESSES += 1
+		print(result.report())
+		for stage in result.timings:
+			totals[stage] = totals.get(stage, 0.0) + result.timings[stage]
+	pool.shutdown()
 
+	if not TEST_FPC_INSTEAD:
+		doconcurrencytest([test[0] for test in tests if len(test[2]) == 0])
 
+	elapsed = time.perf_counter() - start
 	print ("Tests Attempted: " + str(NUM_ATTEMPTS))
 	print ("Tests Succeeded: " + str(NUM_SUCCESSES))
+	print ("Time: " + "{:.2f}".format(elapsed) + " seconds in " + str(numprocesses) + " process(es), for " + "{:.2f}".format(sum(totals.values())) + " seconds of tests (" + ", ".join([stage + " " + "{:.2f}".format(totals[stage]) for stage in TEST_STAGES if stage in totals]) + ")")
+	if NUM_SUCCESSES != NUM_ATTEMPTS: # pragma: no cover
+		sys.exit(1)
 
 if __name__ == '__main__':  # pragma: no cover
 	main()
@@ -1,4 +1,4 @@
-program test21fc;
+program testbyref05;
 var q:integer; r:real; t:integer;
 
 function functwo(var a:Integer; var b:Real):integer;
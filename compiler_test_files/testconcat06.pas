@@ -0,0 +1,29 @@
+program testconcat06;
+var short:string; long:string; result:string; i:integer;
+
+procedure joinall(a:string; var b:string);
+begin
+  b := concat(b, '[', a, '|', a, a, ']');
+  writeln(b)
+end;
+
+begin
+  short := 'abc';
+  long := 'Strings of eight bytes or more';
+  writeln(concat(short, '-', long, '-', short, '-', long));
+  writeln(concat('1234567', '12345678', '123456789', ''));
+  writeln(concat(short, concat(long, short, concat('x', 'y')), short));
+  result := '';
+  i := 0;
+  while i < 12 do
+  begin
+    result := concat(result, 'twenty characters...');
+    i := i + 1
+  end;
+  writeln(result);
+  result := concat(result, '123456789012345');
+  writeln(result);
+  result := 'start';
+  joinall(short, result);
+  joinall(long, result)
+end.
@@ -0,0 +1,31 @@
+program testconcat07;
+{concats assigned to a variable that may also be one of their arguments}
+var s: string; t: string;
+procedure p(var q: string; var w: string; r: string);
+var z: integer;
+begin
+	q := concat('<', s, '>');
+	writeln(q, ' ', s);
+	q := concat(q, '+', r);
+	writeln(q);
+	w := concat('[', q, ']');
+	writeln(w, ' ', q);
+	r := concat(r, r);
+	r := concat('a', r, 'b');
+	writeln(r);
+	q := concat(r, 'x')
+end;
+begin
+	s := 'one';
+	t := 'two';
+	s := concat(s, t);
+	writeln(s);
+	t := concat('(', s, t, ')');
+	writeln(t);
+	s := concat('x', s, concat(s, 'y'));
+	writeln(s);
+	p(s, s, 'r');
+	writeln(s);
+	p(t, s, 'rr');
+	writeln(s, ' ', t)
+end.
@@ -0,0 +1,24 @@
+program testconcat08;
+{concat() as the 4th, 5th and 6th argument, after arguments already loaded into registers}
+var a: string; b: string;
+procedure p(i: integer; j: integer; k: integer; s: string);
+begin
+	writeln(i, ' ', j, ' ', k, ' ', s)
+end;
+procedure q(i: integer; j: integer; k: integer; l: integer; s: string; t: string);
+begin
+	writeln(i, ' ', j, ' ', k, ' ', l, ' ', s, ' ', t)
+end;
+procedure r(var s: string; i: integer; t: string; j: integer; k: integer; u: string);
+begin
+	s := concat(s, t, u);
+	writeln(i, ' ', j, ' ', k, ' ', s)
+end;
+begin
+	a := 'foo';
+	b := 'bar';
+	p(1, 2, 3, concat(a, b));
+	q(1, 2, 3, 4, concat(a, b), concat(b, a, b));
+	r(a, 5, concat(b, b), 6, 7, concat('<', b, '>'));
+	writeln(a)
+end.
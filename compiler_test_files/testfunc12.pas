@@ -0,0 +1,76 @@
+program testfunc12;
+{ parameters that can stay in the registers they were passed in }
+var a:integer; b:integer; s:string; x:real;
+
+function scale(n:integer; r:real; f:real):real;
+begin
+	scale := n * r + f
+end;
+
+function quotient(p:integer; q:integer; d:integer):integer;
+begin
+	{ d is passed in RDX, which IDIV overwrites }
+	quotient := (p div d) + (q mod d) * d
+end;
+
+procedure show(n:integer; msg:string; m:integer);
+begin
+	{ msg is in RSI, and printing a string overwrites RSI }
+	writeln(msg, n);
+	writeln(msg, m)
+end;
+
+procedure bump(var v:integer; by:integer);
+begin
+	v := v + by
+end;
+
+procedure twice(var v:integer; by:integer);
+begin
+	{ the pointer in v is passed on, and by is read after the call }
+	bump(v, by);
+	bump(v, by)
+end;
+
+procedure addone(n:integer);
+begin
+	{ n has to be stored, because its address is passed to bump }
+	bump(n, 1);
+	writeln(n)
+end;
+
+function sum(n:integer; unused:integer):integer;
+begin
+	if n <= 0 then
+		sum := 0
+	else
+		sum := n + sum(n - 1, unused)
+end;
+
+function countdown(n:integer; step:integer):integer;
+var total:integer;
+begin
+	total := 0;
+	while n > 0 do
+	begin
+		total := total + n;
+		n := n - step
+	end;
+	countdown := total
+end;
+
+begin
+	x := 0.5;
+	writeln(scale(3, 2.5, x));
+	writeln(quotient(100, 17, 7));
+	writeln(quotient(-100, -17, 7));
+	s := 'value ';
+	show(4, s, 5);
+	a := 10;
+	twice(a, 3);
+	writeln(a);
+	addone(a);
+	writeln(a);
+	writeln(sum(10, 99));
+	writeln(countdown(10, 3))
+end.
@@ -0,0 +1,38 @@
+program testfunc13;
+{ registers saved around calls }
+var x:integer; y:integer;
+
+function add3(a:integer; b:integer; c:integer):integer;
+begin
+	add3 := a * 100 + b * 10 + c
+end;
+
+function mix(i:integer; r:real; s:real):real;
+begin
+	mix := i + r * s
+end;
+
+function twice(n:integer):integer;
+begin
+	{ n is needed after the call, which passes its first argument in RDI }
+	twice := add3(n, 1, 2) + n
+end;
+
+procedure report(n:integer; r:real);
+begin
+	{ n only has to be saved around the first call, it is not used after the second }
+	writeln(add3(1, 2, 3));
+	writeln(n);
+	writeln(mix(n, r, 2.0))
+end;
+
+begin
+	x := 4;
+	y := 7;
+	writeln(add3(x, add3(y, 1, 2), add3(1, x, y)));
+	writeln(add3(add3(1, 1, 1), add3(2, 2, 2), add3(3, 3, 3)));
+	writeln(mix(1, 2.0, mix(2, 1.5, 0.5)));
+	writeln(mix(add3(0, 0, 3), mix(1, 0.5, 2.0), 0.25));
+	writeln(twice(3));
+	report(5, 1.25)
+end.
@@ -0,0 +1,59 @@
+program testmath05;
+var a:integer; b:integer; c:integer; cnt:integer; x:real; y:real;
+
+function f(n:integer):integer;
+begin
+  cnt := cnt + 1;
+  f := n * 2 + cnt
+end;
+
+function g(r:real):real;
+begin
+  cnt := cnt + 1;
+  g := r / 2 + cnt
+end;
+
+function h(n:integer; k:integer):integer;
+var t:integer;
+begin
+  t := (n * k - (n div 3)) * ((n + 1) * (k - 2) + (n - k) * (n + k));
+  h := t mod 97
+end;
+
+procedure p(n:integer; var m:integer; r:real; var q:real);
+var l:integer; w:real;
+begin
+  l := (n + 3) * (n - 2) - (m * (n + m));
+  w := (r - q) * (r + q) / (q - 1.5);
+  writeln(l, ' ', w);
+  m := ((l div 7) - (n mod 4)) * ((m + l) - (n - 1));
+  q := (w + r) * ((q - w) - (r * 2)) - ((l + n) / 4);
+  writeln(m, ' ', q)
+end;
+
+begin
+  a := 17;
+  b := -5;
+  c := 7;
+  cnt := 0;
+  x := 2.5;
+  y := -1.25;
+  writeln(((a + b) * (a - b)) - ((a * c) - (b * c)) + ((a - c) * (b - c)));
+  writeln((((a + 1) * (b + 2)) * ((c + 3) * (a + 4))) - (((b + 5) * (c + 6)) * ((a + 7) * (b + 8))));
+  writeln(a div b, ' ', a mod b, ' ', b div 2, ' ', b mod 2, ' ', -17 div c, ' ', -17 mod c);
+  writeln((a * 100) div (b * c - 3), ' ', (a * 100) mod (b * c - 3));
+  writeln(100 - a, ' ', 100 - (a - b), ' ', (a - b) - 100);
+  writeln(f(a) + f(b) * f(c), ' ', cnt);
+  writeln((a + b) * f(c - a) - (f(a + b) - c), ' ', cnt);
+  writeln(h(a, b) + h(b, c) * (h(c, a) - h(a + b, c - b)));
+  writeln(((x + y) * (x - y)) / ((x * y) - (y / x)));
+  writeln((x + a) * (y - b) - (c / x) + (a - b) / y);
+  writeln(g(x) + g(y) * (x - g(a)), ' ', cnt);
+  writeln(1.5 - x, ' ', 10 - y, ' ', a - x);
+  if (a + b) * c > (a - b) * 2 then writeln('gt') else writeln('le');
+  if 3 < a then writeln('lt') else writeln('ge');
+  if (x * y) <= (y - x) then writeln('le') else writeln('gt');
+  if f(a) - f(b) = 2 * (a - b) then writeln('eq') else writeln('ne');
+  p(a, b, x, y);
+  writeln(a, ' ', b, ' ', x, ' ', y, ' ', cnt)
+end.
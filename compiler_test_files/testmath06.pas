@@ -0,0 +1,29 @@
+program testmath06;
+var a:integer; b:integer; cnt:integer; x:real;
+
+function f(n:integer):integer;
+begin
+  cnt := cnt + 1;
+  f := n
+end;
+
+begin
+  cnt := 0;
+  a := 37;
+  b := -37;
+  x := 1.5;
+  writeln(2 + 3 * 4, ' ', (7 - 10) * 6, ' ', 17 div 5, ' ', -17 div 5, ' ', 17 mod -5, ' ', -17 mod 5);
+  writeln(1.5 * 4, ' ', 1 / 4, ' ', 10 - 0.25, ' ', 3 + 2.5 * 2);
+  writeln(9223372036854775807 + 1, ' ', 4611686018427387904 * 4);
+  writeln(a + 0, ' ', 0 + a, ' ', a - 0, ' ', a * 1, ' ', 1 * a, ' ', a div 1, ' ', a mod 1, ' ', a * 0);
+  writeln(a * 8, ' ', 8 * b, ' ', a * 1024, ' ', b * 2);
+  writeln(a div 4, ' ', b div 4, ' ', a div 2, ' ', b div 2, ' ', b div 64, ' ', (b - 27) div 64);
+  writeln(a mod 4, ' ', b mod 4, ' ', a mod 2, ' ', b mod 2, ' ', (b - 27) mod 64, ' ', b mod 1024);
+  writeln(f(a) * 0, ' ', f(b) mod 1, ' ', cnt);
+  writeln((a * 4 + b div 8) - (a mod 16) * (b * 2));
+  writeln(x * 1, ' ', x + 0, ' ', x * (2 * 2));
+  if a div 4 = 9 then writeln('yes') else writeln('no');
+  while a mod 8 <> 0 do
+    a := a + 1;
+  writeln(a, ' ', a div 8)
+end.
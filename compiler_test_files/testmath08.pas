@@ -0,0 +1,32 @@
+program testmath08;
+{div and mod as later arguments, after an argument already loaded into RDX}
+var g: integer; h: integer; r: integer;
+procedure p(i: integer; j: integer; k: integer; m: integer);
+begin
+	writeln(i, ' ', j, ' ', k, ' ', m)
+end;
+procedure q(i: integer; j: integer; var k: integer; m: integer; n: integer);
+begin
+	k := k + m + n;
+	writeln(i, ' ', j, ' ', k, ' ', m, ' ', n)
+end;
+function f(a: integer; b: integer; c: integer; d: integer; e: integer): integer;
+begin
+	f := a + b * 10 + c * 100 + d * 1000 + e * 10000
+end;
+begin
+	g := 7;
+	h := 3;
+	r := 5;
+	p(1, 2, 3, g mod h);
+	p(1, 2, 3, g div h);
+	p(g, h, g div h, g mod h);
+	q(1, 2, r, g mod h, (g * 5) div (0 - h));
+	writeln(r);
+	q(1, 2, r, r mod (-4), r div 2);
+	writeln(r);
+	writeln(f(1, 2, g mod h, 4, (g + h) div h));
+	p(1, 2, f(1, 2, 3, g mod 4, g div h), h mod g);
+	p(1, 2, 3, (g * 10) mod f(1, 1, 0, 0, 0));
+	q(1, 2, r, g div f(2, 0, 0, 0, 0), (g * 10) div f(h, 0, 0, 0, 0))
+end.
@@ -0,0 +1,69 @@
+program testproc05;
+{byval String parameters, some only read and some changed, alongside changes to the Strings passed in}
+var g: string; h: string; n: integer;
+procedure show(a: string; b: string);
+begin
+	writeln(a, '/', b)
+end;
+procedure twice(a: string);
+begin
+	show(a, concat(a, a))
+end;
+procedure changeg(a: string);
+begin
+	g := 'changed';
+	writeln(a)
+end;
+procedure callschange(a: string);
+begin
+	changeg('x');
+	writeln(a)
+end;
+procedure local(a: string; b: string);
+begin
+	a := concat(a, '!');
+	writeln(a, b)
+end;
+procedure setref(var r: string);
+begin
+	r := 'set'
+end;
+procedure passref(a: string);
+begin
+	setref(a);
+	writeln(a)
+end;
+function len3(a: string; k: integer): integer;
+begin
+	if k > 0 then
+		len3 := len3(concat(a, 'z'), k - 1) + 1
+	else
+	begin
+		writeln(a);
+		len3 := 0
+	end
+end;
+procedure viaref(var r: string; a: string);
+begin
+	r := concat(a, '#');
+	writeln(a, r)
+end;
+begin
+	g := 'global';
+	h := 'hhh';
+	show(g, 'lit');
+	twice(g);
+	changeg(g);
+	g := 'again';
+	callschange(g);
+	writeln(g);
+	local(g, g);
+	writeln(g);
+	passref(g);
+	writeln(g);
+	n := len3(g, 4);
+	writeln(n);
+	viaref(g, g);
+	viaref(h, g);
+	writeln(g, h)
+end.
@@ -0,0 +1,55 @@
+program testproc06;
+{String locals and concat temps whose lifetimes do not overlap share stack slots}
+var g: string; h: string; n: integer;
+procedure steps(a: string; k: integer);
+var s: string; t: string; u: string; i: integer;
+begin
+	s := concat(a, '-one');
+	writeln(s);
+	t := concat(s, '-two');
+	writeln(t, '|', concat(t, '!'), '|', concat('[', t, ']'));
+	u := concat('u', a);
+	a := concat(a, u);
+	writeln(a, ' ', u);
+	i := 0;
+	while i < k do
+	begin
+		writeln(concat('loop ', u));
+		u := concat(u, '+');
+		i := i + 1
+	end;
+	writeln(u)
+end;
+procedure empties(k: integer);
+var s: string; t: string;
+begin
+	if k > 0 then
+		s := 'set';
+	writeln('[', s, ']');
+	t := concat(t, 'x');
+	writeln('[', t, ']')
+end;
+function count(a: string; k: integer): integer;
+var s: string;
+begin
+	s := concat(a, a);
+	if k > 0 then
+		count := count(s, k - 1) + 1
+	else
+	begin
+		writeln(s);
+		count := 0
+	end
+end;
+begin
+	g := 'main';
+	h := concat(g, '!');
+	writeln(concat(g, h), concat(h, g));
+	steps(g, 3);
+	writeln(g);
+	empties(1);
+	empties(0);
+	n := count('ab', 2);
+	writeln(n);
+	writeln(concat(h, h, h))
+end.
@@ -0,0 +1,25 @@
+program testrelop03;
+{greater and greater-or-equal are false when either Real operand is NaN, however the operands are evaluated}
+var x: real; y: real; z: real;
+function half(r: real): real;
+begin
+	half := r / 2.0
+end;
+begin
+	x := 0.0;
+	y := x / x;
+	z := 1.5;
+	if y > z then writeln('y > z') else writeln('not y > z');
+	if y >= z then writeln('y >= z') else writeln('not y >= z');
+	if z > y then writeln('z > y') else writeln('not z > y');
+	if z >= y then writeln('z >= y') else writeln('not z >= y');
+	if y > 1.0 then writeln('y > 1.0') else writeln('not y > 1.0');
+	if 1.0 >= y then writeln('1.0 >= y') else writeln('not 1.0 >= y');
+	if (y + 1.0) > (z * 2.0) then writeln('y + 1.0 > z * 2.0') else writeln('not y + 1.0 > z * 2.0');
+	if (z * 2.0) >= (y - 1.0) then writeln('z * 2.0 >= y - 1.0') else writeln('not z * 2.0 >= y - 1.0');
+	if half(y) > z then writeln('half(y) > z') else writeln('not half(y) > z');
+	if z > half(y) then writeln('z > half(y)') else writeln('not z > half(y)');
+	while y >= z do
+		y := z;
+	if z > x then writeln('z > x') else writeln('not z > x')
+end.
@@ -0,0 +1,14 @@
+program testwrite02;
+{test output larger than the runtime output buffer, including a single string wider than the space left in it}
+var i:integer; s:string;
+begin {main}
+  s := concat('0123456789012345678901234567890123456789012345678901234567890123456789', '01234567890123456789012345678901234567890123456789');
+  i := 1;
+  while i <= 60 do
+    begin
+      write(i, ': ');
+      writeln(s);
+      i := i + 1
+    end;
+  writeln('done')
+end.
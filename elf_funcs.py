@@ -0,0 +1,686 @@
+import re
+import struct
+import asm_funcs
+
+# Builds the object file for the generated code straight from an Assembler's lines: the instructions are encoded
+# to x86-64 machine code here and written out as an ELF64 relocatable object, so nothing has to be written out as
+# text and read back in by nasm.  Only the instructions and data definitions that the code generator emits are
+# covered; anything else raises ValueError.  The runtime objects are still assembled by nasm (and cached), and the
+# object links with them the same way the one nasm builds does.
+
+INT_REGISTERS = {"RAX": 0, "RCX": 1, "RDX": 2, "RBX": 3, "RSP": 4, "RBP": 5, "RSI": 6, "RDI": 7,
+				 "R8": 8, "R9": 9, "R10": 10, "R11": 11, "R12": 12, "R13": 13, "R14": 14, "R15": 15}
+XMM_REGISTERS = {"XMM" + str(i): i for i in range(16)}
+
+OPERAND_REGISTER = "register"
+OPERAND_XMM = "xmm"
+OPERAND_IMMEDIATE = "immediate"
+OPERAND_MEMORY = "memory"
+OPERAND_LABEL = "label"  # the address of a label used as a value, e.g. mov rdi, fredliteralstring0
+OPERAND_SIZES = ["BYTE", "QWORD"]
+
+LABEL_REGEX = re.compile(r"[A-Za-z_.][\w.]*$")
+MEMORY_REGEX = re.compile(r"\[\s*([A-Za-z_.][\w.]*)\s*(?:([+-])\s*(\d+))?\s*\]$")
+
+# The ModRM reg field (/digit) for each instruction that takes one.  The register forms of the arithmetic
+# instructions are digit * 8 + 1 (r/m64, r64) and digit * 8 + 3 (r64, r/m64).
+ARITHMETIC_OPCODES = {"ADD": 0, "OR": 1, "AND": 4, "SUB": 5, "XOR": 6, "CMP": 7}
+SHIFT_OPCODES = {"SHL": 4, "SAL": 4, "SHR": 5, "SAR": 7}
+UNARY_OPCODES = {"NOT": 2, "NEG": 3, "IDIV": 7}  # F7 /digit
+NO_OPERAND_OPCODES = {"CQO": b"\x48\x99", "RET": b"\xc3", "LEAVE": b"\xc9", "NOP": b"\x90"}
+
+# mandatory prefix, opcode for xmm, xmm/m and opcode for m, xmm (None if there is no store form)
+SSE_OPCODES = {"MOVSD": (0xF2, 0x10, 0x11), "MOVAPD": (0x66, 0x28, 0x29), "MOVDQU": (0xF3, 0x6F, 0x7F),
+			   "ADDSD": (0xF2, 0x58, None), "MULSD": (0xF2, 0x59, None), "SUBSD": (0xF2, 0x5C, None),
+			   "DIVSD": (0xF2, 0x5E, None), "SQRTSD": (0xF2, 0x51, None), "UCOMISD": (0x66, 0x2E, None),
+			   "COMISD": (0x66, 0x2F, None)}
+
+# the condition code in the low four bits of Jcc: 0x70 + cc for rel8, 0x0F 0x80 + cc for rel32
+CONDITION_CODES = {"JO": 0x0, "JNO": 0x1, "JB": 0x2, "JC": 0x2, "JNAE": 0x2, "JAE": 0x3, "JNB": 0x3, "JNC": 0x3,
+				   "JE": 0x4, "JZ": 0x4, "JNE": 0x5, "JNZ": 0x5, "JBE": 0x6, "JNA": 0x6, "JA": 0x7, "JNBE": 0x7,
+				   "JS": 0x8, "JNS": 0x9, "JP": 0xA, "JPE": 0xA, "JNP": 0xB, "JPO": 0xB, "JL": 0xC, "JNGE": 0xC,
+				   "JGE": 0xD, "JNL": 0xD, "JLE": 0xE, "JNG": 0xE, "JG": 0xF, "JNLE": 0xF}
+
+# the escapes nasm understands in a `backquoted` string, other than octal, hex and unicode
+BACKQUOTE_ESCAPES = {"'": 39, '"': 34, "`": 96, "\\": 92, "?": 63, "a": 7, "b": 8, "t": 9, "n": 10, "v": 11,
+					 "f": 12, "r": 13, "e": 27}
+
+R_X86_64_64 = 1
+R_X86_64_PLT32 = 4
+R_X86_64_32S = 11
+
+SECTION_TEXT = ".text"
+SECTION_DATA = ".data"
+SECTION_BSS = ".bss"
+SECTIONS = [SECTION_TEXT, SECTION_DATA, SECTION_BSS]
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHF_WRITE = 1
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_SECTION = 3
+
+# section name -> (type, flags, alignment), the same alignments nasm gives them
+SECTION_HEADERS = {SECTION_TEXT: (SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, 16),
+				   SECTION_DATA: (SHT_PROGBITS, SHF_WRITE | SHF_ALLOC, 4),
+				   SECTION_BSS: (SHT_NOBITS, SHF_WRITE | SHF_ALLOC, 4)}
+
+
+def fitsInt8(value):
+	return -128 <= value <= 127
+
+def fitsInt32(value):
+	return -2147483648 <= value <= 2147483647
+
+
+class Operand:
+	def __init__(self, kind, value = 0, base = None, label = None, size = None):
+		self.kind = kind
+		self.value = value  # register number, immediate value, or the displacement of a memory operand
+		self.base = base  # register number of the base of a memory operand, None if it is at a label
+		self.label = label  # for OPERAND_LABEL, and for a memory operand at a label
+		self.size = size  # "BYTE" or "QWORD" if the operand has a size, else None
+
+
+class Branch:
+	# A jump or call in the text section.  Its size is not known until the labels are placed, so it is kept
+	# apart from the encoded bytes around it.
+	def __init__(self, opcode, label):
+		self.opcode = opcode  # "JMP", "CALL", or a key of CONDITION_CODES
+		self.label = label
+		self.near = (opcode == "CALL")  # jumps start out short (rel8) and are made near (rel32) if they must be
+
+	def size(self):
+		if not self.near:
+			return 2
+		elif self.opcode in ["JMP", "CALL"]:
+			return 5
+		else:
+			return 6
+
+
+def decodeBackquotedString(s):
+	# s is the text between the backquotes.  Returns the bytes nasm assembles for it.
+	ret = bytearray()
+	i = 0
+	while i < len(s):
+		c = s[i]
+		i += 1
+		if c != "\\":
+			ret += c.encode()
+			continue
+		if i >= len(s): # pragma: no cover
+			raise ValueError("Unterminated escape in string: " + s)
+		c = s[i]
+		i += 1
+		if c in BACKQUOTE_ESCAPES:
+			ret.append(BACKQUOTE_ESCAPES[c])
+		elif c in "01234567":
+			j = i - 1
+			while i < len(s) and i - j < 3 and s[i] in "01234567":
+				i += 1
+			ret.append(int(s[j:i], 8) & 0xFF)
+		elif c in "xuU":
+			maxdigits = {"x": 2, "u": 4, "U": 8}[c]
+			j = i
+			while i < len(s) and i - j < maxdigits and s[i] in "0123456789abcdefABCDEF":
+				i += 1
+			if c == "x":
+				ret.append(int(s[j:i], 16) if i > j else 0)
+			else:
+				ret += chr(int(s[j:i], 16)).encode()
+		else:
+			ret += c.encode()
+	return bytes(ret)
+
+
+def parseDataItems(s):
+	# s is the operand of a db; returns its bytes.  Items are numbers or quoted strings, separated by commas.
+	ret = bytearray()
+	i = 0
+	while i < len(s):
+		c = s[i]
+		if c in " \t,":
+			i += 1
+		elif c == ";":
+			break
+		elif c == "`":
+			j = i + 1
+			while j < len(s) and s[j] != "`":
+				if s[j] == "\\":
+					j += 1
+				j += 1
+			if j >= len(s): # pragma: no cover
+				raise ValueError("Unterminated string: " + s)
+			ret += decodeBackquotedString(s[i+1:j])
+			i = j + 1
+		elif c in "'\"":
+			j = s.find(c, i + 1)
+			if j < 0: # pragma: no cover
+				raise ValueError("Unterminated string: " + s)
+			ret += s[i+1:j].encode()
+			i = j + 1
+		else:
+			j = i
+			while j < len(s) and not (s[j] in " \t,;"):
+				j += 1
+			value = int(s[i:j], 0)
+			if value < -128 or value > 255: # pragma: no cover
+				raise ValueError("Byte value out of range: " + s[i:j])
+			ret.append(value & 0xFF)
+			i = j
+	return bytes(ret)
+
+
+class ELFObjectWriter:
+	def __init__(self, assembler):
+		self.assembler = assembler
+		self.text = []  # bytes of encoded instructions, and Branches
+		self.textrelocations = []  # (position in self.text, offset in those bytes, relocation type, label, addend)
+		self.data = bytearray()
+		self.bsssize = 0
+		self.labels = {}  # label -> (section, offset).  Until the text is laid out, text offsets are positions in self.text
+		self.localsymbols = []  # labels that get a symbol table entry of their own, in the order they are defined
+		self.globals = []
+		self.externs = []
+		self.section = None
+		self.scope = ""  # the last label that did not start with a period; nasm puts .labels under it
+		self.operands = {}  # operand string -> Operand, see parse_operand()
+		self.encoders = {"MOV": self.encode_mov, "LEA": self.encode_lea, "IMUL": self.encode_imul,
+						 "XCHG": self.encode_xchg, "PUSH": self.encode_push_pop, "POP": self.encode_push_pop,
+						 "CVTSI2SD": self.encode_cvtsi2sd, "JMP": self.encode_branch, "CALL": self.encode_branch}
+		for opcode in ARITHMETIC_OPCODES:
+			self.encoders[opcode] = self.encode_arithmetic
+		for opcode in SHIFT_OPCODES:
+			self.encoders[opcode] = self.encode_shift
+		for opcode in UNARY_OPCODES:
+			self.encoders[opcode] = self.encode_unary
+		for opcode in NO_OPERAND_OPCODES:
+			self.encoders[opcode] = self.encode_no_operands
+		for opcode in SSE_OPCODES:
+			self.encoders[opcode] = self.encode_sse
+		for opcode in CONDITION_CODES:
+			self.encoders[opcode] = self.encode_branch
+
+	def qualify(self, label):
+		if label[0] == ".":
+			return self.scope + label
+		return label
+
+	def parse_operand(self, s):
+		# The same operands come up again and again, so each is only parsed once.  Not local labels, which depend
+		# on the label they are under.
+		ret = self.operands.get(s)
+		if ret is None:
+			ret = self.parse_new_operand(s)
+			if not ("." in s):
+				self.operands[s] = ret
+		return ret
+
+	def parse_new_operand(self, s):
+		size = None
+		parts = s.split(None, 1)
+		if len(parts) == 2 and parts[0].upper() in OPERAND_SIZES:
+			size = parts[0].upper()
+			s = parts[1].strip()
+		u = s.upper()
+		if u in INT_REGISTERS:
+			return Operand(OPERAND_REGISTER, INT_REGISTERS[u], size = size)
+		if u in XMM_REGISTERS:
+			return Operand(OPERAND_XMM, XMM_REGISTERS[u], size = size)
+		m = MEMORY_REGEX.match(s)
+		if m:
+			displacement = 0
+			if not (m.group(3) is None):
+				displacement = int(m.group(3))
+				if m.group(2) == "-":
+					displacement = -displacement
+			if not fitsInt32(displacement): # pragma: no cover
+				raise ValueError("Displacement out of range: " + s)
+			if m.group(1).upper() in INT_REGISTERS:
+				return Operand(OPERAND_MEMORY, displacement, base = INT_REGISTERS[m.group(1).upper()], size = size)
+			return Operand(OPERAND_MEMORY, displacement, label = self.qualify(m.group(1)), size = size)
+		try:
+			return Operand(OPERAND_IMMEDIATE, int(s), size = size)
+		except ValueError:
+			pass
+		if LABEL_REGEX.match(s):
+			return Operand(OPERAND_LABEL, label = self.qualify(s), size = size)
+		raise ValueError("Operand not supported: " + s)  # pragma: no cover
+
+	def emit(self, prefix, w, opcode, reg, rm, immediate = b"", relocation = None):
+		# Encodes [prefix] [REX] opcode ModRM [SIB] [displacement] [immediate].  reg is a register number or
+		# /digit for the ModRM reg field and rm is a register or memory Operand.  relocation is (type, label, addend)
+		# for a label's address in the immediate.
+		rex = 0x40 | (w << 3) | ((reg >> 3) << 2)
+		relocations = []
+		if rm.kind in [OPERAND_REGISTER, OPERAND_XMM]:
+			rex |= rm.value >> 3
+			modrm = bytes([0xC0 | ((reg & 7) << 3) | (rm.value & 7)])
+		elif rm.kind != OPERAND_MEMORY: # pragma: no cover
+			raise ValueError("Expected a register or memory operand")
+		elif rm.base is None:
+			# absolute address: SIB byte with no base and no index, then the address as disp32
+			modrm = bytes([0x04 | ((reg & 7) << 3), 0x25]) + b"\x00\x00\x00\x00"
+			relocations.append((2, R_X86_64_32S, rm.label, rm.value))
+		else:
+			rex |= rm.base >> 3
+			if rm.value == 0 and (rm.base & 7) != 5:  # RBP and R13 always need a displacement
+				mod = 0
+				displacement = b""
+			elif fitsInt8(rm.value):
+				mod = 1
+				displacement = struct.pack("<b", rm.value)
+			else:
+				mod = 2
+				displacement = struct.pack("<i", rm.value)
+			modrm = bytes([(mod << 6) | ((reg & 7) << 3) | (rm.base & 7)])
+			if (rm.base & 7) == 4:  # RSP and R12 always need a SIB byte
+				modrm += b"\x24"
+			modrm += displacement
+
+		ret = bytearray()
+		if not (prefix is None):
+			ret.append(prefix)
+		if rex != 0x40:
+			ret.append(rex)
+		ret += opcode
+		start = len(ret)
+		ret += modrm
+		for offset, reltype, label, addend in relocations:
+			self.textrelocations.append((len(self.text), start + offset, reltype, label, addend))
+		if not (relocation is None):
+			self.textrelocations.append((len(self.text), len(ret), relocation[0], relocation[1], relocation[2]))
+		ret += immediate
+		self.text.append(bytes(ret))
+
+	def emitbytes(self, b):
+		self.text.append(b)
+
+	def encode_arithmetic(self, opcode, operands, text):
+		dest, source = self.two_operands(operands, text)
+		digit = ARITHMETIC_OPCODES[opcode]
+		if source.kind == OPERAND_IMMEDIATE and dest.kind in [OPERAND_REGISTER, OPERAND_MEMORY]:
+			if fitsInt8(source.value):
+				self.emit(None, 1, b"\x83", digit, dest, struct.pack("<b", source.value))
+			elif fitsInt32(source.value):
+				self.emit(None, 1, b"\x81", digit, dest, struct.pack("<i", source.value))
+			else: # pragma: no cover
+				raise ValueError("Immediate out of range: " + text)
+		elif source.kind == OPERAND_REGISTER and dest.kind in [OPERAND_REGISTER, OPERAND_MEMORY]:
+			self.emit(None, 1, bytes([digit * 8 + 1]), source.value, dest)
+		elif dest.kind == OPERAND_REGISTER and source.kind == OPERAND_MEMORY:
+			self.emit(None, 1, bytes([digit * 8 + 3]), dest.value, source)
+		else: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+
+	def encode_mov(self, opcode, operands, text):
+		dest, source = self.two_operands(operands, text)
+		if dest.kind == OPERAND_REGISTER and source.kind == OPERAND_REGISTER:
+			self.emit(None, 1, b"\x89", source.value, dest)
+		elif dest.kind == OPERAND_REGISTER and source.kind == OPERAND_MEMORY:
+			self.emit(None, 1, b"\x8b", dest.value, source)
+		elif dest.kind == OPERAND_MEMORY and source.kind == OPERAND_REGISTER:
+			self.emit(None, 1, b"\x89", source.value, dest)
+		elif dest.kind == OPERAND_REGISTER and source.kind == OPERAND_IMMEDIATE:
+			# like nasm, the shortest of mov r32, imm32 (zero extended), mov r/m64, imm32 (sign extended) and mov r64, imm64
+			rex = 0x41 if dest.value >= 8 else None
+			if 0 <= source.value <= 0xFFFFFFFF:
+				self.emitbytes((bytes([rex]) if rex else b"") + bytes([0xB8 + (dest.value & 7)]) + struct.pack("<I", source.value))
+			elif fitsInt32(source.value):
+				self.emit(None, 1, b"\xc7", 0, dest, struct.pack("<i", source.value))
+			elif -0x8000000000000000 <= source.value <= 0xFFFFFFFFFFFFFFFF:
+				self.emitbytes(bytes([0x48 | (dest.value >> 3), 0xB8 + (dest.value & 7)]) + struct.pack("<Q", source.value & 0xFFFFFFFFFFFFFFFF))
+			else: # pragma: no cover
+				raise ValueError("Immediate out of range: " + text)
+		elif dest.kind == OPERAND_REGISTER and source.kind == OPERAND_LABEL:
+			# mov r64, imm64 with the label's address
+			self.textrelocations.append((len(self.text), 2, R_X86_64_64, source.label, 0))
+			self.emitbytes(bytes([0x48 | (dest.value >> 3), 0xB8 + (dest.value & 7)]) + b"\x00" * 8)
+		elif dest.kind == OPERAND_MEMORY and source.kind == OPERAND_IMMEDIATE:
+			size = dest.size or source.size
+			if size == "BYTE" and -128 <= source.value <= 255:
+				self.emit(None, 0, b"\xc6", 0, dest, bytes([source.value & 0xFF]))
+			elif size == "QWORD" and fitsInt32(source.value):
+				self.emit(None, 1, b"\xc7", 0, dest, struct.pack("<i", source.value))
+			else: # pragma: no cover
+				raise ValueError("Instruction not supported: " + text)
+		else: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+
+	def encode_lea(self, opcode, operands, text):
+		dest, source = self.two_operands(operands, text)
+		if dest.kind != OPERAND_REGISTER or source.kind != OPERAND_MEMORY: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		self.emit(None, 1, b"\x8d", dest.value, source)
+
+	def encode_imul(self, opcode, operands, text):
+		if len(operands) == 2:
+			operands = [operands[0]] + operands
+		if len(operands) != 3: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		dest, source, immediate = [self.parse_operand(x) for x in operands]
+		if dest.kind != OPERAND_REGISTER or not (source.kind in [OPERAND_REGISTER, OPERAND_MEMORY]): # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		if immediate.kind in [OPERAND_REGISTER, OPERAND_MEMORY] and source.kind == OPERAND_REGISTER and source.value == dest.value:
+			# the two operand form, imul r64, r/m64
+			self.emit(None, 1, b"\x0f\xaf", dest.value, immediate)
+		elif immediate.kind == OPERAND_IMMEDIATE and fitsInt8(immediate.value):
+			self.emit(None, 1, b"\x6b", dest.value, source, struct.pack("<b", immediate.value))
+		elif immediate.kind == OPERAND_IMMEDIATE and fitsInt32(immediate.value):
+			self.emit(None, 1, b"\x69", dest.value, source, struct.pack("<i", immediate.value))
+		else: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+
+	def encode_xchg(self, opcode, operands, text):
+		first, second = self.two_operands(operands, text)
+		if first.kind == OPERAND_REGISTER and second.kind in [OPERAND_REGISTER, OPERAND_MEMORY]:
+			self.emit(None, 1, b"\x87", first.value, second)
+		elif second.kind == OPERAND_REGISTER and first.kind == OPERAND_MEMORY:
+			self.emit(None, 1, b"\x87", second.value, first)
+		else: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+
+	def encode_shift(self, opcode, operands, text):
+		dest, count = self.two_operands(operands, text)
+		if not (dest.kind in [OPERAND_REGISTER, OPERAND_MEMORY]) or count.kind != OPERAND_IMMEDIATE or not (0 <= count.value <= 255): # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		if count.value == 1:
+			self.emit(None, 1, b"\xd1", SHIFT_OPCODES[opcode], dest)
+		else:
+			self.emit(None, 1, b"\xc1", SHIFT_OPCODES[opcode], dest, bytes([count.value]))
+
+	def encode_unary(self, opcode, operands, text):
+		if len(operands) != 1: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		operand = self.parse_operand(operands[0])
+		self.emit(None, 1, b"\xf7", UNARY_OPCODES[opcode], operand)
+
+	def encode_no_operands(self, opcode, operands, text):
+		if len(operands) != 0: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		self.emitbytes(NO_OPERAND_OPCODES[opcode])
+
+	def encode_push_pop(self, opcode, operands, text):
+		if len(operands) != 1: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		operand = self.parse_operand(operands[0])
+		if operand.kind != OPERAND_REGISTER: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		base = 0x50 if opcode == "PUSH" else 0x58
+		if operand.value >= 8:
+			self.emitbytes(bytes([0x41, base + (operand.value & 7)]))
+		else:
+			self.emitbytes(bytes([base + operand.value]))
+
+	def encode_sse(self, opcode, operands, text):
+		dest, source = self.two_operands(operands, text)
+		prefix, loadopcode, storeopcode = SSE_OPCODES[opcode]
+		if dest.kind == OPERAND_XMM and source.kind in [OPERAND_XMM, OPERAND_MEMORY]:
+			self.emit(prefix, 0, bytes([0x0F, loadopcode]), dest.value, source)
+		elif dest.kind == OPERAND_MEMORY and source.kind == OPERAND_XMM and not (storeopcode is None):
+			self.emit(prefix, 0, bytes([0x0F, storeopcode]), source.value, dest)
+		else: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+
+	def encode_cvtsi2sd(self, opcode, operands, text):
+		dest, source = self.two_operands(operands, text)
+		if dest.kind != OPERAND_XMM or not (source.kind in [OPERAND_REGISTER, OPERAND_MEMORY]): # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		self.emit(0xF2, 1, b"\x0f\x2a", dest.value, source)
+
+	def encode_branch(self, opcode, operands, text):
+		if len(operands) != 1: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		operand = self.parse_operand(operands[0])
+		if operand.kind != OPERAND_LABEL: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		self.text.append(Branch(opcode, operand.label))
+
+	def two_operands(self, operands, text):
+		if len(operands) != 2: # pragma: no cover
+			raise ValueError("Instruction not supported: " + text)
+		return (self.parse_operand(operands[0]), self.parse_operand(operands[1]))
+
+	def define_label(self, label):
+		if label[0] != ".":
+			self.scope = label
+		label = self.qualify(label)
+		if label in self.labels: # pragma: no cover
+			raise ValueError("Label defined twice: " + label)
+		if self.section == SECTION_TEXT:
+			self.labels[label] = (SECTION_TEXT, len(self.text))
+		elif self.section == SECTION_DATA:
+			self.labels[label] = (SECTION_DATA, len(self.data))
+		elif self.section == SECTION_BSS:
+			self.labels[label] = (SECTION_BSS, self.bsssize)
+		else: # pragma: no cover
+			raise ValueError("Label outside of a section: " + label)
+		if label[0] != ".":
+			self.localsymbols.append(label)
+
+	def encode_data_line(self, line):
+		# label resq count, label resb count, label dq real, or label db items
+		parts = line.text.strip().split(None, 2)
+		if len(parts) != 3: # pragma: no cover
+			raise ValueError("Data definition not supported: " + line.text)
+		label, directive, operand = parts
+		self.define_label(label)
+		directive = directive.lower()
+		if directive == "resq" and self.section == SECTION_BSS:
+			self.bsssize += 8 * int(operand.split(";")[0])
+		elif directive == "resb" and self.section == SECTION_BSS:
+			self.bsssize += int(operand.split(";")[0])
+		elif directive == "dq" and self.section == SECTION_DATA:
+			self.data += struct.pack("<d", float(operand.split(";")[0]))
+		elif directive == "db" and self.section == SECTION_DATA:
+			self.data += parseDataItems(operand)
+		else: # pragma: no cover
+			raise ValueError("Data definition not supported: " + line.text)
+
+	def encode_lines(self):
+		for line in self.assembler.lines:
+			if line.kind == asm_funcs.ASMLINE_COMMENT:
+				continue
+			elif line.kind == asm_funcs.ASMLINE_RAW:
+				parts = line.text.split()
+				if len(parts) == 2 and parts[0].lower() == "section" and parts[1] in SECTIONS:
+					self.section = parts[1]
+				else: # pragma: no cover
+					raise ValueError("Directive not supported: " + line.text)
+			elif line.kind == asm_funcs.ASMLINE_LABEL:
+				self.define_label(line.opcode)
+			elif line.opcode == "GLOBAL":
+				self.globals.extend(line.operands)
+			elif line.opcode == "EXTERN":
+				for name in line.operands:
+					if not (name in self.externs):
+						self.externs.append(name)
+			elif self.section in [SECTION_DATA, SECTION_BSS]:
+				self.encode_data_line(line)
+			elif self.section != SECTION_TEXT: # pragma: no cover
+				raise ValueError("Instruction outside of the text section: " + line.text)
+			elif line.opcode in self.encoders:
+				self.encoders[line.opcode](line.opcode, line.operands, line.text)
+			else: # pragma: no cover
+				raise ValueError("Instruction not supported: " + line.text)
+
+	def layout_text(self):
+		# Every jump starts out short.  Any whose target is out of reach is made near, which can push other targets
+		# out of reach, so repeat until nothing changes.  Jumps only ever grow, so this ends.
+		positions = {}
+		for label, (section, position) in self.labels.items():
+			if section == SECTION_TEXT:
+				positions.setdefault(position, []).append(label)
+		while True:
+			offsets = []
+			offset = 0
+			for item in self.text:
+				offsets.append(offset)
+				if type(item) is Branch:
+					offset += item.size()
+				else:
+					offset += len(item)
+			offsets.append(offset)
+			changed = False
+			for i in range(len(self.text)):
+				item = self.text[i]
+				if type(item) is Branch and not item.near:
+					target = self.labels.get(item.label)
+					if target is None or target[0] != SECTION_TEXT or not fitsInt8(offsets[target[1]] - offsets[i] - 2):
+						item.near = True
+						changed = True
+			if not changed:
+				break
+		return offsets
+
+	def assemble_text(self):
+		offsets = self.layout_text()
+		text = bytearray()
+		relocations = []  # (offset, relocation type, label, addend)
+		for i in range(len(self.text)):
+			item = self.text[i]
+			if type(item) is Branch:
+				if item.opcode == "CALL":
+					opcode = b"\xe8"
+				elif item.opcode == "JMP":
+					opcode = b"\xe9" if item.near else b"\xeb"
+				elif item.near:
+					opcode = bytes([0x0F, 0x80 + CONDITION_CODES[item.opcode]])
+				else:
+					opcode = bytes([0x70 + CONDITION_CODES[item.opcode]])
+				end = offsets[i] + item.size()
+				target = self.labels.get(item.label)
+				if not (target is None) and target[0] == SECTION_TEXT:
+					displacement = offsets[target[1]] - end
+					text += opcode + (struct.pack("<i", displacement) if item.near else struct.pack("<b", displacement))
+				elif target is None and item.label in self.externs:
+					relocations.append((offsets[i] + len(opcode), R_X86_64_PLT32, item.label, -4))
+					text += opcode + b"\x00\x00\x00\x00"
+				else: # pragma: no cover
+					raise ValueError("Cannot jump to: " + item.label)
+			else:
+				text += item
+		for position, offset, reltype, label, addend in self.textrelocations:
+			relocations.append((offsets[position] + offset, reltype, label, addend))
+		# now that the text is laid out, its labels are offsets too
+		for label, (section, position) in self.labels.items():
+			if section == SECTION_TEXT:
+				self.labels[label] = (SECTION_TEXT, offsets[position])
+		return (bytes(text), relocations)
+
+	def build(self):
+		# Returns the bytes of the object file
+		self.encode_lines()
+		text, relocations = self.assemble_text()
+
+		strtab = bytearray(b"\x00")
+		def addstring(table, s):
+			ret = len(table)
+			table += s.encode() + b"\x00"
+			return ret
+
+		sectionindex = {SECTION_TEXT: 1, SECTION_DATA: 2, SECTION_BSS: 3}
+		# the null symbol, a symbol for each section, the local labels, then the global and external ones
+		symbols = [struct.pack("<IBBHQQ", 0, 0, 0, 0, 0, 0)]
+		symbolindex = {}
+		for section in SECTIONS:
+			symbols.append(struct.pack("<IBBHQQ", 0, (STB_LOCAL << 4) | STT_SECTION, 0, sectionindex[section], 0, 0))
+		for label in self.localsymbols:
+			if not (label in self.globals):
+				section, offset = self.labels[label]
+				symbolindex[label] = len(symbols)
+				symbols.append(struct.pack("<IBBHQQ", addstring(strtab, label), (STB_LOCAL << 4) | STT_NOTYPE, 0, sectionindex[section], offset, 0))
+		firstglobal = len(symbols)
+		for label in self.globals:
+			if not (label in self.labels): # pragma: no cover
+				raise ValueError("Global label is not defined: " + label)
+			section, offset = self.labels[label]
+			symbolindex[label] = len(symbols)
+			symbols.append(struct.pack("<IBBHQQ", addstring(strtab, label), (STB_GLOBAL << 4) | STT_NOTYPE, 0, sectionindex[section], offset, 0))
+		for label in self.externs:
+			if not (label in self.labels):
+				symbolindex[label] = len(symbols)
+				symbols.append(struct.pack("<IBBHQQ", addstring(strtab, label), (STB_GLOBAL << 4) | STT_NOTYPE, 0, 0, 0, 0))
+
+		rela = bytearray()
+		for offset, reltype, label, addend in relocations:
+			if label in self.labels and not (label in self.globals):
+				# against the section, like gas does for local labels
+				section, labeloffset = self.labels[label]
+				symbol = 1 + SECTIONS.index(section)
+				addend += labeloffset
+			elif label in symbolindex:
+				symbol = symbolindex[label]
+			else: # pragma: no cover
+				raise ValueError("Undefined label: " + label)
+			rela += struct.pack("<QQq", offset, (symbol << 32) | reltype, addend)
+
+		shstrtab = bytearray(b"\x00")
+		# name, type, flags, contents (None for .bss), size, link, info, alignment, entry size
+		sections = [(SECTION_TEXT, text, len(text), 0, 0, 0),
+					(SECTION_DATA, bytes(self.data), len(self.data), 0, 0, 0),
+					(SECTION_BSS, None, self.bsssize, 0, 0, 0),
+					(".symtab", b"".join(symbols), 24 * len(symbols), 5, firstglobal, 24),
+					(".strtab", bytes(strtab), len(strtab), 0, 0, 0),
+					(".rela.text", bytes(rela), len(rela), 4, 1, 24),
+					(".note.GNU-stack", b"", 0, 0, 0, 0)]  # empty, so the linker knows the stack need not be executable
+		headers = [b"\x00" * 64]
+		body = bytearray()
+		position = 64
+		for name, contents, size, link, info, entsize in sections:
+			if name in SECTION_HEADERS:
+				shtype, flags, alignment = SECTION_HEADERS[name]
+			elif name == ".symtab":
+				shtype, flags, alignment = SHT_SYMTAB, 0, 8
+			elif name == ".strtab":
+				shtype, flags, alignment = SHT_STRTAB, 0, 1
+			elif name == ".rela.text":
+				shtype, flags, alignment = SHT_RELA, 0, 8
+			else:
+				shtype, flags, alignment = SHT_PROGBITS, 0, 1
+			while (position + len(body)) % alignment != 0:
+				body.append(0)
+			offset = position + len(body)
+			if not (contents is None):
+				body += contents
+			headers.append(struct.pack("<IIQQQQIIQQ", addstring(shstrtab, name), shtype, flags, 0, offset, size, link, info, alignment, entsize))
+		shstrtabname = addstring(shstrtab, ".shstrtab")
+		offset = position + len(body)
+		body += shstrtab
+		headers.append(struct.pack("<IIQQQQIIQQ", shstrtabname, SHT_STRTAB, 0, 0, offset, len(shstrtab), 0, 0, 1, 0))
+		while (position + len(body)) % 8 != 0:
+			body.append(0)
+		sectionheaderoffset = position + len(body)
+
+		ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + b"\x00" * 8  # 64 bit, little endian, version 1, System V
+		header = struct.pack("<16sHHIQQQIHHHHHH", ident, 1, 62, 1, 0, 0, sectionheaderoffset, 0, 64, 0, 0, 64, len(headers), len(headers) - 1)
+		return header + bytes(body) + b"".join(headers)
+
+	def write(self, obj_filename):
+		obj_file = open(obj_filename, "wb")
+		obj_file.write(self.build())
+		obj_file.close()
+
+
+class Compiler:
+	# Takes the place of asm_funcs.Compiler: the object comes from the Assembler's lines instead of the .asm file.
+	def __init__(self, assembler, obj_filename, runtime_cache = None, runtime_directory = "."):
+		self.assembler = assembler
+		self.obj_filename = obj_filename
+		if runtime_cache is None:
+			runtime_cache = asm_funcs.DEFAULT_RUNTIME_CACHE
+		self.runtime_cache = runtime_cache
+		self.runtime_directory = runtime_directory
+		self.runtime_obj_filenames = None
+
+	def do_compile(self):
+		self.runtime_obj_filenames = self.runtime_cache.fetch_all(self.runtime_directory)
+		ELFObjectWriter(self.assembler).write(self.obj_filename)
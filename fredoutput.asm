@@ -0,0 +1,152 @@
+;----------
+;
+;   fredoutput.asm
+;   copyright 2018 M. "Fred" Fredericks
+;   All Rights Reserved
+;   buffered stdout for the Fred compiler
+;
+;----------
+
+%define FREDOUTPUTBUFFERSIZE 4096
+
+global bufferedwrite
+global flushoutput
+global fredoutputlinebuffered
+
+section .data
+
+; 0 = flush only when the buffer is full or flushoutput is called
+; 1 = also flush after any write that contains a newline
+fredoutputlinebuffered db 0
+
+section .bss
+
+fredoutputbuffer resb FREDOUTPUTBUFFERSIZE
+fredoutputlength resq 1
+
+section .text
+
+;----------
+;   All output to stdout goes through a single buffer, so a program that writes many small items makes one
+;   write syscall per FREDOUTPUTBUFFERSIZE bytes instead of one per item.  The compiler emits a call to
+;   flushoutput before the program exits; anything that exits some other way must call flushoutput first.
+;----------
+
+
+;----------
+;
+;   bufferedwrite
+;       - appends bytes to the stdout buffer, flushing the buffer first if they do not fit
+;----------
+; RDI: Address of the bytes
+; RSI: Number of bytes
+;----------
+; Returns: None.  All registers are preserved, same as prtstr in nsm64.
+;----------
+bufferedwrite:
+    push rdi
+    push rsi
+    push rdx
+    push rax
+    push rcx
+    push r11
+
+    mov rdx, [fredoutputlength]
+    mov rax, FREDOUTPUTBUFFERSIZE
+    sub rax, rdx ; rax = space left in the buffer
+    cmp rsi, rax
+    jbe .copy
+    call flushoutput
+    xor rdx, rdx
+    cmp rsi, FREDOUTPUTBUFFERSIZE
+    jb .copy
+
+    ; too large to ever fit in the buffer, so write it directly.  The buffer was just flushed so order is kept.
+    mov rdx, rsi
+    mov rsi, rdi
+    call writestdout
+    jmp .done
+
+.copy:
+    ; RDX has the current length of the buffer
+    mov rcx, rsi
+    mov r11, rsi ; preserve the count for the newline scan
+    mov rsi, rdi
+    lea rdi, [fredoutputbuffer + rdx]
+    add rdx, rcx
+    mov [fredoutputlength], rdx
+    cld
+    rep movsb
+
+    cmp byte [fredoutputlinebuffered], 0
+    je .done
+    ; line-buffered: flush if any of the bytes just copied is a newline
+    sub rdi, r11 ; rdi points to the first byte copied
+    mov rcx, r11
+    mov al, 10
+    repne scasb
+    jne .done
+    call flushoutput
+
+.done:
+    pop r11
+    pop rcx
+    pop rax
+    pop rdx
+    pop rsi
+    pop rdi
+    ret
+
+;----------
+;
+;   flushoutput
+;       - writes everything in the stdout buffer and empties it
+;----------
+; No input arguments needed
+;----------
+; Returns: None.  All registers are preserved.
+;----------
+flushoutput:
+    push rdi
+    push rsi
+    push rdx
+    push rax
+    push rcx
+    push r11
+
+    mov rdx, [fredoutputlength]
+    mov rsi, fredoutputbuffer
+    call writestdout
+    mov qword [fredoutputlength], 0
+
+    pop r11
+    pop rcx
+    pop rax
+    pop rdx
+    pop rsi
+    pop rdi
+    ret
+
+;----------
+;
+;   writestdout
+;       - write syscall to stdout, repeated until all bytes are written
+;----------
+; RSI: Address of the bytes
+; RDX: Number of bytes
+;----------
+; Returns: None.  Trashes RDI, RSI, RDX, RAX, RCX and R11.
+;----------
+writestdout:
+    test rdx, rdx
+    jz .done
+    mov edi, 1 ; stdout
+    mov eax, 1 ; write
+    syscall
+    test rax, rax
+    jle .done ; nothing sensible to do if stdout is gone, so drop the output
+    add rsi, rax
+    sub rdx, rax
+    jmp writestdout
+.done:
+    ret
@@ -14,22 +14,17 @@ extern newline  ; from nsm64
 extern exit     ; from nsm64
 extern prtdec   ; from nsm64
 extern prtstrz  ; from nsm64
-extern malloc  ; from libc
-extern free    ; from libc
+extern flushoutput ; from fredoutput
 
 
-global newstring
-global freestring
 global printstring
 global stringlength
-global stringconcatstring
+global concatstrings
 global copystring
 
 section .data
 
-fred_err_malloc_failed db "Memory allocation failed",0
 fred_err_str_too_large db "Maximum string length exceeded",0 
-fred_err_invalid_size  db "Invalid string size",0
 
 
 
@@ -41,45 +36,6 @@ fred_err_invalid_size  db "Invalid string size",0
 ;----------   
 
 
-;----------
-;
-;   newstring
-;       - allocates memory for a string, returns an "empty" string of length 0
-;----------
-; No input arguments needed
-;----------
-; Returns: Address of the new String in RAX
-;----------
-newstring:
-    mov rdi, FREDSTRINGSIZE + 1
-    call malloc
-    ; if malloc fails, rax will be 0
-    test rax, rax
-    je .err1
-    ; length of the string goes in first byte, so we zero that out.
-    mov [rax], byte 0  
-    ret
-.err1:
-    mov rdi, fred_err_malloc_failed
-    call prtstrz
-    call newline
-    call exit    
-
-;----------
-;
-;   freestring
-;       - deallocates memory for a string
-;
-;----------
-; RDI: Address of the String
-;----------
-; Returns: None
-;----------
-freestring:
-    call free  ; RDI already points to the string to be freed
-    ret
-
-
 ;----------
 ;
 ;   printstring
@@ -115,53 +71,91 @@ stringlength:
 
 ;----------
 ;
-;   stringconcatstring
-;       - appends second String to first String
+;   concatstrings
+;       - sets the first String to the concatenation of a list of Strings
 ;
 ;----------
-; RDI: Address of the first String
-; RSI: Address of the second String
+; RDI: Address of the destination String
+; RSI: Address of the list of String addresses.  The list is built by pushing the addresses in order, so the
+;      last String is at [RSI] and the first is at [RSI + 8*(RDX-1)]
+; RDX: Number of Strings in the list, at least 1
+;----------
+; Returns: RAX contains the address of the destination String
 ;----------
-; Returns: None.  However, the String pointed to by RDI will be modified.
+; Notes: The destination may also be the first String in the list, which is then appended to.  It must not be
+;        any of the others.
 ;----------
 
-stringconcatstring:
+concatstrings:
+    ; RAX - position in the list, counting down from RDX
     ; R9 - length of new string
-    ; RDX - length of first string (original)
-    ; RCX - length of second string
-    
-    ; ensure length of combined string will not exceed the max
-    xor rcx,rcx
-    xor rdx,rdx
+    ; RCX - length of the String being copied
+    ; R8 - next byte of the String being copied
+    ; R11 - next byte of the new string
+    ; RDX - 8 bytes on their way from R8 to R11
+
+    ; add up the lengths first, so the max is only checked once
     xor r9,r9
-    mov r9b, byte [RDI]
-    mov dl, r9b ; save length of first string into low bits of rdx
-    mov cl, byte [RSI]
+    xor rcx,rcx
+    mov rax, rdx
+.addlength:
+    mov r8, [rsi + rax*8 - 8]
+    mov cl, byte [r8]
     add r9, rcx
+    dec rax
+    jnz .addlength
     cmp r9, FREDSTRINGSIZE
-    jg .err1    
-
-    push rdi ; movsb uses rdi as the destination, so we need to preserve RDI so we can update it at the end.
-    inc rdi ; rdi now points to first actual byte of the string
-    add rdi, rdx  ; rdi now points to the first byte after end of the string
-    inc rsi; rsi now points to the first actual byte of the second string
-    ; rcx from above has number of characters to copy, needed for REP to work  
-    cld
-    rep movsb
-    
-    pop rdi ; get rdi back to pointing to the first string
-    ; update the length of the first string to be the combined length
-    mov byte [rdi], r9b    
-
-.done:
+    jg .err1
+
+    mov rax, rdx
+    lea r11, [rdi + 1]
+.nextstring:
+    mov r8, [rsi + rax*8 - 8]
+    mov cl, byte [r8]
+    inc r8 ; r8 now points to first actual byte of the string
+    cmp r8, r11
+    je .copied ; this String is the destination, so it is already in place
+    cmp rcx, 8
+    jae .copyqwords
+    test rcx, rcx
+    jz .donestring
+.copybyte:
+    mov dl, byte [r8]
+    mov byte [r11], dl
+    inc r8
+    inc r11
+    dec rcx
+    jnz .copybyte
+    jmp .donestring
+.copyqwords:
+    mov rdx, [r8]
+    mov [r11], rdx
+    add r8, 8
+    add r11, 8
+    sub rcx, 8
+    cmp rcx, 8
+    jae .copyqwords
+    ; fewer than 8 bytes are left.  Copying the last 8 bytes of the String again finishes it without
+    ; reading or writing past the end of either string.
+    mov rdx, [r8 + rcx - 8]
+    mov [r11 + rcx - 8], rdx
+.copied:
+    add r11, rcx
+.donestring:
+    dec rax
+    jnz .nextstring
+
+    mov byte [rdi], r9b
+    mov rax, rdi
     ret
-.err1:                
+.err1:
     mov rdi, fred_err_str_too_large
     call prtstrz
     call newline
-    call exit  
+    call flushoutput
+    call exit
+
 
-        
 ;----------
 ;
 ;   copystring
@@ -25,6 +25,10 @@
 ;and enable this line below
 %include 'nobjlist.inc'
 
+;Fred note - prtreg, prtstr, prtstrz and prtchr write into the stdout buffer in
+;fredoutput.asm instead of making a write syscall for each call.
+extern bufferedwrite
+
 ;Compile: nasm -f elf64 nsm64.asm -o nsm64.o
 ;---------------------------------------------
 
@@ -84,11 +88,9 @@ prtreg:
 	rol 	rsi,4	
 	loop 	.begin	
 .disp:
-	mov		rdx,16 			;Size
-	lea		rsi,[rbp-16]	;Address of string
-	mov 	edi,1			;stdout
-	mov 	eax,1			;sys_write
-	syscall
+	lea		rdi,[rbp-16]	;Address of string
+	mov		esi,16 			;Size
+	call	bufferedwrite
 	pop		rdx
 	pop 	rsi 
 	pop 	rcx	
@@ -1291,22 +1293,7 @@ prtflt:
 ;RETN	: -
 ;------------------------------------------------
 prtstr:	
-	push	rdi 
-	push	rsi 
-	push	rdx 
-	push	rax 
-	push	rcx
-	mov		rdx,rsi ;size
-	mov		rsi,rdi	;address
-	mov 	edi,1	;stdout
-	mov 	eax,edi	;write
-	syscall
-	pop		rcx 
-	pop 	rax 
-	pop 	rdx 
-	pop 	rsi 
-	pop 	rdi
-	ret
+	jmp		bufferedwrite	;same arguments, preserves all registers
 ;------------------------------------------------
 ;#14	: prtstrz(1)
 ;OBJ	: Display 0-ended string
@@ -1330,9 +1317,9 @@ prtstrz:
 	repne	scasb
 	mov		rdx,-2
 	sub		rdx,rcx
-	mov		edi,1
-	mov		eax,1
-	syscall
+	mov		rdi,rsi	;address
+	mov		rsi,rdx	;size
+	call	bufferedwrite
 	pop		rdi
 	pop 	rcx 
 	pop 	rax 
@@ -1367,23 +1354,15 @@ prtchar:
 ;RETN	: 
 ;--------------------------------
 prtchr:
-	push	rcx
-	push	r11
 	push	rdi
 	push	rsi
-	push	rdx
 	push 	rax
-	mov 	edx,1
-	mov 	rsi,rsp
-	mov 	edi,edx
-	mov 	eax,edx
-	syscall
+	mov 	rdi,rsp	;address of the character
+	mov 	esi,1	;size
+	call	bufferedwrite
 	pop		rax
-	pop		rdx
 	pop		rsi
 	pop		rdi
-	pop		r11
-	pop		rcx
 	ret
 ;------------------------------------------------
 ;#17	: getch(0)/AL